@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Reading non-JSON files from a page, through a script or /api/file.
+#
+# Starts the server in a child process and measures the latency of
+# reading a log file whole and its last 4 KB, with a shell script that
+# cats the file (a process per read) and with /api/file?format=text.
+#
+# Usage: python3 benchmarks/file_reads.py [--requests N] [--backend threaded|asyncio]
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'bigbashview', 'usr', 'lib')
+
+SCENARIOS = (
+    ('whole file, script', '/execute$' + quote('./read.sh')),
+    ('whole file, api', '/api/file?format=text&filename=app.log'),
+    ('last 4 KB, script', '/execute$' + quote('./tail.sh')),
+    ('last 4 KB, api', '/api/file?format=text&offset=-4096&filename=app.log'),
+)
+
+
+def serve(backend, directory):
+    sys.path.insert(0, LIB_DIR)
+    os.chdir(directory)
+    from bbv import globaldata
+    from bbv.server.bbv2server import run_server
+    globaldata.BACKEND = backend
+    run_server()
+    print('PORT', globaldata.PORT, flush=True)
+    # Serve until the benchmark closes our stdin
+    sys.stdin.read()
+    os._exit(0)
+
+
+def create_app(directory):
+    with open(os.path.join(directory, 'app.log'), 'w') as log:
+        for i in range(5000):
+            log.write('2024-01-01 12:00:%02d INFO request %d served in %d ms\n' % (i % 60, i, i % 97))
+    for name, command in (('read.sh', 'cat app.log'), ('tail.sh', 'tail -c 4096 app.log')):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as script:
+            script.write('#!/bin/sh\n%s\n' % command)
+        os.chmod(path, 0o755)
+
+
+def request(port, path):
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('%s returned %d' % (path, response.status))
+    finally:
+        connection.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView file reads')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--backend', default='threaded', choices=('threaded', 'asyncio'))
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.dir)
+
+    with tempfile.TemporaryDirectory() as directory:
+        create_app(directory)
+        server = subprocess.Popen(
+            [sys.executable, __file__, '--serve', args.backend, '--dir', directory],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True)
+        try:
+            line = ''
+            while not line.startswith('PORT'):
+                line = server.stdout.readline()
+                if not line:
+                    raise RuntimeError('the server did not start')
+            port = int(line.split()[1])
+            print('%-20s %9s %9s' % ('scenario', 'p50 ms', 'p95 ms'))
+            for name, path in SCENARIOS:
+                request(port, path)
+                latencies = sorted(request(port, path) for _ in range(args.requests))
+                print('%-20s %9.2f %9.2f' % (name, statistics.median(latencies) * 1000,
+                                             latencies[int(len(latencies) * 0.95) - 1] * 1000))
+        finally:
+            server.stdin.close()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Time to first paint of a BigBashView window.
+#
+# Launches a page that reports back through a script once it has been
+# painted, and then closes its window. Each launch is measured from the
+# start of bigbashview until the report, either starting everything in
+# the launched process or with a daemon started with --prestart opening
+# the windows. Needs a display and QtWebEngine.
+#
+# Usage: python3 benchmarks/first_paint.py [--runs N] [--mode normal|prestart]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BIGBASHVIEW = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'bigbashview', 'usr', 'lib', 'bbv', 'bigbashview.py')
+# Seconds to wait for a window or the daemon
+TIMEOUT = 60
+
+# Reports the first frame painted after the page loaded
+PAGE = '''<html><body><h1>First paint</h1><script>
+window.addEventListener('load', () => requestAnimationFrame(() => setTimeout(() =>
+    fetch('/execute$./painted.sh').then(() => window.close()))));
+</script></body></html>
+'''
+SCRIPT = '''#!/bin/sh
+: > "$BBV_FIRST_PAINT"
+'''
+
+
+def create_app(directory):
+    with open(os.path.join(directory, 'index.html'), 'w') as page:
+        page.write(PAGE)
+    script = os.path.join(directory, 'painted.sh')
+    with open(script, 'w') as painted:
+        painted.write(SCRIPT)
+    os.chmod(script, 0o755)
+    return os.path.join(directory, 'painted')
+
+
+def launch(directory, marker, env):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, BIGBASHVIEW, '-t', 'qt', '-d', directory, 'index.html'],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Launches forwarded to the daemon exit before the window is painted
+    while not os.path.exists(marker):
+        if proc.poll() or time.perf_counter() - start > TIMEOUT:
+            raise RuntimeError('the window was not painted')
+        time.sleep(0.002)
+    elapsed = time.perf_counter() - start
+    os.unlink(marker)
+    proc.wait(TIMEOUT)
+    return elapsed
+
+
+def start_daemon(directory, env):
+    socket_path = os.path.join(env['XDG_RUNTIME_DIR'], 'bigbashview', 'daemon.sock')
+    proc = subprocess.Popen(
+        [sys.executable, BIGBASHVIEW, '-t', 'qt', '--prestart'], cwd=directory,
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + TIMEOUT
+    while not os.path.exists(socket_path):
+        if proc.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError('the daemon did not start')
+        time.sleep(0.05)
+    return proc
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView time to first paint')
+    parser.add_argument('--runs', type=int, default=10, help='Launches to measure')
+    parser.add_argument('--mode', action='append', choices=('normal', 'prestart'),
+                        help='Launch modes to measure, both by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        marker = create_app(directory)
+        # A runtime directory of its own keeps a running daemon out
+        env = dict(os.environ, XDG_RUNTIME_DIR=directory, BBV_FIRST_PAINT=marker)
+
+        results = {}
+        for mode in args.mode or ('normal', 'prestart'):
+            daemon = start_daemon(directory, env) if mode == 'prestart' else None
+            try:
+                launch(directory, marker, env)
+                results[mode] = [launch(directory, marker, env) * 1000
+                                 for _ in range(args.runs)]
+            finally:
+                if daemon:
+                    daemon.terminate()
+                    daemon.wait(TIMEOUT)
+
+    print('%-10s %9s %9s %9s' % ('mode', 'median ms', 'min ms', 'max ms'))
+    for mode, values in results.items():
+        print('%-10s %9.1f %9.1f %9.1f' % (
+            mode, statistics.median(values), min(values), max(values)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+#
+# Import time benchmark of the BigBashView startup.
+#
+# Imports the modules loaded at startup in fresh interpreters started
+# with -X importtime, and reports the time each one takes including
+# its own imports, and the slowest modules imported along the way.
+# The modules of a toolkit that is not installed are reported as
+# failed.
+#
+# Usage: python3 benchmarks/import_time.py [--runs N] [--top N] [module ...]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'bigbashview', 'usr', 'lib')
+
+# Modules imported by bigbashview, in the order they are needed
+MODULES = ('bbv.main', 'bbv.server.bbv2server', 'bbv.ui.qt', 'bbv.ui.gtk')
+
+
+# Import a module in a fresh interpreter and return the cumulative
+# import time in microseconds of each module it loaded, or None when
+# the import failed
+def import_times(module):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (LIB_DIR, env.get('PYTHONPATH'))))
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, text=True)
+    if proc.returncode != 0:
+        return None
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            times[fields[2].strip()] = int(fields[1])
+        except (IndexError, ValueError):
+            pass
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView import time benchmark')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='Modules to import')
+    parser.add_argument('--runs', type=int, default=10, help='Imports of each module')
+    parser.add_argument('--top', type=int, default=10, help='Slowest imports to list')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.runs)]
+        if None in runs:
+            print('%s: import failed\n' % module)
+            continue
+        totals = [times[module] / 1000 for times in runs]
+        print('%s: median %.1f ms, min %.1f ms, max %.1f ms' % (
+            module, statistics.median(totals), min(totals), max(totals)))
+        medians = {name: statistics.median(times.get(name, 0) for times in runs)
+                   for name in runs[0] if name != module}
+        slowest = sorted(medians.items(), key=lambda item: item[1], reverse=True)
+        for name, value in slowest[:args.top]:
+            print('    %-40s %8.1f ms' % (name, value / 1000))
+        print()
+
+
+if __name__ == '__main__':
+    main()
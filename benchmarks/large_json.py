@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Reading a large JSON file through the /api/file API code.
+#
+# Generates a JSON array of records and reads it the way GET did before
+# large files were streamed (parsing and serializing it again), streamed
+# with and without validation, and a page at a time through the item
+# index. Each mode runs in a child process, to report its peak memory.
+#
+# Usage: python3 benchmarks/large_json.py [--megabytes N] [--runs N]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'bigbashview', 'usr', 'lib')
+
+MODES = {
+    'load + dumps': 'text = json.dumps(json.load(open(path)))',
+    'stream': 'for chunk in jsonstream.stream_file(path): pass',
+    'stream, validate=0': 'for chunk in jsonstream.stream_file(path, False): pass',
+    'first page': 'jsonstream.indexes.read_items(path, 1000, 50)',
+    'next pages': '''jsonstream.indexes.read_items(path, 0, 50)
+start = time.perf_counter()
+for offset in range(0, 50000, 500):
+    jsonstream.indexes.read_items(path, offset, 50)
+elapsed = (time.perf_counter() - start) / 100''',
+}
+
+CHILD = '''
+import json, resource, sys, time
+sys.path.insert(0, %r)
+from bbv.server import jsonstream
+path = %r
+start = time.perf_counter()
+%s
+elapsed = locals().get('elapsed', time.perf_counter() - start)
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def create_file(path, megabytes):
+    with open(path, 'w') as f:
+        f.write('[')
+        size, i = 0, 0
+        while size < megabytes * 1024 * 1024:
+            item = json.dumps({'id': i, 'name': 'package-%d' % i, 'version': '1.%d.0' % (i % 50),
+                               'description': 'A package of the inventory ' * 4,
+                               'depends': ['lib%d' % (i % 97), 'lib%d' % (i % 89)],
+                               'installed': i % 3 == 0, 'size': i * 1024})
+            f.write(',\n' if i else '\n')
+            f.write(item)
+            size += len(item) + 2
+            i += 1
+        f.write('\n]\n')
+    return i
+
+
+def run(path, code):
+    output = subprocess.check_output([sys.executable, '-c', CHILD % (LIB_DIR, path, code)])
+    elapsed, maxrss = output.split()
+    return float(elapsed), int(maxrss) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView large JSON files')
+    parser.add_argument('--megabytes', type=int, default=100, help='Size of the file')
+    parser.add_argument('--runs', type=int, default=3, help='Runs of each mode')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'inventory.json')
+        items = create_file(path, args.megabytes)
+        print('%d MB, %d items' % (os.path.getsize(path) // (1024 * 1024), items))
+        print('%-20s %12s %12s' % ('mode', 'median ms', 'peak RSS MB'))
+        for mode, code in MODES.items():
+            results = [run(path, code) for _ in range(args.runs)]
+            print('%-20s %12.2f %12.0f' % (
+                mode, statistics.median(r[0] for r in results) * 1000,
+                max(r[1] for r in results)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Request latency benchmark of the BigBashView server backends.
+#
+# Starts the server with each backend (threaded and asyncio) in a child
+# process and measures the latency of concurrent requests for a static
+# page, a short command and a burst of slow commands, along with the
+# number of threads the server needed.
+#
+# Usage: python3 benchmarks/request_latency.py [--requests N] [--concurrency N]
+
+import argparse
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'bigbashview', 'usr', 'lib')
+
+# (name, path, requests multiplier, concurrency override)
+SCENARIOS = (
+    ('static page', '/page.html', 1, None),
+    ('short command', '/execute$' + quote('echo hello'), 1, None),
+    ('slow command burst', '/execute$' + quote('sleep 0.2; echo done'), 0.5, 100),
+)
+
+
+def serve(backend, directory):
+    sys.path.insert(0, LIB_DIR)
+    os.chdir(directory)
+    from bbv import globaldata
+    from bbv.server.bbv2server import run_server
+    globaldata.BACKEND = backend
+    run_server()
+    print('PORT', globaldata.PORT, flush=True)
+    # Serve until the benchmark closes our stdin
+    sys.stdin.read()
+    os._exit(0)
+
+
+def request(port, path):
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError('%s returned %d' % (path, response.status))
+    finally:
+        connection.close()
+    return time.perf_counter() - start
+
+
+def count_threads(pid):
+    try:
+        return len(os.listdir('/proc/%d/task' % pid))
+    except OSError:
+        return 0
+
+
+def run_scenario(server, port, path, requests, concurrency):
+    peak = [count_threads(server.pid)]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.02):
+            peak[0] = max(peak[0], count_threads(server.pid))
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = sorted(pool.map(lambda _: request(port, path), range(requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    return {
+        'p50': statistics.median(latencies) * 1000,
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'max': latencies[-1] * 1000,
+        'rps': requests / elapsed,
+        'threads': peak[0],
+    }
+
+
+def benchmark(backend, directory, requests, concurrency):
+    server = subprocess.Popen(
+        [sys.executable, __file__, '--serve', backend, '--dir', directory],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        text=True)
+    try:
+        line = ''
+        while not line.startswith('PORT'):
+            line = server.stdout.readline()
+            if not line:
+                raise RuntimeError('%s server did not start' % backend)
+        port = int(line.split()[1])
+        # Warm up caches and workers
+        for name, path, _, _ in SCENARIOS:
+            request(port, path)
+        results = []
+        for name, path, multiplier, burst in SCENARIOS:
+            results.append((name, run_scenario(
+                server, port, path, max(int(requests * multiplier), 1),
+                burst or concurrency)))
+        return results
+    finally:
+        server.stdin.close()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView request latency benchmark')
+    parser.add_argument('--requests', type=int, default=400, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+    parser.add_argument('--backends', default='threaded,asyncio', help='Backends to compare')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.serve, args.dir)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'page.html'), 'w') as page:
+            page.write('<html><body>%s</body></html>' % ('<p>BigBashView</p>' * 200))
+
+        print('%-10s %-20s %9s %9s %9s %9s %8s' % (
+            'backend', 'scenario', 'p50 ms', 'p95 ms', 'max ms', 'req/s', 'threads'))
+        for backend in args.backends.split(','):
+            for name, result in benchmark(backend, directory, args.requests, args.concurrency):
+                print('%-10s %-20s %9.1f %9.1f %9.1f %9.1f %8d' % (
+                    backend, name, result['p50'], result['p95'], result['max'],
+                    result['rps'], result['threads']))
+
+
+if __name__ == '__main__':
+    main()
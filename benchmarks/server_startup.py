@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Cold-start benchmark of the BigBashView server.
+#
+# Starts the server in fresh interpreters and measures how long the
+# imports take, how long run_server() takes to return, and how long
+# until the first response is received.
+#
+# Usage: python3 benchmarks/server_startup.py [--runs N] [--backend NAME]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LIB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       '..', 'bigbashview', 'usr', 'lib')
+
+
+def measure(backend):
+    start = time.perf_counter()
+    sys.path.insert(0, LIB_DIR)
+    from bbv import globaldata
+    from bbv.server.bbv2server import run_server
+    imported = time.perf_counter()
+
+    globaldata.BACKEND = backend
+    sys.stdout = open(os.devnull, 'w')
+    run_server()
+    started = time.perf_counter()
+
+    import http.client
+    connection = http.client.HTTPConnection(globaldata.ADDRESS, globaldata.PORT)
+    connection.request('GET', '/')
+    connection.getresponse().read()
+    responded = time.perf_counter()
+
+    sys.stdout = sys.__stdout__
+    print(json.dumps({
+        'import': (imported - start) * 1000,
+        'run_server': (started - imported) * 1000,
+        'first_response': (responded - imported) * 1000,
+    }), flush=True)
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView server cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=20, help='Server starts to measure')
+    parser.add_argument('--backend', default='threaded', help='Server backend')
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        return measure(args.backend)
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run(
+            [sys.executable, __file__, '--measure', '--backend', args.backend],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print('%-16s %9s %9s %9s' % ('phase', 'median ms', 'min ms', 'max ms'))
+    for phase in ('import', 'run_server', 'first_response'):
+        values = [result[phase] for result in results]
+        print('%-16s %9.1f %9.1f %9.1f' % (
+            phase, statistics.median(values), min(values), max(values)))
+
+
+if __name__ == '__main__':
+    main()
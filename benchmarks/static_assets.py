@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Static asset benchmark of the bbv:// scheme.
+#
+# Creates an app with many small CSS, JavaScript and image files, starts
+# its server on a unix socket and loads all the assets the two ways the
+# scheme handler can: through the server, and read directly by the UI
+# process. Several requests run at once, like a browser loading a page.
+#
+# Usage: python3 benchmarks/static_assets.py [--assets N] [--rounds N]
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'bigbashview', 'usr', 'lib'))
+
+# Requests a browser runs at once for one host
+CONCURRENCY = 6
+
+
+def create_app(directory, assets):
+    paths = []
+    for index in range(assets):
+        name, data = (
+            ('style%d.css' % index, b'.item%d { color: red; }\n' % index * 40),
+            ('script%d.js' % index, b'var item%d = %d;\n' % (index, index) * 40),
+            ('icon%d.png' % index, os.urandom(2048)),
+        )[index % 3]
+        with open(os.path.join(directory, name), 'wb') as asset:
+            asset.write(data)
+        paths.append('/' + name)
+    return paths
+
+
+def through_server(scheme, host, path):
+    connection = scheme.request(host, 'GET', path, {}, None)
+    try:
+        return connection.getresponse().read()
+    finally:
+        connection.close()
+
+
+def from_disk(scheme, host, path):
+    filename, _ = scheme.find_static_file(host, 'GET', path, {})
+    with open(filename, 'rb') as asset:
+        return asset.read()
+
+
+def load(fetch, scheme, host, paths):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CONCURRENCY) as pool:
+        sizes = list(pool.map(lambda path: len(fetch(scheme, host, path)), paths))
+    if not all(sizes):
+        raise RuntimeError('empty asset')
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BigBashView static asset benchmark')
+    parser.add_argument('--assets', type=int, default=150, help='Assets of the page')
+    parser.add_argument('--rounds', type=int, default=20, help='Page loads to measure')
+    parser.add_argument('--backend', default='threaded', help='Server backend')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_app(directory, args.assets)
+        os.chdir(directory)
+        from bbv import globaldata
+        globaldata.BACKEND = args.backend
+        globaldata.TRANSPORT = 'unix'
+        from bbv.server.bbv2server import run_server
+        from bbv.ui import scheme
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        stderr, sys.stderr = sys.stderr, sys.stdout
+        server = run_server()
+
+        results = {}
+        for name, fetch in (('through server', through_server), ('from disk', from_disk)):
+            load(fetch, scheme, server.host, paths)
+            results[name] = [load(fetch, scheme, server.host, paths) * 1000
+                             for _ in range(args.rounds)]
+        sys.stdout, sys.stderr = stdout, stderr
+
+        print('%d assets, %d at once' % (len(paths), CONCURRENCY))
+        print('%-16s %9s %9s %9s' % ('path', 'median ms', 'min ms', 'max ms'))
+        for name, values in results.items():
+            print('%-16s %9.1f %9.1f %9.1f' % (
+                name, statistics.median(values), min(values), max(values)))
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
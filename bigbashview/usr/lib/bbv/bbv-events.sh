@@ -0,0 +1,25 @@
+# Helpers for scripts streamed through the events$ command.
+# Source it with:  . "$bbv_events"
+#
+#   bbv_event name [data]          emit an event of the given name
+#   bbv_progress percent [message] emit a "progress" event with JSON data
+#   bbv_json_string text           print text as a JSON string
+
+bbv_json_string() {
+    local s=$1
+    s=${s//\\/\\\\}
+    s=${s//\"/\\\"}
+    s=${s//$'\n'/\\n}
+    s=${s//$'\r'/\\r}
+    s=${s//$'\t'/\\t}
+    printf '"%s"' "$s"
+}
+
+bbv_event() {
+    local data=${2-}
+    printf '::bbv-event %s %s\n' "$1" "${data//$'\n'/ }"
+}
+
+bbv_progress() {
+    bbv_event progress "{\"percent\": ${1:-0}, \"message\": $(bbv_json_string "${2-}")}"
+}
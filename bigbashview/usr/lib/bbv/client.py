@@ -21,6 +21,6 @@ from bbv.main import Main
 from sys import argv
 
 if __name__ == "__main__":
-    app = Main()
+    app = Main(start_server=False)
     app.url=argv[1]
     app.run(False)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#  This file implements the daemon mode of BigBashView.
+#
+#  The first bigbashview started with --daemon keeps its server and
+#  browser process running and listens on a unix socket. Later launches
+#  send it their URL and window options, and the daemon opens a new
+#  window for them, so each app after the first starts without spawning
+#  another Python interpreter, server and web engine. The launches wait
+#  until their window is closed, as they do when they open it themselves.
+#
+#  With --prestart the daemon is started ahead of time, by the systemd
+#  user unit or the autostart entry, without a window of its own. Every
+#  launch then finds it running and has its window opened by it.
+#
+#  Note: This code is licensed under the GNU General Public License version 3 or later.
+#  For more details, see http://www.gnu.org/licenses/
+
+import fcntl
+import json
+import os
+import socket
+import struct
+import threading
+from bbv.paths import bind_private_socket, get_runtime_dir
+
+# Largest request accepted from a launcher
+MAX_REQUEST_BYTES = 1024 * 1024
+# Seconds a launcher waits to connect to the daemon, and for the daemon
+# to open its window
+CONNECT_TIMEOUT = 2
+FORWARD_TIMEOUT = 30
+# Variables set anew for every launch, which don't make it another app
+LAUNCH_VARIABLES = frozenset((
+    '_', 'PWD', 'OLDPWD', 'SHLVL', 'COLUMNS', 'LINES', 'WINDOWID',
+    'DESKTOP_STARTUP_ID', 'XDG_ACTIVATION_TOKEN', 'BAMF_DESKTOP_FILE_HINT',
+    'GIO_LAUNCHED_DESKTOP_FILE', 'GIO_LAUNCHED_DESKTOP_FILE_PID',
+    'INVOCATION_ID', 'JOURNAL_STREAM', 'SYSTEMD_EXEC_PID', 'MANAGERPID',
+    'TERM_SESSION_ID',
+))
+
+
+def get_socket_path():
+    return os.path.join(get_runtime_dir(), 'daemon.sock')
+
+
+# Launches from the same directory and environment, apart from the
+# variables of the launch itself, are served by the same server
+def get_server_key(cwd, environ):
+    return (cwd, tuple(sorted(item for item in environ.items()
+                              if item[0] not in LAUNCH_VARIABLES)))
+
+
+# Send a request to the running daemon, returns its reply and the
+# connection it came on, or None when no daemon answers
+def _send(request, path):
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        soc.settimeout(CONNECT_TIMEOUT)
+        soc.connect(path)
+        soc.settimeout(FORWARD_TIMEOUT)
+        soc.sendall(json.dumps(request).encode() + b'\n')
+        line = soc.makefile('rb').readline()
+        return json.loads(line), soc
+    except ValueError:
+        soc.close()
+        return {'ok': False, 'error': 'invalid reply from the daemon'}, None
+    except OSError:
+        soc.close()
+        return None, None
+
+
+# With wait in the request, return once the window the daemon opened is
+# closed: the daemon then writes to the connection, or exits
+def _finish(request, reply, soc):
+    if soc is None:
+        return reply
+    with soc:
+        if reply.get('ok') and request.get('wait'):
+            soc.settimeout(None)
+            try:
+                soc.recv(1)
+            except OSError:
+                pass
+    return reply
+
+
+# Have the running daemon open the window of a launch. Returns its reply,
+# or None for the launch to open the window itself.
+def forward(request, path=None):
+    return _finish(request, *_send(request, path or get_socket_path()))
+
+
+# Hand the request over to a running daemon or become the daemon.
+# Returns the reply of the daemon when there is one, or a listening
+# socket for this process to serve. The lock keeps two launches from
+# both finding no daemon and binding the socket at the same time, it is
+# released before waiting for the window to be closed.
+def claim(request):
+    path = get_socket_path()
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        reply, soc = _send(request, path)
+        if reply is None:
+            # Left over by a daemon that did not exit cleanly
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            bind_private_socket(soc, path)
+            soc.listen(socket.SOMAXCONN)
+            return None, soc
+    return _finish(request, reply, soc), None
+
+
+# Accept the requests of other launches on a thread of their own. Each
+# one is passed to handler, which opens the window and returns the reply,
+# with an event to set when the window is closed. Launches that wait for
+# it are sent a second line then.
+class Listener(threading.Thread):
+    def __init__(self, sock, handler):
+        super().__init__(daemon=True)
+        self.sock = sock
+        self.path = sock.getsockname()
+        self.handler = handler
+
+    def run(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+
+    def serve(self, conn):
+        with conn:
+            # Only launches by the same user may open windows
+            creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                    struct.calcsize('3i'))
+            if struct.unpack('3i', creds)[1] != os.getuid():
+                return
+            line = conn.makefile('rb').readline(MAX_REQUEST_BYTES)
+            closed = threading.Event()
+            try:
+                request = json.loads(line)
+                # Sent by --prestart to check for a running daemon
+                if request.get('ping'):
+                    reply = {'ok': True}
+                    closed.set()
+                else:
+                    reply = self.handler(request, closed)
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            try:
+                conn.sendall(json.dumps(reply).encode() + b'\n')
+                if reply.get('ok') and request.get('wait'):
+                    closed.wait()
+                    conn.sendall(b'{"closed": true}\n')
+            except OSError:
+                # The launch went away
+                pass
+
+    def stop(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.sock.close()
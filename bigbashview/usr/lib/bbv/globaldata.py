@@ -28,3 +28,26 @@ PROCESS = 'BigBashView'
 EXTERNAL_LINK = False
 ADDRESS = '127.0.0.1'
 PORT = 19000
+BACKEND = 'threaded'
+TRANSPORT = 'tcp'
+ASYNC_THREADS = 10
+WORKERS = 2
+WORKER_REQUESTS = 100
+INCLUDE_WORKERS = 8
+RESULT_CACHE_ENTRIES = 256
+RESULT_CACHE_BYTES = 32 * 1024 * 1024
+CACHE_TTL = 60
+TEMPLATE_CACHE_ENTRIES = 256
+TEMPLATE_CACHE_BYTES = 16 * 1024 * 1024
+STREAM_FILE_BYTES = 8 * 1024 * 1024
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_CACHE_ENTRIES = 256
+COMPRESS_CACHE_BYTES = 16 * 1024 * 1024
+MAX_JOBS = 8
+MAX_FINISHED_JOBS = 64
+FILE_STORE_ENTRIES = 64
+JSON_STREAM_BYTES = 8 * 1024 * 1024
+JSON_INDEX_ENTRIES = 8
+FILE_FOLLOW_INTERVAL = 0.1
+FILE_FOLLOW_TIMEOUT = 30
+FILE_FOLLOWERS = 4
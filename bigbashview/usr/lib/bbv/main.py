@@ -34,16 +34,17 @@
 #  If a matching file is found, it sets the URL to that file.
 #
 #  The script then checks for the availability of the rendering toolkits,
-#  QtWebEngine and WebKitGTK2. If both are unavailable, it displays an error
-#  message and exits. If only one toolkit is available, it sets the toolkit
-#  to that one. If both toolkits are available, it sets the toolkit to 'auto'
-#  and tries to import the QtWebEngine toolkit first. If it fails, it imports
-#  the WebKitGTK2 toolkit.
+#  QtWebEngine and WebKitGTK2, without importing them. If both are
+#  unavailable, it displays an error message and exits. With the toolkit
+#  'auto' it picks QtWebEngine when PySide6 provides it, and WebKitGTK2
+#  otherwise, or when QtWebEngine fails to import. The toolkit picked is
+#  cached until the installed packages change.
 #
-#  After setting up the toolkit, the script creates an instance of the
-#  corresponding window class (gtk.Window or qt.Window) and sets the window
-#  properties based on the command line arguments. It then runs the window,
-#  loading the specified URL and starting the server if specified.
+#  The server is started on a background thread before the toolkit is
+#  imported, so the two load at the same time. The script then creates an
+#  instance of the corresponding window class (gtk.Window or qt.Window) and
+#  sets the window properties based on the command line arguments. It then
+#  runs the window, loading the specified URL once the server is ready.
 #
 #  The Main class also includes a nested class, formatter, which is a helper
 #  class for formatting the help message of the argument parser.
@@ -53,14 +54,16 @@
 #  to start the script.
 
 import argparse
+import collections
 import sys
 import os
+import threading
 from bbv import globaldata
 from setproctitle import setproctitle
 
 class Main:
     # Start bbv #
-    def __init__(self):
+    def __init__(self, start_server=True):
         # Helper class for formatting the help message
         def formatter(prog):
             return argparse.RawTextHelpFormatter(
@@ -98,6 +101,7 @@ class Main:
                         .sh.html|.sh.htm  Html Markup
                         .sh.js            Shell with js output
                         .sh.css           Shell with css output
+                        .sh.json          Shell with json output
                         .sh.php           PHP Script
                         .sh.py            Python Script
                         .sh.lua           Lua Script
@@ -151,6 +155,26 @@ class Main:
         parser.add_argument(
             '-e', '--external_link', action='store_true',
             help='Open external link in default browser')
+        parser.add_argument(
+            '--backend', default=globaldata.BACKEND, choices=('threaded', 'asyncio'),
+            help='HTTP server: threaded or asyncio')
+        parser.add_argument(
+            '--transport', default=globaldata.TRANSPORT, choices=('tcp', 'unix'),
+            help='Connection to the server: tcp port or unix socket (bbv:// URLs)')
+        parser.add_argument(
+            '--workers', type=int, default=globaldata.WORKERS,
+            help='Warm bash workers for executed scripts, 0 to disable')
+        parser.add_argument(
+            '--worker_requests', type=int, default=globaldata.WORKER_REQUESTS,
+            help='Requests served by a bash worker before it is recycled')
+        parser.add_argument(
+            '--daemon', action='store_true',
+            help='Open the window in a running BigBashView, or keep running\n'
+                 'to open the windows of later launches (QtWebEngine only)')
+        parser.add_argument(
+            '--prestart', action='store_true',
+            help='Start the daemon without a window, to open the windows\n'
+                 'of all later launches (QtWebEngine only)')
 
         # Parse the command line arguments
         args = parser.parse_args()
@@ -159,6 +183,11 @@ class Main:
         if args.external_link:
             globaldata.EXTERNAL_LINK = True
 
+        globaldata.BACKEND = args.backend
+        globaldata.TRANSPORT = args.transport
+        globaldata.WORKERS = max(args.workers, 0)
+        globaldata.WORKER_REQUESTS = max(args.worker_requests, 0)
+
         # Check if the specified directory exists
         if args.directory and os.path.isdir(args.directory):
             os.chdir(args.directory)
@@ -234,42 +263,63 @@ class Main:
             parser.print_help()
             sys.exit(1)
 
-        # Construct the window
-        if self.toolkit == 'auto':
-            try:
-                from bbv.ui import qt
-                self.toolkit = 'qt'
-            except ImportError as e:
-                print(e)
-                try:
-                    from bbv.ui import gtk
-                    self.toolkit = 'gtk'
-                except ImportError as e:
-                    print(e)
-                    print('Please install WebKitGtk or PySide6')
+        # Environment of the launch, before the variables of the toolkit
+        # are set, which the daemon picks the server of an app by
+        self.environ = dict(os.environ)
+        # Options a daemon can't apply to the windows it opens, it only
+        # opens those of launches with the same ones
+        self.options = {
+            'backend': globaldata.BACKEND,
+            'transport': globaldata.TRANSPORT,
+            'workers': globaldata.WORKERS,
+            'worker_requests': globaldata.WORKER_REQUESTS,
+            'gpu': args.gpu,
+            'process': globaldata.PROCESS,
+        }
+
+        # Hand the window over to a running daemon, or become the daemon
+        self.daemon_socket = None
+        self.prestart = args.prestart
+        if self.prestart and self.toolkit == 'gtk':
+            print('--prestart needs QtWebEngine')
+            sys.exit(1)
+        if (args.daemon or self.prestart) and self.toolkit != 'gtk':
+            from bbv import daemon
+            request = {'ping': True} if self.prestart else self.get_request()
+            reply, self.daemon_socket = daemon.claim(request)
+            # A daemon with other options leaves the window to this launch
+            if reply is not None and not reply.get('declined'):
+                if not reply.get('ok'):
+                    print(reply.get('error', 'The daemon could not open the window'))
                     sys.exit(1)
+                sys.exit(0)
+        elif start_server and self.toolkit != 'gtk':
+            # Have the window opened by the daemon when one is running, like
+            # the one started ahead of time with --prestart, and open it in
+            # this process otherwise
+            from bbv import daemon
+            reply = daemon.forward(self.get_request())
+            if reply is not None and not reply.get('declined'):
+                if reply.get('ok'):
+                    sys.exit(0)
+                print(reply.get('error', 'The daemon could not open the window'))
 
-        if self.toolkit == 'gtk':
-            try:
-                from bbv.ui import gtk
-            except ImportError as e:
-                print(e)
-                print('Please install WebKitGtk')
+        # Pick the toolkit without importing it, both take a while to load.
+        # The one imported by the last launch is used while the installed
+        # packages are unchanged.
+        cached = None
+        if self.toolkit == 'auto':
+            from bbv import toolkit
+            cached = toolkit.get_cached()
+            self.toolkit = cached or toolkit.find_toolkit()
+            if self.toolkit is None:
+                print('Please install WebKitGtk or PySide6')
                 sys.exit(1)
-            os.environ['GDK_BACKEND'] = 'x11'
-            os.environ['WEBKIT_DISABLE_SANDBOX_THIS_IS_DANGEROUS'] = '1'
-            os.environ['WEBKIT_DISABLE_COMPOSITING_MODE'] = '1'
-            os.environ['WEBKIT_HARDWARE_ACCELERATION_POLICY_NEVER'] = '1'
-            self.window = gtk.Window(None)
 
-        if self.toolkit == 'qt':
-            try:
-                from bbv.ui import qt
-            except ImportError as e:
-                print(e)
-                print('Please install PySide6')
-                sys.exit(1)
+        if self.toolkit == 'gtk':
+            self.prepare_gtk()
 
+        if self.toolkit == 'qt':
             if args.gpu:
                 flags = (' --enable-gpu-rasterization')
             else:
@@ -285,30 +335,219 @@ class Main:
                 os.environ['QTWEBENGINE_CHROMIUM_FLAGS'] = flags
 
             os.environ['QTWEBENGINE_DISABLE_SANDBOX'] = '1'
-            self.window = qt.Window()
 
-    def run(self, start_server=True):
-        # Import the run_server function from bbv2server module
-        from bbv.server.bbv2server import run_server
-        # Start the server if specified
-        server = run_server() if start_server else None
+        # Start the server while the toolkit is imported, once the
+        # environment of the scripts is complete
+        self.server_thread = None
+        if start_server:
+            self.start_server()
+
+        # Construct the window
+        if self.toolkit == 'qt':
+            try:
+                from bbv.ui import qt
+                if self.prestart:
+                    # Windows are only opened for later launches
+                    self.window = None
+                    self.app = qt.prestart()
+                else:
+                    self.window = qt.Window()
+            except ImportError as e:
+                print(e)
+                if args.toolkit == 'qt':
+                    print('Please install PySide6')
+                    sys.exit(1)
+                # Found but not loadable, fall back to WebKitGTK
+                self.toolkit = 'gtk'
+                self.prepare_gtk()
+
+        if self.toolkit == 'gtk':
+            try:
+                from bbv.ui import gtk
+            except ImportError as e:
+                print(e)
+                print('Please install WebKitGtk')
+                if args.toolkit == 'auto':
+                    toolkit.clear_cached()
+                sys.exit(1)
+            if self.prestart:
+                print('--prestart needs QtWebEngine')
+                sys.exit(1)
+            self.window = gtk.Window(None)
+
+        if args.toolkit == 'auto' and self.toolkit != cached:
+            toolkit.set_cached(self.toolkit)
 
+    # Environment of WebKitGTK, also inherited by the scripts
+    def prepare_gtk(self):
+        os.environ['GDK_BACKEND'] = 'x11'
+        os.environ['WEBKIT_DISABLE_SANDBOX_THIS_IS_DANGEROUS'] = '1'
+        os.environ['WEBKIT_DISABLE_COMPOSITING_MODE'] = '1'
+        os.environ['WEBKIT_HARDWARE_ACCELERATION_POLICY_NEVER'] = '1'
+        # Daemon mode needs several windows in one process
+        if self.daemon_socket:
+            self.daemon_socket.close()
+            os.unlink(self.daemon_socket.getsockname())
+            self.daemon_socket = None
+
+    # Window options of this launch, as sent to the daemon. The launch
+    # waits for the window the daemon opens to be closed.
+    def get_request(self):
+        return {
+            'wait': True,
+            'url': self.url,
+            'cwd': os.getcwd(),
+            'environ': self.environ,
+            'width': self.width,
+            'height': self.height,
+            'min_width': self.min_width,
+            'min_height': self.min_height,
+            'window_state': self.window_state,
+            'color': self.color,
+            'title': globaldata.TITLE or '',
+            'icon': globaldata.ICON,
+            'external_link': globaldata.EXTERNAL_LINK,
+            'options': self.options,
+        }
+
+    def show_window(self, window, request, server_url):
+        url = request['url']
         # Check if the URL is a local file
-        if self.url.find('://') == -1:
-            if not self.url.startswith('/'):
-                self.url = '/'+self.url
-            self.url = 'http://%s:%s%s' % (
-                globaldata.ADDRESS,
-                globaldata.PORT,
-                self.url)
+        if url.find('://') == -1:
+            if not url.startswith('/'):
+                url = '/'+url
+            url = server_url + url
 
         # Set the window size, style, viewer, and load the URL
-        self.window.set_size(self.width, self.height, self.window_state, self.min_width, self.min_height)
-        self.window.style(self.color)
-        self.window.viewer(self.window_state)
-        self.window.load_url(self.url)
-        # Run the window
-        self.window.run()
+        window.set_size(request['width'], request['height'], request['window_state'],
+                        request['min_width'], request['min_height'])
+        window.style(request['color'])
+        window.viewer(request['window_state'])
+        window.load_url(url)
+
+    # Start the server on a background thread
+    def start_server(self):
+        def start():
+            try:
+                from bbv.server.bbv2server import run_server
+                self.server = run_server()
+            except BaseException as e:
+                self.server_error = e
+        self.server = self.server_error = None
+        self.server_thread = threading.Thread(target=start, daemon=True)
+        self.server_thread.start()
+
+    # Wait for the server started by start_server()
+    def wait_server(self):
+        if self.server_thread is None:
+            self.start_server()
+        self.server_thread.join()
+        if self.server_error is not None:
+            raise self.server_error
+        return self.server
+
+    def run(self, start_server=True):
+        # Wait for the server if specified
+        server = self.wait_server() if start_server else None
+
+        listener = None
+        if self.daemon_socket:
+            listener = self.start_daemon(server)
+
+        if server:
+            server_url = server.url
+        else:
+            server_url = 'http://%s:%s' % (globaldata.ADDRESS, globaldata.PORT)
+        if self.window:
+            self.show_window(self.window, self.get_request(), server_url)
+            if server and listener:
+                self.track_window(server, self.window)
+            # Run the window
+            self.window.run()
+        else:
+            # Prestarted, keep running until stopped
+            self.app.exec_()
+        # Stop listening before the windows are gone
+        if listener:
+            listener.stop()
         # Stop the server if started
         if server:
             server.stop()
+
+    # Serve the windows of later launches from this process. Apps started
+    # from another directory or environment get a server of their own,
+    # stopped when their last window is closed.
+    def start_daemon(self, server):
+        from bbv import daemon
+        from bbv.ui import qt
+        from bbv.server.bbv2server import run_server
+
+        self.invoker = qt.Invoker()
+        self.servers = {}
+        self.windows = {}
+        # Windows about to be opened on each server, which keep it running
+        self.pending = collections.Counter()
+        self.servers_lock = threading.Lock()
+        if server:
+            self.servers[daemon.get_server_key(os.getcwd(), self.environ)] = server
+
+        def open_window(request, closed):
+            if request.get('options') != self.options:
+                return {'ok': False, 'declined': True,
+                        'error': 'The daemon runs with other options'}
+            key = daemon.get_server_key(request['cwd'], request['environ'])
+            with self.servers_lock:
+                app_server = self.servers.get(key)
+                if app_server is None:
+                    app_server = run_server(workdir=request['cwd'], environ=request['environ'])
+                    self.servers[key] = app_server
+                self.pending[app_server] += 1
+
+            def show():
+                try:
+                    window = qt.Window(request['title'], request['icon'], request['external_link'])
+                    window.destroyed.connect(lambda: closed.set())
+                    self.show_window(window, request, app_server.url)
+                    self.track_window(app_server, window)
+                finally:
+                    with self.servers_lock:
+                        self.pending[app_server] -= 1
+                    # Not left running when the window failed to open
+                    self.stop_server(app_server)
+            self.invoker.invoke(show, daemon.FORWARD_TIMEOUT)
+            return {'ok': True}
+
+        listener = daemon.Listener(self.daemon_socket, open_window)
+        qt.QApplication.instance().aboutToQuit.connect(listener.stop)
+        listener.start()
+        return listener
+
+    # The close option of a script closes the windows of its app only
+    def track_window(self, server, window):
+        windows = self.windows.setdefault(server, [])
+        windows.append(window)
+
+        def forget():
+            windows.remove(window)
+            self.stop_server(server)
+        window.destroyed.connect(forget)
+
+        def close():
+            for app_window in list(windows):
+                self.invoker.called.emit(app_window.close)
+        server.on_close = close
+
+    # Stop a server the daemon started for another app once its windows
+    # are closed, unless a window is being opened on it
+    def stop_server(self, server):
+        if server is self.server:
+            return
+        with self.servers_lock:
+            keys = [key for key, app_server in self.servers.items() if app_server is server]
+            if not keys or self.windows.get(server) or self.pending[server]:
+                return
+            for key in keys:
+                del self.servers[key]
+            self.windows.pop(server, None)
+            del self.pending[server]
+        threading.Thread(target=server.shutdown, daemon=True).start()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+#  Per-user directories of BigBashView.
+#
+#  Note: This code is licensed under the GNU General Public License version 3 or later.
+#  For more details, see http://www.gnu.org/licenses/
+
+import os
+import stat
+import sys
+import tempfile
+
+# Runtime directory of this process, picked on first use
+_runtime_dir = None
+
+
+# Whether a directory is a real directory of the user that no one else
+# can enter, and not one another user made at the same path first
+def _is_private(path):
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and \
+        stat.S_IMODE(st.st_mode) == 0o700
+
+
+# Directory of the sockets of BigBashView, only accessible to the user.
+# Launchers send their environment to the daemon socket in it, so when
+# the directory can't be trusted a new one is made for this process,
+# and it is left without the daemon of other launches.
+def get_runtime_dir():
+    global _runtime_dir
+    if _runtime_dir is None:
+        runtime = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime and os.path.isdir(runtime):
+            path = os.path.join(runtime, 'bigbashview')
+        else:
+            path = '/tmp/bigbashview-%d' % os.getuid()
+        try:
+            os.mkdir(path, 0o700)
+        except FileExistsError:
+            pass
+        if not _is_private(path):
+            print('%s is not a private directory of the user, using another one' % path,
+                  file=sys.stderr)
+            path = tempfile.mkdtemp(prefix='bigbashview-%d-' % os.getuid())
+        _runtime_dir = path
+    return _runtime_dir
+
+
+# Bind a unix socket only the user can connect to. The umask makes it
+# so from the start, instead of changing its mode once it is bound.
+def bind_private_socket(soc, path):
+    umask = os.umask(0o177)
+    try:
+        soc.bind(path)
+    finally:
+        os.umask(umask)
+
+
+# Directory of the files BigBashView can rebuild when they are removed
+def get_cache_dir():
+    cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache, 'bigbashview')
@@ -0,0 +1,334 @@
+import asyncio
+import concurrent.futures
+import io
+import itertools
+import os
+import socket
+import sys
+import threading
+import traceback
+from email.utils import formatdate
+from urllib.parse import unquote_to_bytes
+import web
+from web.httpserver import LogMiddleware, StaticMiddleware
+from bbv import globaldata
+from .commands import CommandStream
+from .compress import CompressionMiddleware, compressible, encoded_headers, get_compressor, negotiate
+
+# Largest request line and headers accepted
+MAX_HEADER_BYTES = 64 * 1024
+# Seconds an idle keep-alive connection is kept open
+KEEPALIVE_TIMEOUT = 30
+# Statuses of responses that never have a body
+NO_BODY_STATUS = ('1', '204', '304')
+# Seconds between checks for a closed connection while a pool thread
+# waits to hand over a chunk
+POLL_INTERVAL = 1.0
+
+
+# Event loop shared by the servers of the process, so the servers the
+# daemon starts for other apps run on the same thread and child watcher
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            # Before Python 3.12 asyncio waits for each subprocess on a
+            # thread of its own unless it is told to use pidfds
+            if sys.version_info < (3, 12) and hasattr(os, 'pidfd_open'):
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(_loop)
+                asyncio.set_child_watcher(watcher)
+            threading.Thread(target=_loop.run_forever, name='bbv-asyncio', daemon=True).start()
+        return _loop
+
+
+# HTTP/1.1 server running on an asyncio event loop. The url_handler
+# classes run unchanged on a small thread pool, but the commands they
+# return (CommandStream) are awaited on the event loop as asyncio
+# subprocesses, so scripts in flight don't hold a thread each.
+class AsyncServer(object):
+    def __init__(self, app, sock, ready=None):
+        self.app = app
+        self.sock = sock
+        if sock.family == socket.AF_UNIX:
+            self.ip, self.port = 'localhost', 0
+        else:
+            self.ip, self.port = sock.getsockname()[:2]
+        self.ready = ready
+        self.future = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(globaldata.ASYNC_THREADS, 1),
+            thread_name_prefix='bbv-handler')
+        # Same middleware as the threaded server
+        app.add_processor(self._detach_command)
+        self.wsgi = LogMiddleware(StaticMiddleware(app.wsgifunc(CompressionMiddleware)))
+
+    def run(self):
+        self.future = asyncio.run_coroutine_threadsafe(self.serve(), get_loop())
+        try:
+            self.future.result()
+        except concurrent.futures.CancelledError:
+            # Stopped by stop()
+            pass
+        finally:
+            self.executor.shutdown(wait=False)
+
+    # Stop serving, called from another thread
+    def stop(self):
+        if self.future is not None:
+            self.future.cancel()
+
+    async def serve(self):
+        server = await asyncio.start_server(
+            self._client, sock=self.sock, limit=MAX_HEADER_BYTES,
+            backlog=socket.SOMAXCONN)
+        if self.ready is not None:
+            self.ready.set()
+        async with server:
+            await server.serve_forever()
+
+    # Processor taking the command returned by a handler out of the WSGI
+    # response, to be run by the event loop instead of a pool thread
+    def _detach_command(self, handler):
+        result = handler()
+        if isinstance(result, CommandStream):
+            web.ctx.environ['bbv.command'] = result
+            return b''
+        return result
+
+    # Run the middleware and handler on a pool thread, up to the first
+    # chunk of the body so the status and headers are known
+    def _call_app(self, environ):
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = list(headers)
+
+        body = iter(self.wsgi(environ, start_response))
+        first = next(body, b'')
+        return (response['status'], response['headers'],
+                environ.get('bbv.command'), itertools.chain([first], body))
+
+    async def _client(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError):
+                    break
+                environ = self._parse_head(head, peer)
+                body = await self._read_body(reader, environ) if environ else None
+                if body is None:
+                    writer.write(b'HTTP/1.1 400 Bad Request\r\n'
+                                 b'Content-Length: 0\r\nConnection: close\r\n\r\n')
+                    await writer.drain()
+                    break
+                environ['wsgi.input'] = io.BytesIO(body)
+                if not await self._respond(environ, writer):
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def _parse_head(self, head, peer):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, protocol = lines[0].split(' ')
+        except ValueError:
+            return None
+        if not protocol.startswith('HTTP/1.'):
+            return None
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.ip,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'ACTUAL_SERVER_PROTOCOL': 'HTTP/1.1',
+            'SERVER_SOFTWARE': globaldata.APP_NAME,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, separator, value = line.partition(':')
+            if not separator:
+                return None
+            key = name.strip().upper().replace('-', '_')
+            value = value.strip()
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+                if key in environ:
+                    value = '%s, %s' % (environ[key], value)
+            environ[key] = value
+        return environ
+
+    # Read the request body, returns None when it is malformed
+    async def _read_body(self, reader, environ):
+        try:
+            if 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+                chunks = []
+                while True:
+                    size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                    if size == 0:
+                        # Skip the trailer
+                        while await reader.readuntil(b'\r\n') != b'\r\n':
+                            pass
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readexactly(2)
+                body = b''.join(chunks)
+                environ['CONTENT_LENGTH'] = str(len(body))
+                return body
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            return await reader.readexactly(length) if length > 0 else b''
+        except (ValueError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            return None
+
+    # Send the response to a request, returns False when the connection
+    # has to be closed afterwards
+    async def _respond(self, environ, writer):
+        loop = asyncio.get_running_loop()
+        head = loop.create_future()
+        queue = asyncio.Queue(1)
+        stopped = threading.Event()
+        producer = loop.run_in_executor(
+            self.executor, self._run_app, environ, loop, head, queue, stopped)
+        try:
+            status, headers, command = await head
+        except Exception:
+            traceback.print_exc()
+            status, headers = '500 Internal Server Error', [('Content-Type', 'text/plain')]
+            command, body = None, self._replay([b'internal server error'])
+        else:
+            body = self._iterate(queue, stopped, producer)
+
+        keep_alive = environ['SERVER_PROTOCOL'] == 'HTTP/1.1' and \
+            'close' not in environ.get('HTTP_CONNECTION', '').lower()
+        has_body = environ['REQUEST_METHOD'] != 'HEAD' and \
+            not status.startswith(NO_BODY_STATUS)
+        chunks = None
+        if has_body:
+            if command is None:
+                chunks = body
+            else:
+                headers, chunks = await self._encode_command(environ, status, headers, command)
+        if chunks is not body:
+            # Nothing to send from the WSGI body
+            stopped.set()
+        sized = any(name.lower() == 'content-length' for name, _ in headers)
+        chunked = has_body and not sized and keep_alive
+
+        lines = ['HTTP/1.1 %s' % status]
+        lines.extend('%s: %s' % header for header in headers)
+        lines.append('Date: %s' % formatdate(usegmt=True))
+        if chunked:
+            lines.append('Transfer-Encoding: chunked')
+        if not keep_alive:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        if chunks is not None:
+            try:
+                async for chunk in chunks:
+                    if chunk:
+                        writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                        await writer.drain()
+            finally:
+                # Kills the command when the client went away
+                await chunks.aclose()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        await writer.drain()
+        return keep_alive and (sized or chunked or not has_body)
+
+    # Compress the output of a command like CompressionMiddleware does
+    # for the threaded server: from the first chunk, flushing the
+    # compressor after every chunk so none is held back
+    async def _encode_command(self, environ, status, headers, command):
+        chunks = command.chunks()
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        lowered = {name.lower(): value for name, value in headers}
+        if encoding is None or not compressible(int(status[:3]), lowered):
+            return headers, chunks
+        return encoded_headers(headers, encoding), self._compress(chunks, encoding)
+
+    async def _compress(self, chunks, encoding):
+        compressor = get_compressor(encoding)
+        try:
+            async for chunk in chunks:
+                yield compressor.compress(chunk) + compressor.flush()
+            yield compressor.finish()
+        finally:
+            await chunks.aclose()
+
+    async def _replay(self, buffered):
+        for chunk in buffered:
+            yield chunk
+
+    # Run the middleware and handler, and iterate the body they return,
+    # on one pool thread: web.py keeps the state of a request in thread
+    # locals, and finishes the request when the body is exhausted. The
+    # status and headers are handed over through the head future, and
+    # the chunks through a queue.
+    def _run_app(self, environ, loop, head, queue, stopped):
+        def resolve(result, error):
+            if not head.done():
+                if error is None:
+                    head.set_result(result)
+                else:
+                    head.set_exception(error)
+
+        def put(item):
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while not stopped.is_set():
+                try:
+                    return future.result(POLL_INTERVAL)
+                except concurrent.futures.TimeoutError:
+                    pass
+            future.cancel()
+
+        try:
+            status, headers, command, body = self._call_app(environ)
+        except Exception as e:
+            loop.call_soon_threadsafe(resolve, None, e)
+            return
+        loop.call_soon_threadsafe(resolve, (status, headers, command), None)
+        try:
+            for chunk in body:
+                if stopped.is_set():
+                    break
+                put(chunk)
+        finally:
+            put(None)
+
+    async def _iterate(self, queue, stopped, producer):
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            stopped.set()
+            await producer
@@ -1,21 +1,121 @@
 from bbv import globaldata
 import web
-import sys
+from web.httpserver import LogMiddleware, StaticMiddleware
+from cheroot import wsgi
 import socket
+import errno
+import itertools
+import mimetypes
 import threading
 import time
 import json
+import sys
+from . import routes
 from . import views
+from . import workers
+from . import jobs
+from . import jsonstream
+from . import rawfile
+from .filestore import store
+from .jsonpatch import PatchConflict, apply_patch, merge_patch
+from .commands import CommandStream
+from .compress import CompressionMiddleware
+from .routes import route
+from .utils import parse_range, resolve_path
+from bbv.paths import bind_private_socket, get_runtime_dir
 import os
 
-# Define a custom URL handler class
-class FileHandler(views.url_handler):
-    __url__ = "/api/file"
+# Unix sockets bound by this process, removed when it stops
+unix_sockets = []
+# Servers of this process on unix sockets, by their bbv:// host
+local_servers = {}
+_socket_ids = itertools.count()
+
+# Parse the body of a request changing a file
+def _load_body(method):
+    if method not in ('POST', 'PUT', 'PATCH'):
+        return None
+    return json.loads(web.data().decode())
+
+
+# Run an operation of the /api/file API on a file, through the file
+# store or a transaction of it. Returns the status and the JSON response,
+# or an iterator of the chunks of a large file sent as it is when stream
+# is set. page is the offset and limit of the items of an array to read,
+# and headers gets the headers of the response.
+def run_file_operation(files, method, filename, data=None, pointer=None, content_type='',
+                       page=None, headers=None, stream=False, validate=True):
+    try:
+        if method == 'GET' and page is not None:
+            # Return a page of the items of an array
+            response, count = files.read_items(filename, *page)
+            if headers is not None:
+                headers['X-Total-Count'] = str(count)
+            return '200 OK', response
+        elif method == 'GET':
+            if stream and not pointer:
+                path = files.get_large_file(filename)
+                if path:
+                    # Checked while it is sent, unless validate is false
+                    return '200 OK', jsonstream.stream_file(path, validate)
+            # Return the contents of the file as JSON, or only the value
+            # at a JSON pointer like /a/b/0
+            return '200 OK', files.read(filename, pointer)
+        elif method == 'POST':
+            # Replace the contents of the file with the JSON data
+            files.write(filename, data)
+        elif method == 'PUT':
+            # Update the existing JSON data in the file
+            files.update(filename, data)
+        elif method == 'PATCH':
+            # A JSON Patch is a list of operations, a JSON Merge Patch an
+            # object merged into the document, unless the content type says
+            content_type = content_type.split(';')[0].strip()
+            if content_type == 'application/json-patch+json' or (
+                    content_type != 'application/merge-patch+json' and isinstance(data, list)):
+                files.modify(filename, lambda existing: apply_patch(existing, data))
+            else:
+                files.modify(filename, lambda existing: merge_patch(existing, data))
+        elif method == 'DELETE':
+            # Delete the file
+            files.delete(filename)
+        else:
+            return '405 Method Not Allowed', json.dumps({"error": f"Method {method} not allowed"})
+        return '200 OK', json.dumps({"success": True})
+    except FileNotFoundError as e:
+        if method == 'POST':
+            # The directory of the file is missing
+            return '500 Internal Server Error', json.dumps({"error": str(e)})
+        # If the file is not found, return an error response
+        return '404 Not Found', json.dumps({"error": f"File {filename} not found"})
+    except (json.JSONDecodeError, jsonstream.InvalidJSON):
+        # If the file contains invalid JSON, return an error response
+        return '400 Bad Request', json.dumps({"error": f"Could not decode JSON in {filename}"})
+    except PatchConflict as e:
+        # The pointer is not found, or the patch doesn't apply to the
+        # document and nothing is changed
+        status = '404 Not Found' if method == 'GET' else '409 Conflict'
+        return status, json.dumps({"error": str(e)})
+    except ValueError as e:
+        # An invalid patch or pointer, or a page of a file that is not an array
+        return '400 Bad Request', json.dumps({"error": str(e)})
+    except Exception as e:
+        # If any other exception occurs, return an error response
+        return '500 Internal Server Error', json.dumps({"error": str(e)})
 
+
+# Reads of /api/file waiting for data to be appended to a file
+followers = threading.BoundedSemaphore(globaldata.FILE_FOLLOWERS)
+
+
+# Define a custom URL handler class. The files are kept parsed in memory
+# by the file store, which writes changes back before responding.
+@route('/api/file')
+class FileHandler(views.url_handler):
     def resolve_filename(self, filename):
-        """Resolve $HOME to the home directory."""
+        """Resolve $HOME to the home directory, and relative names to the app directory."""
         home_dir = os.path.expanduser("~")
-        return filename.replace("$HOME", home_dir)
+        return resolve_path(filename.replace("$HOME", home_dir))
 
     def handle_request(self, method):
         # Get the filename from the request parameters
@@ -25,155 +125,443 @@ class FileHandler(views.url_handler):
             # If no filename is specified, return an error response
             web.ctx.status = '400 Bad Request'
             return json.dumps({"error": "No filename specified"})
-        
+
         # Resolve $HOME in the filename
         filename = self.resolve_filename(filename)
 
-        # Delegate to the actual HTTP method
-        return method(filename)
-
-    def GET(self):
-        def method(filename):
+        file_format = params.get('format') or 'json'
+        if file_format != 'json':
+            if file_format not in ('raw', 'text', 'ndjson'):
+                web.ctx.status = '400 Bad Request'
+                return json.dumps({"error": f"Unknown format {file_format}"})
+            if method != 'GET':
+                web.ctx.status = '405 Method Not Allowed'
+                return json.dumps({"error": f"Files in {file_format} format can only be read"})
             try:
-                # Read the contents of the file and return as JSON
-                with open(filename, 'r') as f:
-                    data = json.load(f)
-                return json.dumps(data)
+                return self.read_file(filename, file_format, params)
+            except jsonstream.InvalidJSON as e:
+                web.ctx.status = '400 Bad Request'
+                return json.dumps({"error": f"Could not decode JSON in {filename}: {e}"})
+            except ValueError:
+                web.ctx.status = '400 Bad Request'
+                return json.dumps({"error": "Invalid offset, length, limit or wait"})
             except FileNotFoundError:
-                # If the file is not found, return an error response
                 web.ctx.status = '404 Not Found'
                 return json.dumps({"error": f"File {filename} not found"})
-            except json.JSONDecodeError:
-                # If the file contains invalid JSON, return an error response
-                web.ctx.status = '400 Bad Request'
-                return json.dumps({"error": f"Could not decode JSON in {filename}"})
-            except Exception as e:
-                # If any other exception occurs, return an error response
+            except OSError as e:
                 web.ctx.status = '500 Internal Server Error'
                 return json.dumps({"error": str(e)})
-        return self.handle_request(method)
 
-    def POST(self):
-        def method(filename):
-            # Parse the JSON data from the request body
-            data = json.loads(web.data().decode())
-            try:
-                # Write the JSON data to the file
-                with open(filename, 'w') as f:
-                    json.dump(data, f)
-                return json.dumps({"success": True})
-            except Exception as e:
-                # If any exception occurs, return an error response
-                web.ctx.status = '500 Internal Server Error'
-                return json.dumps({"error": str(e)})
-        return self.handle_request(method)
+        try:
+            data = _load_body(method)
+        except ValueError:
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "Could not decode the JSON data"})
 
-    def PUT(self):
-        def method(filename):
-            # Parse the JSON data from the request body
-            data = json.loads(web.data().decode())
+        page = None
+        if method == 'GET':
             try:
-                # Update the existing JSON data in the file
-                with open(filename, 'r+') as f:
-                    existing_data = json.load(f)
-                    existing_data.update(data)
-                    f.seek(0)
-                    json.dump(existing_data, f)
-                    f.truncate()
-                return json.dumps({"success": True})
-            except FileNotFoundError:
-                # If the file is not found, return an error response
-                web.ctx.status = '404 Not Found'
-                return json.dumps({"error": f"File {filename} not found"})
-            except json.JSONDecodeError:
-                # If the file contains invalid JSON, return an error response
+                page = self.get_page(params)
+            except ValueError:
                 web.ctx.status = '400 Bad Request'
-                return json.dumps({"error": f"Could not decode JSON in {filename}"})
-            except Exception as e:
-                # If any other exception occurs, return an error response
-                web.ctx.status = '500 Internal Server Error'
-                return json.dumps({"error": str(e)})
-        return self.handle_request(method)
+                return json.dumps({"error": "Invalid offset or limit"})
+
+        headers = {}
+        web.ctx.status, response = run_file_operation(
+            store, method, filename, data, params.get('pointer'),
+            web.ctx.env.get('CONTENT_TYPE', ''), page, headers, stream=True,
+            validate=params.get('validate', '') not in ('0', 'false'))
+        for name, value in headers.items():
+            web.header(name, value)
+        return response
+
+    # Items offset to offset + limit of an array, all the rest by
+    # default, or None when neither is given
+    def get_page(self, params):
+        if not params.get('offset') and not params.get('limit'):
+            return None
+        offset, limit = int(params.get('offset') or 0), int(params.get('limit') or sys.maxsize)
+        if offset < 0 or limit < 0:
+            raise ValueError('Invalid offset or limit')
+        return offset, limit
+
+    # Read a file that is not a JSON document: records of a JSON Lines
+    # file, or bytes of any file sent as they are
+    def read_file(self, filename, file_format, params):
+        if file_format == 'ndjson':
+            page = self.get_page(params) or (0, sys.maxsize)
+            response, count = jsonstream.read_lines(filename, *page)
+            web.header('Content-Type', 'application/json')
+            web.header('X-Total-Count', str(count))
+            return response
+
+        # offset and length select the bytes to read, a negative offset
+        # counts from the end of the file. With wait, a read at the end
+        # of the file waits up to that many seconds for data to be
+        # appended, so pages follow a growing file like tail -f.
+        offset = int(params['offset']) if params.get('offset') else None
+        length = int(params['length']) if params.get('length') else None
+        wait = float(params.get('wait') or 0)
+        if (length is not None and length < 0) or not 0 <= wait < float('inf'):
+            raise ValueError('Invalid length or wait')
+        if offset is None or offset < 0:
+            wait = 0
+        # Each read waiting holds a server thread, only a few may wait at
+        # once so they can't take all of them
+        if wait and not followers.acquire(blocking=False):
+            web.ctx.status = '429 Too Many Requests'
+            web.header('Content-Type', 'application/json')
+            web.header('Retry-After', '1')
+            return json.dumps({"error": "Too many reads are waiting for data"})
+        try:
+            deadline = time.monotonic() + min(wait, globaldata.FILE_FOLLOW_TIMEOUT)
+            while True:
+                f = open(filename, 'rb')
+                try:
+                    byte_range = self.get_range(f, file_format, offset, length, wait)
+                except BaseException:
+                    f.close()
+                    raise
+                if byte_range is None:
+                    f.close()
+                    return ''
+                start, stop = byte_range
+                if start < stop or not wait or time.monotonic() >= deadline:
+                    break
+                f.close()
+                time.sleep(globaldata.FILE_FOLLOW_INTERVAL)
+        finally:
+            if wait:
+                followers.release()
+
+        mimetype = mimetypes.guess_type(filename)[0]
+        web.header('Accept-Ranges', 'bytes')
+        # Where the next read of a growing file starts
+        web.header('X-Next-Offset', str(stop))
+        chunks = rawfile.read_range(f, start, stop)
+        if file_format == 'text':
+            if not mimetype or not mimetype.startswith('text/'):
+                mimetype = 'text/plain'
+            web.header('Content-Type', mimetype + '; charset=UTF-8')
+            return rawfile.decode_text(chunks)
+        web.header('Content-Type', mimetype or 'application/octet-stream')
+        web.header('Content-Length', str(stop - start))
+        return chunks
+
+    # Bytes start to stop of a file to read, from offset and length or
+    # the Range header, or None when the range can't be satisfied
+    def get_range(self, f, file_format, offset, length, wait):
+        size = os.fstat(f.fileno()).st_size
+        start, stop = 0, size
+        if offset is not None or length is not None:
+            offset = offset or 0
+            if offset < 0:
+                start = max(size + offset, 0)
+            elif offset <= size:
+                start = offset
+            elif wait:
+                # Truncated or replaced since the last read, read it
+                # again from the start
+                start = 0
+            else:
+                start = size
+            if length is not None:
+                stop = min(start + length, size)
+        else:
+            byte_range = parse_range(web.ctx.env.get('HTTP_RANGE'), size)
+            if byte_range is False:
+                web.ctx.status = '416 Range Not Satisfiable'
+                web.header('Content-Range', 'bytes */%d' % size)
+                return None
+            if byte_range:
+                start, stop = byte_range[0], byte_range[1] + 1
+                web.ctx.status = '206 Partial Content'
+                web.header('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size))
+                return start, stop
+        if file_format == 'text':
+            return rawfile.align_text(f, start, stop)
+        return start, stop
+
+    def GET(self):
+        return self.handle_request('GET')
+
+    def POST(self):
+        return self.handle_request('POST')
+
+    def PUT(self):
+        return self.handle_request('PUT')
+
+    def PATCH(self):
+        return self.handle_request('PATCH')
 
     def DELETE(self):
-        def method(filename):
-            try:
-                # Delete the file
-                os.remove(filename)
-                return json.dumps({"success": True})
-            except FileNotFoundError:
-                # If the file is not found, return an error response
-                web.ctx.status = '404 Not Found'
-                return json.dumps({"error": f"File {filename} not found"})
-            except Exception as e:
-                # If any other exception occurs, return an error response
-                web.ctx.status = '500 Internal Server Error'
-                return json.dumps({"error": str(e)})
-        return self.handle_request(method)
+        return self.handle_request('DELETE')
+
+
+# Several /api/file operations in one request, run in order. Each one is
+# an object with the method, filename, body, pointer and content_type
+# of the request it replaces. With transaction, the changes are made
+# only when all the operations succeed.
+@route('/api/batch')
+class BatchHandler(FileHandler):
+    def POST(self):
+        try:
+            batch = json.loads(web.data().decode())
+        except ValueError:
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "Could not decode the JSON data"})
+        transaction = web.input().get('transaction', '') not in ('', '0', 'false')
+        if isinstance(batch, dict):
+            transaction = bool(batch.get('transaction', transaction))
+            batch = batch.get('operations')
+        if not isinstance(batch, list):
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "Expected an array of operations"})
+
+        operations = []
+        for operation in batch:
+            if not isinstance(operation, dict) or not isinstance(operation.get('filename'), str) \
+                    or not operation['filename'] or not isinstance(operation.get('method', 'GET'), str):
+                web.ctx.status = '400 Bad Request'
+                return json.dumps({"error": f"Invalid operation {json.dumps(operation)}"})
+            operations.append((
+                operation.get('method', 'GET').upper(),
+                self.resolve_filename(operation['filename']),
+                operation.get('body'),
+                operation.get('pointer'),
+                operation.get('content_type', ''),
+            ))
+
+        if not transaction:
+            results = [run_file_operation(store, *operation) for operation in operations]
+            return self.respond(results)
+
+        try:
+            with store.transaction([operation[1] for operation in operations]) as files:
+                results = []
+                for operation in operations:
+                    status, response = run_file_operation(files, *operation)
+                    results.append((status, response))
+                    if not status.startswith('2'):
+                        # Nothing is changed, and the rest is not run
+                        web.ctx.status = status
+                        skipped = json.dumps({"error": "Not run, the transaction failed"})
+                        results.extend(('424 Failed Dependency', skipped)
+                                       for _ in range(len(operations) - len(results)))
+                        return self.respond(results)
+                files.commit()
+        except OSError as e:
+            # A change could not be written to its file
+            web.ctx.status = '500 Internal Server Error'
+            return json.dumps({"error": str(e)})
+        return self.respond(results)
+
+    # Join the JSON responses of the operations without parsing them again
+    def respond(self, results):
+        web.header('Content-Type', 'application/json')
+        return '[%s]' % ', '.join('{"status": %d, "body": %s}' % (int(status.split()[0]), response)
+                                  for status, response in results)
+
+    def GET(self):
+        raise web.nomethod()
+
+    PUT = PATCH = DELETE = GET
+
+
+# cheroot server accepting connections on an already listening socket
+class PreboundWSGIServer(wsgi.Server):
+    def __init__(self, sock, wsgi_app):
+        super().__init__(sock.getsockname(), wsgi_app, server_name='localhost')
+        self.prebound = sock
+        self.request_queue_size = socket.SOMAXCONN
+
+    def bind(self, family, type, proto=0):
+        self.socket = self.prebound
+        return self.socket
+
+    def bind_unix_socket(self, bind_addr):
+        self.socket = self.prebound
+        return self.socket
 
 # Define a custom server class
 class Server(threading.Thread):
-    def _get_subclasses(self, classes=None):
-        """ Get subclasses recursively """
-        if classes is None:
-            classes = views.url_handler.__subclasses__()
-        result = classes
-        for cls in classes:
-            result += self._get_subclasses(cls.__subclasses__())
-        return result
-
-    def get_urls(self):
-        """ Return supported URLs. """
-        classes = self._get_subclasses()
-        result = ["/api/file", "FileHandler"]
-        for cls in classes:
-            result.append(cls.__url__)
-            result.append(cls.__name__)
-        return tuple(result)
-
-    def get_classes(self):
-        """ Return all view classes. """
-        classes = self._get_subclasses()
-        classes.append(FileHandler)  # Add the new class
-        result = {}
-        for cls in classes:
-            result[cls.__name__] = cls
-        return result
+    def __init__(self, sock, workdir=None, environ=None):
+        super().__init__()
+        self.sock = sock
+        if sock.family == socket.AF_UNIX:
+            self.socket_path = sock.getsockname()
+            self.port = None
+            # The socket name is the host of the app in bbv:// URLs
+            self.host = os.path.basename(self.socket_path)[:-len('.sock')]
+            self.url = 'bbv://%s' % self.host
+            local_servers[self.host] = self
+        else:
+            self.socket_path = None
+            self.host = None
+            self.port = sock.getsockname()[1]
+            self.url = 'http://%s:%s' % (sock.getsockname()[0], self.port)
+        # Directory and environment of the app, when they are not the ones
+        # of this process (servers started by the daemon for other apps)
+        self.workdir = workdir
+        self.environ = environ
+        # Called by the close option instead of ending the process
+        self.on_close = None
+        # Set once the server accepts connections, or failed to start
+        self.ready = threading.Event()
+        self.error = None
+        # The cheroot or asyncio server serving the app
+        self.backend = None
 
     def run(self):
         """ Run the webserver """
-        ip = globaldata.ADDRESS
-        port = globaldata.PORT
-        sys.argv = [sys.argv[0], '']
-        sys.argv[1] = ':'.join((ip, str(port)))
+        self.app = routes.Application(routes.table)
+        self.app.add_processor(web.loadhook(self.load_context))
+        try:
+            if globaldata.BACKEND == 'asyncio':
+                from .aserver import AsyncServer
+                self.backend = AsyncServer(self.app, self.sock, self.ready)
+                self.backend.run()
+            else:
+                self.serve_threaded()
+        except BaseException as e:
+            self.error = e
+            raise
+        finally:
+            self.ready.set()
+
+    def find_static_file(self, path):
+        """ Return the file a request for path is answered with unchanged, or None """
+        workdir = self.workdir or os.getcwd()
+        if path.startswith('/static/'):
+            # Served as they are by StaticMiddleware
+            filename = os.path.join(workdir, path[1:])
+            if os.path.isfile(filename):
+                return filename, mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            return None
+        if routes.table.match(path)[0] is not views.default_handler:
+            return None
+        return views.find_static_file(workdir, path)
 
-        urls = self.get_urls()
-        classes = self.get_classes()
-        self.app = web.application(urls, classes)
-        self.app.run()
+    def load_context(self):
+        """ Expose the app settings to the handlers of a request """
+        web.ctx.bbv_port = self.port
+        web.ctx.bbv_socket = self.socket_path
+        if self.workdir:
+            web.ctx.bbv_workdir = self.workdir
+        if self.environ is not None:
+            web.ctx.bbv_environ = self.environ
+        if self.on_close:
+            web.ctx.bbv_close = self.on_close
+
+    def track_command(self, handler):
+        """ Record the command a handler returns, for the middleware to stop it """
+        result = handler()
+        if isinstance(result, CommandStream):
+            web.ctx.environ['bbv.stream'] = result
+        return result
+
+    def serve_threaded(self):
+        """ Run the app on web.py's cheroot server, signaling when it serves """
+        self.app.add_processor(self.track_command)
+        func = self.app.wsgifunc(CompressionMiddleware)
+        func = LogMiddleware(StaticMiddleware(func))
+        server = web.httpserver.server = self.backend = PreboundWSGIServer(self.sock, func)
+        server.prepare()
+        self.ready.set()
+        try:
+            server.serve()
+        except (KeyboardInterrupt, SystemExit):
+            server.stop()
+
+    def shutdown(self):
+        """ Stop serving this app, leaving the other servers of the process running """
+        if self.backend is not None:
+            self.backend.stop()
+        if self.socket_path:
+            local_servers.pop(self.host, None)
+            try:
+                unix_sockets.remove(self.socket_path)
+                os.unlink(self.socket_path)
+            except (ValueError, FileNotFoundError):
+                pass
 
     def stop(self):
+        workers.stop_pool()
+        jobs.manager.stop()
+        store.flush()
+        for path in unix_sockets:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
         os.kill(os.getpid(), 15)
 
-# Function to run the server
-def run_server(ip='127.0.0.1', background=True):
-    # Find an available port to bind the server
-    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    for port in range(19000, 19100):
+# Bind the listening socket of the server, on the first free port of
+# the usual range or on any free port when they are all taken. The
+# socket listens right away and is handed to the server as it is, so
+# no other process can take the port in between.
+def bind_socket(ip):
+    for port in list(range(19000, 19100)) + [0]:
+        soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            soc.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # Another process may bind the same port with SO_REUSEADDR
+            # until one of them listens, so a port is only ours once
+            # listen() succeeds
             soc.bind((ip, port))
+            soc.listen(socket.SOMAXCONN)
+            return soc
+        except OSError as e:
             soc.close()
-            break
-        except socket.error as e:
-            if e.errno != 98:
-                raise socket.error(e)
-            print('Port %d already in use, trying next one' % port)
+            if e.errno != errno.EADDRINUSE:
+                raise
+
+# Bind the listening socket of a server to a unix socket in the user's
+# runtime directory, which only the user can connect to. The webview
+# reaches it through the bbv:// scheme instead of TCP.
+def bind_unix_socket():
+    path = os.path.join(get_runtime_dir(), 'app-%d-%d.sock' % (os.getpid(), next(_socket_ids)))
+    try:
+        # Left over by a process that had the same pid
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        bind_private_socket(soc, path)
+        soc.listen(socket.SOMAXCONN)
+    except OSError:
+        soc.close()
+        raise
+    unix_sockets.append(path)
+    return soc
+
+# Find a static file of an app served by this process, for the UI to
+# read directly. Returns its path and content type, or None when the
+# request has to go through the server.
+def find_static_file(host, path):
+    server = local_servers.get(host)
+    if server is None:
+        return None
+    return server.find_static_file(path)
 
+# Function to run the server. The daemon runs additional servers for
+# apps started from another directory or environment.
+def run_server(ip='127.0.0.1', background=True, workdir=None, environ=None):
     globaldata.ADDRESS = ip
-    globaldata.PORT = port
+    if globaldata.TRANSPORT == 'unix':
+        sock = bind_unix_socket()
+    else:
+        sock = bind_socket(ip)
+        if workdir is None:
+            globaldata.PORT = sock.getsockname()[1]
 
-    server = Server()
+    # Pre-start the bash workers used by execute requests
+    if workers.pool is None:
+        workers.start_pool(globaldata.WORKERS, globaldata.WORKER_REQUESTS)
+
+    server = Server(sock, workdir, environ)
 
     if not background:
         web.config.debug = True
@@ -182,18 +570,10 @@ def run_server(ip='127.0.0.1', background=True):
     server.daemon = True
     web.config.debug = False
     server.start()
-    time.sleep(0.05)
-    # Wait for server to respond...
-    while True:
-        try:
-            con = socket.create_connection((ip, port))
-            con.close()
-            break
-        except socket.error as e:
-            if e.errno != 111:
-                raise socket.error(e)
-            print('Waiting for server...')
-            time.sleep(0.05)
+    # Wait for the server to listen
+    server.ready.wait()
+    if server.error is not None:
+        raise server.error
 
     return server
 
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from bbv import globaldata
+from .utils import parse_duration
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+# Cache policy declared by include options or script directives:
+#   cache=30s          keep the result for 30 seconds
+#   cache / cache=mtime keep the result until a watched file changes, or
+#                      for CACHE_TTL seconds when no file is watched
+#   watch=/a,/b        files whose modification invalidates the result
+# Returns (ttl, watched paths), or None when caching was not requested.
+def get_policy(options, path=None):
+    value = options.get('cache')
+    watch = options.get('watch')
+    if not value and not watch:
+        return None
+
+    ttl = None
+    if value not in (None, True, 'mtime'):
+        ttl = parse_duration(value)
+        if ttl is None:
+            return None
+
+    paths = [p for p in watch.split(',') if p] if isinstance(watch, str) else []
+    if path:
+        paths.append(path)
+    # Nothing would ever refresh the result
+    if ttl is None and not paths:
+        ttl = globaldata.CACHE_TTL
+    return ttl, tuple(paths)
+
+
+# LRU bounded cache of command outputs, invalidated by age or by the
+# modification time of the files they depend on
+class ResultCache(object):
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires, stamps = entry
+            if (expires is not None and time.monotonic() >= expires) or \
+                    any(_mtime(path) != mtime for path, mtime in stamps):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None, watch=()):
+        if len(value) > self.max_bytes:
+            return
+        expires = time.monotonic() + ttl if ttl is not None else None
+        stamps = tuple((path, _mtime(path)) for path in watch)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires, stamps)
+            self._size += len(value)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def _remove(self, key):
+        value = self._entries.pop(key)[0]
+        self._size -= len(value)
+
+
+results = ResultCache(globaldata.RESULT_CACHE_ENTRIES, globaldata.RESULT_CACHE_BYTES)
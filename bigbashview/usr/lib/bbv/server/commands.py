@@ -0,0 +1,204 @@
+import os
+import subprocess
+from shutil import which
+from . import cache
+from . import workers
+
+# Maximum size of each output chunk read from a command
+CHUNK_SIZE = 64 * 1024
+
+# Lines of command output that carry a named event
+EVENT_PREFIX = b'::bbv-event '
+
+
+def _get_bash():
+    bash_bin = which("bash")
+    return bash_bin if bash_bin is not None else "/bin/bash"
+
+
+# The output of a command, returned by handlers instead of a plain
+# generator so each server backend can run it its own way: the threaded
+# server iterates it, blocking its thread on a warm bash worker or a new
+# shell, while the asyncio server awaits an asyncio subprocess through
+# chunks(). Filters transform the output the same way on both paths.
+class CommandStream(object):
+    def __init__(self, command, root, variables, isolate=False, cwd=None, environ=None):
+        self.command = command
+        self.root = root
+        self.variables = variables
+        self.isolate = isolate
+        self.cwd = cwd or os.getcwd()
+        self.environ = os.environ if environ is None else environ
+        self.filters = []
+        self.status = None
+        self._iterator = None
+
+    def add_filter(self, output_filter):
+        self.filters.append(output_filter)
+        return self
+
+    def _get_command(self):
+        if self.root:
+            return f'{_get_bash()} {self.command}'
+        return self.command
+
+    def _get_env(self):
+        env = dict(self.environ)
+        env.update(self.variables)
+        return env
+
+    def _feed(self, chunk):
+        for output_filter in self.filters:
+            chunk = output_filter.feed(chunk)
+        return chunk
+
+    def _finish(self, status):
+        self.status = status
+        tail = b''
+        for output_filter in self.filters:
+            tail = output_filter.feed(tail) + output_filter.finish(status)
+        return tail
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = self._run()
+        return next(self._iterator)
+
+    def close(self):
+        if self._iterator is not None:
+            self._iterator.close()
+
+    def _run(self):
+        # Commands run on a warm bash worker unless they need isolation
+        # or an environment other than the one the workers started with
+        if workers.pool is not None and not self.root and not self.isolate and \
+                self.environ is os.environ:
+            source = workers.pool.run(self.command, self.variables, self._run_oneshot, self.cwd)
+        else:
+            source = self._run_oneshot()
+        try:
+            while True:
+                try:
+                    chunk = next(source)
+                except StopIteration as stop:
+                    status = stop.value
+                    break
+                chunk = self._feed(chunk)
+                if chunk:
+                    yield chunk
+        finally:
+            source.close()
+        tail = self._finish(status)
+        if tail:
+            yield tail
+
+    # Execute the command in a new shell process
+    def _run_oneshot(self):
+        po = subprocess.Popen(
+            self._get_command(),
+            stdin=None,
+            stdout=subprocess.PIPE,
+            shell=True,
+            cwd=self.cwd,
+            env=self._get_env(),
+            bufsize=0
+        )
+        try:
+            while True:
+                # Unbuffered read, returns as soon as any output is available
+                chunk = po.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            return po.wait()
+        finally:
+            po.stdout.close()
+            # The client went away before the script finished
+            if po.poll() is None:
+                po.kill()
+                po.wait()
+
+    # Run the command as an asyncio subprocess and yield its output,
+    # without holding a thread while it runs
+    async def chunks(self):
+        # Only used by the asyncio server, which has imported it already
+        import asyncio
+        po = await asyncio.create_subprocess_exec(
+            '/bin/sh', '-c', self._get_command(),
+            stdout=asyncio.subprocess.PIPE,
+            cwd=self.cwd,
+            env=self._get_env()
+        )
+        try:
+            while True:
+                chunk = await po.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunk = self._feed(chunk)
+                if chunk:
+                    yield chunk
+            status = await po.wait()
+        finally:
+            if po.returncode is None:
+                po.kill()
+                await po.wait()
+        tail = self._finish(status)
+        if tail:
+            yield tail
+
+
+# Keep the output of a command in the result cache if it succeeds.
+# Output larger than the cache can hold is dropped as soon as it
+# passes the limit, instead of being kept until the command ends.
+class CacheFilter(object):
+    def __init__(self, key, policy):
+        self.key = key
+        self.policy = policy
+        self._chunks = []
+        self._size = 0
+        self._too_large = False
+
+    def feed(self, chunk):
+        if not self._too_large:
+            self._size += len(chunk)
+            if self._size > cache.results.max_bytes:
+                self._too_large = True
+                self._chunks = []
+            else:
+                self._chunks.append(chunk)
+        return chunk
+
+    def finish(self, status):
+        if status == 0 and not self._too_large:
+            cache.results.put(self.key, b''.join(self._chunks), *self.policy)
+        return b''
+
+
+# Frame the output of a command as Server-Sent Events, one per complete
+# line. Lines like "::bbv-event name data" become events of that name,
+# and a final bbv-exit event carries the exit status.
+class EventFilter(object):
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, chunk):
+        lines = (self._pending + chunk).split(b'\n')
+        self._pending = lines.pop()
+        return b''.join(self._format_event(line) for line in lines)
+
+    def finish(self, status):
+        events = self._format_event(self._pending) if self._pending else b''
+        self._pending = b''
+        exit_status = b'' if status is None else str(status).encode()
+        return events + b'event: bbv-exit\ndata: %s\n\n' % exit_status
+
+    def _format_event(self, line):
+        line = line.rstrip(b'\r')
+        if line.startswith(EVENT_PREFIX):
+            name, _, data = line[len(EVENT_PREFIX):].partition(b' ')
+            if name:
+                return b'event: %s\ndata: %s\n\n' % (name, data)
+        return b'data: %s\n\n' % line
@@ -0,0 +1,210 @@
+import zlib
+from bbv import globaldata
+from .cache import ResultCache
+
+# Brotli is optional, gzip is used when it isn't installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content types that are already compressed
+SKIP_TYPES = ('image/', 'audio/', 'video/', 'font/woff',
+              'application/zip', 'application/gzip', 'application/x-gzip',
+              'application/x-bzip2', 'application/x-xz', 'application/zstd',
+              'application/x-7z-compressed', 'application/x-rar-compressed',
+              'application/pdf', 'application/octet-stream',
+              # Events must reach the page as soon as they are written
+              'text/event-stream')
+
+# Compressed bodies of responses with an ETag, keyed by URL, ETag and
+# encoding, so static files are only compressed once per version
+compressed = ResultCache(globaldata.COMPRESS_CACHE_ENTRIES, globaldata.COMPRESS_CACHE_BYTES)
+
+
+# Pick the preferred encoding accepted by the client, if any
+def negotiate(accept_encoding):
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for name in (('br', 'gzip') if brotli else ('gzip',)):
+        if accepted.get(name, accepted.get('*', 0)) > 0:
+            return name
+    return None
+
+
+class _GzipCompressor(object):
+    def __init__(self):
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor(object):
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=5)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+def get_compressor(encoding):
+    return _BrotliCompressor() if encoding == 'br' else _GzipCompressor()
+
+
+# Whether a response with the given status code and lower-cased headers
+# is worth compressing
+def compressible(status, headers):
+    if status != 200 or 'content-encoding' in headers or 'content-range' in headers:
+        return False
+    content_type = headers.get('content-type', '').lower()
+    if not content_type:
+        return False
+    if content_type.startswith('image/svg+xml'):
+        return True
+    return not content_type.startswith(SKIP_TYPES)
+
+
+# Headers of the compressed variant of a response
+def encoded_headers(headers, encoding, etag=None):
+    headers = _set_header(headers, 'Content-Length', None)
+    headers = _set_header(headers, 'Content-Encoding', encoding)
+    headers = _set_header(headers, 'Vary', 'Accept-Encoding')
+    if etag:
+        headers = _set_header(headers, 'ETag', _encode_etag(etag, encoding))
+    return headers
+
+
+def _set_header(headers, name, value):
+    headers = [h for h in headers if h[0].lower() != name.lower()]
+    if value is not None:
+        headers.append((name, value))
+    return headers
+
+
+# ETags identify the encoded variant, e.g. "abc" becomes "abc-gzip"
+def _encode_etag(etag, encoding):
+    return '"%s-%s"' % (etag.strip('" '), encoding)
+
+
+# Map the ETags of encoded variants back to the identity version
+def _decode_etags(if_none_match, encoding):
+    suffix = '-%s"' % encoding
+    etags = []
+    for etag in if_none_match.split(','):
+        etag = etag.strip()
+        if etag.endswith(suffix):
+            etag = etag[:-len(suffix)] + '"'
+        etags.append(etag)
+    return ', '.join(etags)
+
+
+# WSGI middleware compressing response bodies with the encoding
+# negotiated from Accept-Encoding. Bodies of unknown length are
+# compressed from their first chunk and flushed after every chunk, so
+# streamed script output still reaches the client right away.
+class CompressionMiddleware(object):
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            body = self.app(environ, start_response)
+            return self._close_after(environ, body, body)
+
+        # Let the application validate the ETag of the identity version
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        revalidating = '-%s"' % encoding in if_none_match
+        if revalidating:
+            environ['HTTP_IF_NONE_MATCH'] = _decode_etags(if_none_match, encoding)
+
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+
+        body = self.app(environ, capture)
+        return self._close_after(environ, self._respond(
+            environ, start_response, response, body, encoding, revalidating), body)
+
+    # Close the body of the application once the response is sent or
+    # the client went away, as WSGI requires, and the command producing
+    # it, which the body returned by web.py doesn't pass the close on to,
+    # so the command is stopped right away
+    def _close_after(self, environ, chunks, body):
+        try:
+            yield from chunks
+        finally:
+            for closable in (body, environ.get('bbv.stream')):
+                if hasattr(closable, 'close'):
+                    closable.close()
+
+    def _respond(self, environ, start_response, response, body, encoding, revalidating):
+        status, headers = response['status'], list(response['headers'])
+        lowered = {name.lower(): value for name, value in headers}
+        etag = lowered.get('etag')
+
+        if status.startswith('304'):
+            if etag and revalidating:
+                headers = _set_header(headers, 'ETag', _encode_etag(etag, encoding))
+            start_response(status, headers)
+            yield from body
+            return
+
+        length = lowered.get('content-length')
+        min_size = globaldata.COMPRESS_MIN_BYTES
+        # The asyncio server compresses the commands it runs itself
+        if 'bbv.command' in environ or not compressible(int(status[:3]), lowered) or \
+                (length is not None and int(length) < min_size):
+            start_response(status, headers)
+            yield from body
+            return
+
+        compressed_headers = encoded_headers(headers, encoding, etag)
+
+        # Whole bodies with a validator are compressed once per version
+        if etag and length is not None and int(length) <= compressed.max_bytes:
+            key = (environ.get('PATH_INFO'), environ.get('QUERY_STRING'), etag, encoding)
+            data = compressed.get(key)
+            if data is None:
+                compressor = get_compressor(encoding)
+                data = b''.join(compressor.compress(chunk) for chunk in body) + compressor.finish()
+                compressed.put(key, data)
+            start_response(status, _set_header(compressed_headers, 'Content-Length', str(len(data))))
+            yield data
+            return
+
+        # Streamed bodies are not held back to see if they are worth
+        # compressing, the first chunk has to reach the page right away
+        start_response(status, compressed_headers)
+        compressor = get_compressor(encoding)
+        for chunk in body:
+            data = compressor.compress(chunk)
+            if length is None:
+                data += compressor.flush()
+            yield data
+        yield compressor.finish()
@@ -0,0 +1,400 @@
+from bbv import globaldata
+from . import jsonpatch
+from . import jsonstream
+import json
+import os
+import threading
+
+
+# A JSON file of the /api/file API, kept parsed in memory. Changes are
+# made to the parsed document and written to the file before the
+# request that made them returns. Changes made while the file is being
+# written are written together by the next write.
+class Document(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # Held while the file is written, taken before lock
+        self.write_lock = threading.Lock()
+        # Parsed content, and its serialization once requested
+        self.data = None
+        self.text = None
+        # Identity of the file the content was read from or written to
+        self.stat = None
+        # Changed in memory and not written yet
+        self.dirty = False
+        # Number of the last change, and of the last one in the file
+        self.version = 0
+        self.written = 0
+        # Numbers of the changes lost by the last write that failed, the
+        # ones after the first and up to the last, and why
+        self.failed = (0, 0)
+        self.error = None
+        # Requests using the document, which keep it in the store
+        self.users = 0
+
+
+def _get_stat(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+# Operations on the files of the store, on top of the methods getting
+# and setting the content of a locked document
+class FileOperations(object):
+    # Return the serialized content of a file, or of the value at a JSON
+    # pointer in it
+    def read(self, path, pointer=None):
+        document = self._acquire(path)
+        try:
+            if not pointer:
+                return self._get_text(document)
+            data = self._get_data(document)
+        finally:
+            self._release(document)
+        # Documents are replaced on change, never changed in place
+        return json.dumps(jsonpatch.resolve(data, pointer))
+
+    # Return the path of a file to send as it is, when it is too large to
+    # be read in memory and has no change in memory, or None
+    def get_large_file(self, path):
+        document = self._acquire(path)
+        try:
+            return document.path if self._is_large(document) else None
+        finally:
+            self._release(document)
+
+    # Return the JSON array of the items offset to offset + limit of the
+    # array in a file, and the number of items in the array. The array of
+    # a large file is read from the file through an index of its items.
+    def read_items(self, path, offset, limit):
+        document = self._acquire(path)
+        try:
+            large = self._is_large(document)
+            if not large:
+                data = self._get_data(document)
+        finally:
+            self._release(document)
+        if large:
+            return jsonstream.indexes.read_items(document.path, offset, limit)
+        if not isinstance(data, list):
+            raise ValueError('JSON in %s is not an array' % path)
+        return json.dumps(data[offset:offset + limit]), len(data)
+
+    # Replace the content of a file, creating it if needed
+    def write(self, path, data):
+        document = self._acquire(path)
+        try:
+            version = self._put(document, data)
+        finally:
+            self._release(document)
+        self._sync(document, version)
+
+    # Replace the content of a file with change(content)
+    def modify(self, path, change):
+        document = self._acquire(path)
+        try:
+            version = self._put(document, change(self._get_data(document)))
+        finally:
+            self._release(document)
+        self._sync(document, version)
+
+    # Add the keys of data to the object in a file
+    def update(self, path, data):
+        def update(existing):
+            if not isinstance(existing, dict):
+                raise TypeError('JSON in %s is not an object' % path)
+            existing = dict(existing)
+            existing.update(data)
+            return existing
+        self.modify(path, update)
+
+    def delete(self, path):
+        document = self._acquire(path)
+        try:
+            self._remove(document)
+        finally:
+            self._release(document)
+
+
+# The documents of the files read or changed recently, up to
+# max_entries of them besides the ones in use
+class FileStore(FileOperations):
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.documents = {}
+        self.lock = threading.Lock()
+
+    # Return the document of a file, in use until it is passed to
+    # _put_document()
+    def _get_document(self, path):
+        # Symbolic links are resolved so the rename replaces their target
+        path = os.path.realpath(path)
+        with self.lock:
+            document = self.documents.pop(path, None)
+            if document is None:
+                document = Document(path)
+            # Most recently used last
+            self.documents[path] = document
+            document.users += 1
+            if len(self.documents) > self.max_entries:
+                self._evict()
+            return document
+
+    def _put_document(self, document):
+        with self.lock:
+            document.users -= 1
+
+    # Forget the least recently used documents past max_entries. The
+    # ones in use are kept, a document of a file has to be the only one.
+    def _evict(self):
+        excess = len(self.documents) - self.max_entries
+        for path, document in list(self.documents.items()):
+            if excess <= 0:
+                break
+            if document.users == 0 and not document.dirty:
+                del self.documents[path]
+                excess -= 1
+
+    def _acquire(self, path):
+        document = self._get_document(path)
+        document.lock.acquire()
+        return document
+
+    def _release(self, document):
+        document.lock.release()
+        self._put_document(document)
+
+    # Parse the file again when it was changed by another program. A
+    # change not written yet wins over the file.
+    def _load(self, document):
+        if document.dirty:
+            return
+        try:
+            stat = _get_stat(document.path)
+        except FileNotFoundError:
+            document.data = document.text = document.stat = None
+            raise
+        if document.data is not None and stat == document.stat:
+            return
+        with open(document.path, 'r') as f:
+            text = f.read()
+        document.data = json.loads(text)
+        document.text = text
+        document.stat = stat
+
+    def _get_data(self, document):
+        self._load(document)
+        return document.data
+
+    # Large files are not kept in memory unless they were changed
+    def _is_large(self, document):
+        if document.dirty or document.data is not None:
+            return False
+        return os.stat(document.path).st_size >= globaldata.JSON_STREAM_BYTES
+
+    def _get_text(self, document):
+        self._load(document)
+        if document.text is None:
+            document.text = json.dumps(document.data)
+        return document.text
+
+    # Report what writing the document would fail with before changing
+    # it, for changes staged by a transaction to be made as a whole
+    def _check(self, document):
+        directory = os.path.dirname(document.path)
+        if not os.path.isdir(directory):
+            raise FileNotFoundError('Directory %s not found' % directory)
+        if not os.access(directory, os.W_OK):
+            raise PermissionError('Directory %s is not writable' % directory)
+
+    # Change the document in memory, returns the number of the change
+    # for _sync() to write it
+    def _put(self, document, data):
+        self._check(document)
+        document.data = data
+        document.text = None
+        document.dirty = True
+        document.version += 1
+        return document.version
+
+    # Write the document to the file unless the change numbered version
+    # is in it already. The file is written to a temporary file next to
+    # it and renamed over it, so readers never see a partial file. It is
+    # written without the lock of the document, so other requests can
+    # read and change it meanwhile, and a change made meanwhile is only
+    # written by the next write.
+    def _sync(self, document, version):
+        if version is None:
+            return
+        with document.write_lock:
+            with document.lock:
+                if document.failed[0] < version <= document.failed[1]:
+                    raise document.error
+                if document.written >= version:
+                    return
+                version = document.version
+                text = json.dumps(document.data)
+            directory, name = os.path.split(document.path)
+            temp = os.path.join(directory, '.%s.%d.tmp' % (name, threading.get_ident()))
+            try:
+                try:
+                    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+                    try:
+                        try:
+                            os.fchmod(fd, os.stat(document.path).st_mode & 0o7777)
+                        except FileNotFoundError:
+                            pass
+                        os.write(fd, text.encode())
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                    with document.lock:
+                        # Deleted meanwhile
+                        if document.written >= version:
+                            return
+                        os.replace(temp, document.path)
+                        document.written = version
+                        if document.version == version:
+                            document.text = text
+                            document.stat = _get_stat(document.path)
+                            document.dirty = False
+                except OSError as e:
+                    with document.lock:
+                        # The file is read again by the next request, the
+                        # changes not written are lost
+                        document.failed = (document.written, version)
+                        document.error = OSError(e.errno, 'Could not write %s: %s' % (
+                            document.path, e.strerror or e))
+                        if document.version == version:
+                            document.data = document.text = document.stat = None
+                            document.dirty = False
+                    raise document.error
+            finally:
+                try:
+                    os.unlink(temp)
+                except OSError:
+                    pass
+
+    def _remove(self, document):
+        # A change being written is not written anymore
+        document.written = document.version
+        try:
+            os.remove(document.path)
+        except FileNotFoundError:
+            # Created by a change that was not written yet
+            if not document.dirty:
+                raise
+        finally:
+            document.data = document.text = document.stat = None
+            document.dirty = False
+
+    # Lock the files at paths for a transaction
+    def transaction(self, paths):
+        return Transaction(self, paths)
+
+    # Write the changes not written yet, before the server stops
+    def flush(self):
+        with self.lock:
+            documents = list(self.documents.values())
+        for document in documents:
+            try:
+                self._sync(document, document.version)
+            except OSError:
+                pass
+
+
+# Changes to several files made as a whole. The files are locked while
+# the transaction is open, in the order of their paths so transactions
+# can't wait for each other. Changes are staged, the files read through
+# the transaction see them, and they are only made to the store by
+# commit().
+class Transaction(FileOperations):
+    # Staged in place of the content of a deleted file
+    DELETED = object()
+
+    def __init__(self, store, paths):
+        self.store = store
+        self.paths = {}
+        for path in paths:
+            if os.path.realpath(path) not in self.paths:
+                document = store._get_document(path)
+                self.paths[document.path] = document
+        self.documents = sorted(self.paths.values(), key=lambda document: document.path)
+        self.staged = {}
+        # Numbers of the changes made by commit(), written on exit
+        self.versions = {}
+
+    def __enter__(self):
+        for document in self.documents:
+            document.lock.acquire()
+        return self
+
+    # Release the files and write the changes made. The changes to the
+    # files written before one that fails to be written are kept.
+    def __exit__(self, *exc_info):
+        for document in self.documents:
+            document.lock.release()
+        try:
+            for document, version in self.versions.items():
+                self.store._sync(document, version)
+        finally:
+            for document in self.documents:
+                self.store._put_document(document)
+
+    def _acquire(self, path):
+        document = self.paths.get(os.path.realpath(path))
+        if document is None:
+            raise RuntimeError('%s is not part of the transaction' % path)
+        return document
+
+    def _release(self, document):
+        pass
+
+    # Staged changes are written by the store after commit()
+    def _sync(self, document, version):
+        pass
+
+    def _get_data(self, document):
+        if document in self.staged:
+            data = self.staged[document]
+            if data is self.DELETED:
+                raise FileNotFoundError(document.path)
+            return data
+        return self.store._get_data(document)
+
+    def _get_text(self, document):
+        if document in self.staged:
+            return json.dumps(self._get_data(document))
+        return self.store._get_text(document)
+
+    def _is_large(self, document):
+        if document in self.staged:
+            return False
+        return self.store._is_large(document)
+
+    def _put(self, document, data):
+        self.store._check(document)
+        self.staged[document] = data
+
+    def _remove(self, document):
+        if document in self.staged:
+            if self.staged[document] is self.DELETED:
+                raise FileNotFoundError(document.path)
+        elif not document.dirty and not os.path.exists(document.path):
+            raise FileNotFoundError(document.path)
+        self.staged[document] = self.DELETED
+
+    def commit(self):
+        for document, data in self.staged.items():
+            if data is self.DELETED:
+                try:
+                    self.store._remove(document)
+                except FileNotFoundError:
+                    pass
+            else:
+                self.versions[document] = self.store._put(document, data)
+        self.staged = {}
+
+
+store = FileStore(globaldata.FILE_STORE_ENTRIES)
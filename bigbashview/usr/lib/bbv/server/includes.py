@@ -0,0 +1,123 @@
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from bbv import globaldata
+
+# Matches <?include type[options] body?> blocks
+INCLUDE_PATTERN = re.compile(
+    r'<\?include (\w+)(?:\[([^\]]*)\])?(.*?)\?>', re.DOTALL)
+
+# Start of every include block, as stored in a file
+INCLUDE_MARKER = b'<?include '
+# Size of the blocks a file is searched for include blocks in
+SEARCH_CHUNK_SIZE = 64 * 1024
+
+# An include block found in a template and the markup it came from
+Include = namedtuple('Include', ('type', 'options', 'body', 'source'))
+
+# Pool running independent include blocks concurrently
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Parse "[serial timeout=5]" style options into a dict
+def parse_options(text):
+    options = {}
+    for token in (text or '').split():
+        name, _, value = token.partition('=')
+        options[name] = value or True
+    return options
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(globaldata.INCLUDE_WORKERS, 1),
+                thread_name_prefix='bbv-include')
+        return _executor
+
+
+# Split a template into a list of literal strings and Include blocks,
+# scanning the text only once
+def compile_template(text):
+    segments = []
+    position = 0
+    for match in INCLUDE_PATTERN.finditer(text):
+        if match.start() > position:
+            segments.append(text[position:match.start()])
+        include_type, options, body = match.groups()
+        segments.append(Include(
+            include_type, parse_options(options), body.strip(), match.group(0)))
+        position = match.end()
+    if position < len(text):
+        segments.append(text[position:])
+    return segments
+
+
+# Whether a file has an include block, read in blocks so a large file
+# is never held in memory. Consecutive blocks overlap by the length of
+# the marker, to find one cut by the end of a block.
+def has_includes(path):
+    with open(path, 'rb') as arq:
+        tail = b''
+        while True:
+            chunk = arq.read(SEARCH_CHUNK_SIZE)
+            if not chunk:
+                return False
+            if INCLUDE_MARKER in tail + chunk:
+                return True
+            tail = chunk[1 - len(INCLUDE_MARKER):]
+
+
+# A compiled file and the version of the file it was read from
+class Template(object):
+    def __init__(self, segments, mtime_ns, size):
+        self.segments = segments
+        self.mtime_ns = mtime_ns
+        self.size = size
+        # Files without include blocks are sent exactly as stored
+        self.static = all(isinstance(segment, str) for segment in segments)
+        self.etag = '%x-%x' % (mtime_ns, size)
+        self.data = ''.join(segments).encode('utf-8') if self.static else None
+
+
+# Compiled templates keyed by file path, reused while the file keeps
+# the same modification time and size. The cache is bounded by number
+# of files and by their total size, dropping the least recently used.
+class TemplateCache(object):
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            template = self._entries.get(path)
+            if template and (template.mtime_ns, template.size) == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(path)
+                return template
+
+        with open(path) as arq:
+            template = Template(compile_template(arq.read()), stat.st_mtime_ns, stat.st_size)
+
+        if template.size > self.max_bytes:
+            return template
+        with self._lock:
+            if path in self._entries:
+                self._size -= self._entries.pop(path).size
+            self._entries[path] = template
+            self._size += template.size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._size -= self._entries.popitem(last=False)[1].size
+        return template
+
+
+templates = TemplateCache(globaldata.TEMPLATE_CACHE_ENTRIES, globaldata.TEMPLATE_CACHE_BYTES)
@@ -0,0 +1,249 @@
+from bbv import globaldata
+from .utils import get_env_for_shell, get_environ, get_server_variables, get_workdir, is_local_request
+from . import views
+from .routes import route
+from urllib.parse import parse_qs
+import json
+import os
+import secrets
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+import web
+
+# Largest slice of output returned by a single status request
+OUTPUT_LIMIT = 64 * 1024
+# Seconds a killed job gets to exit after SIGTERM before SIGKILL
+KILL_TIMEOUT = 3
+
+
+# Drop an incomplete UTF-8 sequence at the end of an output slice, so
+# the next request starts at the beginning of a character
+def _complete_utf8(data):
+    # Look back over up to three continuation bytes for the lead byte
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte < 0x80:
+            return data
+        if byte >= 0xC0:
+            size = 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return data if back >= size else data[:-back]
+    return data
+
+
+# A script started in its own process group, writing stdout and stderr
+# to a spool file so memory use doesn't grow with its output
+class Job(object):
+    def __init__(self, job_id, command, env, spool_dir, cwd=None):
+        self.id = job_id
+        self.command = command
+        self.started = time.time()
+        self.finished = None
+        self.killed = False
+        self.path = os.path.join(spool_dir, '%s.log' % job_id)
+        with open(self.path, 'wb') as output:
+            self.proc = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=output,
+                stderr=subprocess.STDOUT,
+                shell=True,
+                cwd=cwd,
+                env=env,
+                start_new_session=True
+            )
+        threading.Thread(target=self._wait, daemon=True).start()
+
+    def _wait(self):
+        self.proc.wait()
+        self.finished = time.time()
+
+    @property
+    def running(self):
+        return self.finished is None
+
+    @property
+    def status(self):
+        if self.killed:
+            return 'killed'
+        return 'running' if self.running else 'finished'
+
+    def read(self, offset, limit):
+        try:
+            with open(self.path, 'rb') as output:
+                output.seek(offset)
+                return _complete_utf8(output.read(limit))
+        except OSError:
+            return b''
+
+    def kill(self):
+        if not self.running:
+            return
+        self.killed = True
+        try:
+            os.killpg(self.proc.pid, signal.SIGTERM)
+            self.proc.wait(KILL_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def remove(self):
+        self.kill()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'command': self.command,
+            'status': self.status,
+            'returncode': None if self.running else self.proc.returncode,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobManager(object):
+    def __init__(self, max_running, max_finished):
+        self.max_running = max_running
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._spool_dir = None
+
+    # Start a job, or return None when too many jobs are running
+    def start(self, command, env, cwd=None):
+        with self._lock:
+            if sum(job.running for job in self._jobs.values()) >= self.max_running:
+                return None
+            if self._spool_dir is None:
+                self._spool_dir = tempfile.mkdtemp(prefix='bbv-jobs-')
+            self._prune()
+            job = Job(secrets.token_hex(8), command, env, self._spool_dir, cwd)
+            self._jobs[job.id] = job
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def remove(self, job_id):
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job:
+            job.remove()
+        return job
+
+    # Kill every job, used when the server stops
+    def stop(self):
+        with self._lock:
+            jobs, self._jobs = list(self._jobs.values()), {}
+        for job in jobs:
+            job.remove()
+        if self._spool_dir:
+            shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    # Forget the oldest finished jobs beyond max_finished
+    def _prune(self):
+        finished = sorted(
+            (job for job in self._jobs.values() if not job.running),
+            key=lambda job: job.finished)
+        for job in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self._jobs[job.id]
+            job.remove()
+
+
+manager = JobManager(globaldata.MAX_JOBS, globaldata.MAX_FINISHED_JOBS)
+
+
+# Handler for the /api/jobs URL, under /api/ with the other APIs so it
+# takes no path of the files of apps:
+#   POST   /api/jobs        start a command, returns its id
+#   GET    /api/jobs        list the jobs
+#   GET    /api/jobs/<id>   status and output from ?offset=
+#   DELETE /api/jobs/<id>   kill the job's process group and forget it
+@route('/api/jobs', prefix=True, separators='/')
+class jobs_handler(views.url_handler):
+    def _check_client(self):
+        if not is_local_request():
+            raise web.Forbidden()
+        web.header('Content-Type', 'application/json; charset=UTF-8')
+
+    def _get_job(self, name):
+        job = manager.get(name.strip('/'))
+        if job is None:
+            web.ctx.status = '404 Not Found'
+        return job
+
+    def GET(self, name=''):
+        self._check_client()
+        if not name.strip('/'):
+            return json.dumps([job.to_dict() for job in manager.list()])
+
+        job = self._get_job(name)
+        if job is None:
+            return json.dumps({"error": f"Job {name.strip('/')} not found"})
+        params = web.input(offset='0', limit=str(OUTPUT_LIMIT))
+        try:
+            offset = max(int(params.offset), 0)
+            limit = min(max(int(params.limit), 1), OUTPUT_LIMIT)
+        except ValueError:
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "Invalid offset or limit"})
+
+        output = job.read(offset, limit)
+        result = job.to_dict()
+        result.update({
+            'offset': offset,
+            'next_offset': offset + len(output),
+            'output': output.decode('utf-8', 'replace'),
+        })
+        return json.dumps(result)
+
+    def POST(self, name=''):
+        self._check_client()
+        data = web.data()
+        try:
+            if web.ctx.env.get('CONTENT_TYPE', '').startswith('application/json'):
+                request = json.loads(data.decode() or '{}')
+                command = request.get('command')
+                extra_env = {str(k): str(v) for k, v in request.get('env', {}).items()}
+            else:
+                query = parse_qs(data.decode())
+                command = query.pop('command', [None])[0]
+                extra_env = get_env_for_shell(query)
+        except (ValueError, AttributeError):
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "Invalid request body"})
+        if not command:
+            web.ctx.status = '400 Bad Request'
+            return json.dumps({"error": "No command specified"})
+
+        env = dict(get_environ())
+        env.update(get_server_variables())
+        env.update(extra_env)
+
+        job = manager.start(command, env, get_workdir())
+        if job is None:
+            web.ctx.status = '429 Too Many Requests'
+            return json.dumps({"error": f"Too many running jobs (max {manager.max_running})"})
+        web.ctx.status = '201 Created'
+        return json.dumps(job.to_dict())
+
+    def DELETE(self, name=''):
+        self._check_client()
+        job = manager.remove(name.strip('/'))
+        if job is None:
+            web.ctx.status = '404 Not Found'
+            return json.dumps({"error": f"Job {name.strip('/')} not found"})
+        return json.dumps({"success": True, "status": job.status})
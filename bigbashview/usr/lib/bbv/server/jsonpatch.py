@@ -0,0 +1,187 @@
+# JSON Pointer (RFC 6901), JSON Patch (RFC 6902) and JSON Merge Patch
+# (RFC 7396) for the documents of the /api/file API.
+#
+# Documents are never changed in place: a change copies the objects and
+# arrays on the path to the changed value and shares everything else
+# with the original, so a patch to a large document costs about the
+# size of the path, and a patch that fails leaves the document as it was.
+
+
+# The patch is not valid
+class PatchError(ValueError):
+    pass
+
+
+# The patch is valid but does not apply to the document: a path that
+# doesn't exist or a failed test operation
+class PatchConflict(PatchError):
+    pass
+
+
+def parse_pointer(pointer):
+    if pointer == '':
+        return []
+    if not isinstance(pointer, str) or not pointer.startswith('/'):
+        raise PatchError('Invalid JSON pointer %r' % (pointer,))
+    return [token.replace('~1', '/').replace('~0', '~')
+            for token in pointer[1:].split('/')]
+
+
+# Key or index of token in a container. "-" is the end of an array,
+# only valid where a value is added.
+def _get_key(container, token, pointer, end=False):
+    if isinstance(container, dict):
+        return token
+    if isinstance(container, list):
+        if token == '-' and end:
+            return len(container)
+        if not token.isdigit() or (token != '0' and token.startswith('0')):
+            raise PatchConflict('Invalid array index %r in %s' % (token, pointer))
+        index = int(token)
+        if index >= len(container) + end:
+            raise PatchConflict('Array index %s out of range in %s' % (token, pointer))
+        return index
+    raise PatchConflict('%s does not exist' % pointer)
+
+
+def _get(document, tokens, pointer):
+    for token in tokens:
+        key = _get_key(document, token, pointer)
+        try:
+            document = document[key]
+        except KeyError:
+            raise PatchConflict('%s does not exist' % pointer)
+    return document
+
+
+# Value at a JSON pointer in a document
+def resolve(document, pointer):
+    return _get(document, parse_pointer(pointer), pointer)
+
+
+# Return a copy of document where change(container, token) was applied
+# to a copy of the container of the last token
+def _change(document, tokens, pointer, change):
+    container = document.copy() if isinstance(document, (dict, list)) else document
+    if len(tokens) == 1:
+        change(container, tokens[0])
+        return container
+    key = _get_key(document, tokens[0], pointer)
+    try:
+        child = document[key]
+    except KeyError:
+        raise PatchConflict('%s does not exist' % pointer)
+    container[key] = _change(child, tokens[1:], pointer, change)
+    return container
+
+
+def _add(document, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+
+    def add(container, token):
+        key = _get_key(container, token, pointer, end=True)
+        if isinstance(container, list):
+            container.insert(key, value)
+        else:
+            container[key] = value
+    return _change(document, tokens, pointer, add)
+
+
+def _remove(document, pointer):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        raise PatchError('The whole document can not be removed')
+
+    def remove(container, token):
+        key = _get_key(container, token, pointer)
+        try:
+            del container[key]
+        except KeyError:
+            raise PatchConflict('%s does not exist' % pointer)
+    return _change(document, tokens, pointer, remove)
+
+
+def _replace(document, pointer, value):
+    tokens = parse_pointer(pointer)
+    if not tokens:
+        return value
+
+    def replace(container, token):
+        key = _get_key(container, token, pointer)
+        if isinstance(container, dict) and key not in container:
+            raise PatchConflict('%s does not exist' % pointer)
+        container[key] = value
+    return _change(document, tokens, pointer, replace)
+
+
+# JSON equality: numbers are equal by value, but true and false are
+# not numbers
+def _equal(a, b):
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(_equal(a[key], b[key]) for key in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    return a == b
+
+
+def _get_member(operation, name):
+    try:
+        return operation[name]
+    except KeyError:
+        raise PatchError('Operation %r has no %r member' % (operation.get('op'), name))
+
+
+# Apply a JSON Patch, a list of operations, and return the new document
+def apply_patch(document, patch):
+    if not isinstance(patch, list):
+        raise PatchError('A JSON patch is an array of operations')
+    for operation in patch:
+        if not isinstance(operation, dict):
+            raise PatchError('Invalid operation %r' % (operation,))
+        op = operation.get('op')
+        path = _get_member(operation, 'path')
+        if op == 'add':
+            document = _add(document, path, _get_member(operation, 'value'))
+        elif op == 'remove':
+            document = _remove(document, path)
+        elif op == 'replace':
+            document = _replace(document, path, _get_member(operation, 'value'))
+        elif op in ('move', 'copy'):
+            source = _get_member(operation, 'from')
+            value = resolve(document, source)
+            if op == 'move':
+                # Checked before path is used, which may not be a string
+                tokens, source_tokens = parse_pointer(path), parse_pointer(source)
+                if len(tokens) > len(source_tokens) and \
+                        tokens[:len(source_tokens)] == source_tokens:
+                    raise PatchError('%s can not be moved into itself' % source)
+                document = _remove(document, source)
+            document = _add(document, path, value)
+        elif op == 'test':
+            if not _equal(resolve(document, path), _get_member(operation, 'value')):
+                raise PatchConflict('Test of %s failed' % path)
+        else:
+            raise PatchError('Unknown operation %r' % (op,))
+    return document
+
+
+# Apply a JSON Merge Patch: objects are merged recursively, null
+# removes a member and any other value replaces it
+def merge_patch(document, patch):
+    if not isinstance(patch, dict):
+        return patch
+    document = dict(document) if isinstance(document, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            document.pop(key, None)
+        else:
+            document[key] = merge_patch(document.get(key), value)
+    return document
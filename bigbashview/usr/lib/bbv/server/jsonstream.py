@@ -0,0 +1,287 @@
+from bbv import globaldata
+from array import array
+import codecs
+import json
+import os
+import re
+import threading
+
+# Size of the chunks read from large JSON files
+CHUNK_SIZE = 64 * 1024
+# An error this far from the end of the data read may be caused by a
+# value cut short at the end of the chunk
+INCOMPLETE_MARGIN = 16
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+SEPARATOR = re.compile(r'[ \t\n\r]*,[ \t\n\r]*')
+decoder = json.JSONDecoder()
+
+# States of the scanner: what comes next at the top level
+VALUE, ARRAY_FIRST, ARRAY_ITEM, ARRAY_NEXT, OBJECT_FIRST, OBJECT_KEY, \
+    OBJECT_COLON, OBJECT_VALUE, OBJECT_NEXT, DONE = range(10)
+
+
+# The file is not valid JSON
+class InvalidJSON(ValueError):
+    pass
+
+
+# Checks a JSON document fed to it in chunks, without building it in
+# memory. The members of the top-level array or object are parsed one
+# at a time by the C parser of the json module and dropped, so memory
+# use is about the size of the largest member. The data is decoded as
+# latin-1, so positions in the text are byte offsets in the file, and
+# checked as UTF-8 separately. The byte ranges of the items of a
+# top-level array are recorded in items when it is given.
+class Scanner(object):
+    def __init__(self, items=None):
+        self.items = items
+        self.state = VALUE
+        self.is_array = False
+        self.text = ''
+        # File offset of the start of text, and position reached in it
+        self.offset = 0
+        self.pos = 0
+        # Length of text at which to try again to parse an incomplete value
+        self.retry = 0
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    def feed(self, data):
+        try:
+            self.utf8.decode(data)
+        except UnicodeDecodeError as e:
+            raise InvalidJSON('Invalid UTF-8 data: %s' % e)
+        self.offset += self.pos
+        self.text = self.text[self.pos:] + data.decode('latin-1')
+        self.pos = 0
+        if len(self.text) >= self.retry:
+            self._scan(False)
+
+    def close(self):
+        try:
+            self.utf8.decode(b'', True)
+        except UnicodeDecodeError as e:
+            raise InvalidJSON('Invalid UTF-8 data: %s' % e)
+        self._scan(True)
+        if self.state != DONE:
+            raise InvalidJSON('Unexpected end of the JSON data')
+
+    def _error(self, message, pos):
+        raise InvalidJSON('%s at byte %d' % (message, self.offset + pos))
+
+    # Parse a complete value at pos and return where it ends, or None
+    # when more data is needed
+    def _value(self, pos, final):
+        text = self.text
+        try:
+            _, end = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError as e:
+            if final or (not e.msg.startswith('Unterminated string')
+                         and e.pos < len(text) - INCOMPLETE_MARGIN):
+                self._error(e.msg, e.pos)
+            end = None
+        else:
+            # A number could go on in the next chunk
+            if final or text[end - 1] not in '0123456789' or end < len(text) - INCOMPLETE_MARGIN:
+                self.retry = 0
+                return end
+        # Wait until the value read so far doubled, so a large value is
+        # parsed a number of times that only grows with the log of its size
+        self.retry = 2 * (len(text) - pos)
+        return None
+
+    # Parse the items of the top-level array from pos on, up to one that
+    # is not followed by a comma or could be incomplete, which are left
+    # to _scan. Returns where it stopped.
+    def _items(self, pos, final):
+        text = self.text
+        limit = len(text) - INCOMPLETE_MARGIN
+        scan_once = decoder.scan_once
+        items = self.items
+        while True:
+            try:
+                end = scan_once(text, pos)[1]
+            except (StopIteration, json.JSONDecodeError):
+                return pos
+            if end >= limit and not final:
+                return pos
+            if items is not None:
+                items.append(self.offset + pos)
+                items.append(self.offset + end)
+            match = SEPARATOR.match(text, end)
+            if match is None:
+                self.state = ARRAY_NEXT
+                return end
+            # An item has to follow the comma
+            self.state = ARRAY_ITEM
+            pos = match.end()
+
+    def _scan(self, final):
+        text = self.text
+        while True:
+            pos = WHITESPACE.match(text, self.pos).end()
+            self.pos = pos
+            if pos == len(text):
+                return
+            char = text[pos]
+            state = self.state
+            if state == VALUE:
+                if char == '[':
+                    self.is_array = True
+                    self.state, self.pos = ARRAY_FIRST, pos + 1
+                    continue
+                if char == '{':
+                    self.state, self.pos = OBJECT_FIRST, pos + 1
+                    continue
+                end = self._value(pos, final)
+                if end is None:
+                    return
+                self.state, self.pos = DONE, end
+            elif state == ARRAY_FIRST and char == ']':
+                self.state, self.pos = DONE, pos + 1
+            elif state in (ARRAY_FIRST, ARRAY_ITEM):
+                end = self._items(pos, final)
+                if end != pos:
+                    self.pos, self.retry = end, 0
+                    continue
+                end = self._value(pos, final)
+                if end is None:
+                    return
+                if self.items is not None:
+                    self.items.append(self.offset + pos)
+                    self.items.append(self.offset + end)
+                self.state, self.pos = ARRAY_NEXT, end
+            elif state == ARRAY_NEXT and char in ',]':
+                self.state, self.pos = ARRAY_ITEM if char == ',' else DONE, pos + 1
+            elif state == OBJECT_FIRST and char == '}':
+                self.state, self.pos = DONE, pos + 1
+            elif state in (OBJECT_FIRST, OBJECT_KEY) and char == '"':
+                end = self._value(pos, final)
+                if end is None:
+                    return
+                self.state, self.pos = OBJECT_COLON, end
+            elif state == OBJECT_COLON and char == ':':
+                self.state, self.pos = OBJECT_VALUE, pos + 1
+            elif state == OBJECT_VALUE:
+                end = self._value(pos, final)
+                if end is None:
+                    return
+                self.state, self.pos = OBJECT_NEXT, end
+            elif state == OBJECT_NEXT and char in ',}':
+                self.state, self.pos = OBJECT_KEY if char == ',' else DONE, pos + 1
+            elif state == DONE:
+                self._error('Extra data', pos)
+            else:
+                self._error('Unexpected %r' % char, pos)
+
+
+def _get_stat(f):
+    st = os.fstat(f.fileno())
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+# Send a JSON file as it is, checking it on the way unless validate is
+# false. The first chunk is checked before this returns, so a file that
+# is not JSON at all is reported with an error status. An error found
+# later can only cut the response short.
+def stream_file(path, validate=True):
+    f = open(path, 'rb')
+    try:
+        scanner = Scanner() if validate else None
+        chunk = f.read(CHUNK_SIZE)
+        if scanner:
+            scanner.feed(chunk)
+            # The whole of a small file is checked here
+            if len(chunk) < CHUNK_SIZE:
+                scanner.close()
+    except BaseException:
+        f.close()
+        raise
+
+    def send(chunk):
+        with f:
+            while chunk:
+                yield chunk
+                chunk = f.read(CHUNK_SIZE)
+                if scanner:
+                    if chunk:
+                        scanner.feed(chunk)
+                    else:
+                        scanner.close()
+    return send(chunk)
+
+
+# Byte ranges of the items of the top-level array of large JSON files,
+# so pages of it are read from the file without parsing all of it
+class ItemIndexes(object):
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def _get_index(self, path, f):
+        stat = _get_stat(f)
+        with self.lock:
+            index = self.indexes.get(path)
+            if index is not None and index[0] == stat:
+                # Most recently used last
+                self.indexes[path] = self.indexes.pop(path)
+                return index[1]
+        items = array('q')
+        scanner = Scanner(items)
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            scanner.feed(chunk)
+        scanner.close()
+        if not scanner.is_array:
+            raise ValueError('JSON in %s is not an array' % path)
+        with self.lock:
+            self.indexes.pop(path, None)
+            self.indexes[path] = (stat, items)
+            while len(self.indexes) > self.max_entries:
+                del self.indexes[next(iter(self.indexes))]
+        return items
+
+    # Return the JSON array of the items offset to offset + limit of the
+    # top-level array in a file, and the number of items in it
+    def read_items(self, path, offset, limit):
+        with open(path, 'rb') as f:
+            items = self._get_index(path, f)
+            count = len(items) // 2
+            first, last = min(offset, count), min(offset + limit, count)
+            if first == last:
+                return '[]', count
+            start, end = items[2 * first], items[2 * last - 1]
+            f.seek(start)
+            data = f.read(end - start)
+        parts = [data[items[2 * i] - start:items[2 * i + 1] - start] for i in range(first, last)]
+        return (b'[' + b', '.join(parts) + b']').decode('utf-8'), count
+
+
+indexes = ItemIndexes(globaldata.JSON_INDEX_ENTRIES)
+
+
+# Return the JSON array of the records offset to offset + limit of a
+# JSON Lines file, one value per line, and the number of records in it.
+# Only the records returned are parsed. A last line without a newline
+# that doesn't parse is taken as a record still being written.
+def read_lines(path, offset, limit):
+    records = []
+    count = 0
+    with open(path, 'rb') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            if offset <= count < offset + limit or not line.endswith(b'\n'):
+                try:
+                    json.loads(line)
+                except ValueError as e:
+                    if not line.endswith(b'\n'):
+                        break
+                    raise InvalidJSON('Invalid record at line %d: %s' % (number, e))
+                if offset <= count < offset + limit:
+                    records.append(line.strip().decode('utf-8'))
+            count += 1
+    return '[%s]' % ', '.join(records), count
@@ -0,0 +1,55 @@
+import codecs
+
+# Size of the blocks read from files
+CHUNK_SIZE = 64 * 1024
+
+
+# Yield the bytes start to stop of an open file, and close it. A file
+# truncated while it is read, like a rotated log, ends the response with
+# an error, so the server drops the connection instead of leaving the
+# client waiting for the rest of the Content-Length.
+def read_range(f, start, stop):
+    with f:
+        f.seek(start)
+        while start < stop:
+            chunk = f.read(min(CHUNK_SIZE, stop - start))
+            if not chunk:
+                raise EOFError('%s was truncated while it was read' % f.name)
+            start += len(chunk)
+            yield chunk
+
+
+# Move the bytes start to stop of a file to the nearest UTF-8 character
+# boundaries, so a character cut by the range, like one being appended
+# to a log, is read whole with the next range
+def align_text(f, start, stop):
+    f.seek(start)
+    head = f.read(min(3, stop - start))
+    while head and 0x80 <= head[0] < 0xc0:
+        start += 1
+        head = head[1:]
+    if stop - start <= 0:
+        return start, start
+    f.seek(max(stop - 3, start))
+    tail = f.read(stop - max(stop - 3, start))
+    for i in range(len(tail) - 1, -1, -1):
+        if not 0x80 <= tail[i] < 0xc0:
+            # Length of the sequence started by this lead byte
+            needed = 2 if tail[i] < 0xe0 else 3 if tail[i] < 0xf0 else 4
+            if tail[i] >= 0xc0 and len(tail) - i < needed:
+                stop -= len(tail) - i
+            break
+    return start, stop
+
+
+# Replace the invalid UTF-8 sequences in the chunks of a text file, so
+# pages can read any file as text
+def decode_text(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text.encode('utf-8')
+    text = decoder.decode(b'', True)
+    if text:
+        yield text.encode('utf-8')
@@ -0,0 +1,57 @@
+import web
+
+
+# Routing table of the server: url_handler classes by exact path and by
+# path prefix, filled by the route decorator as the handler modules are
+# imported. A request is routed with a dictionary lookup per distinct
+# prefix length, instead of a regular expression per handler.
+class RouteTable(object):
+    def __init__(self):
+        self.paths = {}
+        self.prefixes = {}
+        self.lengths = []
+
+    # Class decorator registering a handler for a path, or for every path
+    # starting with it when prefix is True. The rest of the path is
+    # passed to the handler methods. With separators, the rest has to be
+    # empty or start with one of them, so "/api/jobs" doesn't take
+    # "/api/jobs.html". The longest matching prefix wins, and the empty
+    # prefix catches every other path.
+    def route(self, path, prefix=False, separators=None):
+        def register(cls):
+            if prefix:
+                self.prefixes[path] = (cls, separators)
+                self.lengths = sorted({len(key) for key in self.prefixes}, reverse=True)
+            else:
+                self.paths[path] = cls
+            return cls
+        return register
+
+    # Return the handler of a path and the arguments of its methods
+    def match(self, path):
+        cls = self.paths.get(path)
+        if cls is not None:
+            return cls, []
+        for length in self.lengths:
+            cls, separators = self.prefixes.get(path[:length], (None, None))
+            if cls is None:
+                continue
+            rest = path[length:]
+            if separators and rest and rest[0] not in separators:
+                continue
+            return cls, [rest]
+        return None, None
+
+
+# web.py application routing requests through a RouteTable
+class Application(web.application):
+    def __init__(self, table):
+        super().__init__(autoreload=False)
+        self.table = table
+
+    def _match(self, mapping, value):
+        return self.table.match(value)
+
+
+table = RouteTable()
+route = table.route
@@ -1,3 +1,43 @@
+import os
+import re
+import web
+from stat import S_ISREG
+from bbv import globaldata
+
+# Matches durations such as "30", "30s", "5m" or "1h"
+DURATION_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([smh]?)$')
+
+# Working directory, environment and port of the app a request belongs
+# to. They are the process ones, unless the server was started by the
+# daemon for another app (see Server).
+def get_workdir():
+    return web.ctx.get('bbv_workdir') or os.getcwd()
+
+def get_environ():
+    return web.ctx.get('bbv_environ') or os.environ
+
+def get_port():
+    return web.ctx.get('bbv_port') or globaldata.PORT
+
+# Variables telling scripts how to reach the server of their app: its
+# unix socket, or its address and port
+def get_server_variables():
+    socket_path = web.ctx.get('bbv_socket')
+    if socket_path:
+        return {'bbv_socket': socket_path}
+    return {
+        'bbv_ip': str(globaldata.ADDRESS),
+        'bbv_port': str(get_port()),
+    }
+
+# Requests must come from this machine. Only the user can connect to
+# the unix socket of a server, so anything arriving on it is trusted.
+def is_local_request():
+    return bool(web.ctx.get('bbv_socket')) or web.ctx.ip == '127.0.0.1'
+
+def resolve_path(path):
+    return os.path.join(get_workdir(), path)
+
 def to_s(text):
     return text if isinstance(text, str) else text.decode("utf-8")
 
@@ -9,3 +49,76 @@ def get_env_for_shell(query):
         return name, values
 
     return dict(list(map(join_options, list(query.items()))))
+
+# Replace a response header already set for the current request
+def set_header(name, value):
+    web.ctx.headers = [h for h in web.ctx.headers if h[0].lower() != name.lower()]
+    web.header(name, value)
+
+# Parse a "bytes=start-end" Range header against a file size.
+# Returns (start, end) with an inclusive end, None to send the whole
+# file, or False when the range can't be satisfied.
+def parse_range(header, size):
+    match = re.match(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', header or '')
+    if not match or match.groups() == ('', ''):
+        # Missing, malformed or multiple ranges: send the whole file
+        return None
+    if size == 0:
+        return False
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+# Convert a duration option to seconds, None when missing or invalid
+def parse_duration(value):
+    match = DURATION_PATTERN.match(str(value).strip())
+    if not match:
+        return None
+    number, unit = match.groups()
+    return float(number) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[unit]
+
+# Directives declared by a script in a "# bbv: key=value ..." comment
+# within its first lines, cached by path and modification time
+_directives_cache = {}
+
+def get_script_directives(command):
+    if not command.strip():
+        return {}
+    path = resolve_path(command.split(None, 1)[0])
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return {}
+    if not S_ISREG(stat.st_mode):
+        return {}
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _directives_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    directives = {}
+    try:
+        with open(path, 'rb') as script:
+            head = script.read(1024).decode('utf-8', 'replace')
+    except OSError:
+        head = ''
+    for line in head.splitlines()[:10]:
+        match = re.match(r'\s*#\s*bbv:\s*(.*)', line)
+        if not match:
+            continue
+        for token in match.group(1).split():
+            name, _, value = token.partition('=')
+            directives[name] = value or True
+
+    _directives_cache[path] = (key, directives)
+    return directives
@@ -19,19 +19,58 @@
 
 from urllib.parse import parse_qs
 from urllib.parse import unquote
-from .utils import get_env_for_shell, to_s
-from .html import HTML
+from datetime import datetime, timezone
+from .utils import get_env_for_shell, get_environ, get_script_directives, get_server_variables, get_workdir, is_local_request, parse_duration, parse_range, resolve_path, set_header, to_s
+from .includes import Include, compile_template, get_executor, has_includes, templates
+from .commands import CacheFilter, CommandStream, EventFilter
+from .routes import route
+from . import cache
 from bbv import globaldata
 import subprocess
-import re
+import mimetypes
 import os
 import web
-from shutil import which
+
+# Maximum size of each output chunk streamed from executed commands
+# and files
+CHUNK_SIZE = 64 * 1024
+
+# Shell functions for emitting events, sourced with . "$bbv_events"
+EVENTS_HELPER = os.path.join(globaldata.PROGDIR, 'bbv-events.sh')
+
+# Non text/* types that are served as text
+TEXT_TYPES = ('application/javascript', 'application/json', 'application/xml',
+              'application/x-sh', 'image/svg+xml')
+
+# How default_handler serves a file, by extension: the content type of
+# the response, and whether the file is run as a script. The longest
+# extension of a file name is looked up first, so ".sh.css" files run
+# while ".css" files are sent. Other files are sent as HTML.
+FILE_TYPES = {
+    '.sh': ('text/html; charset=UTF-8', True),
+    '.sh.html': ('text/html; charset=UTF-8', True),
+    '.sh.htm': ('text/html; charset=UTF-8', True),
+    '.sh.php': ('text/html; charset=UTF-8', True),
+    '.sh.py': ('text/html; charset=UTF-8', True),
+    '.sh.lua': ('text/html; charset=UTF-8', True),
+    '.sh.rb': ('text/html; charset=UTF-8', True),
+    '.sh.pl': ('text/html; charset=UTF-8', True),
+    '.sh.lisp': ('text/html; charset=UTF-8', True),
+    '.sh.jl': ('text/html; charset=UTF-8', True),
+    '.run': ('text/html; charset=UTF-8', True),
+    '.sh.css': ('text/css; charset=UTF-8', True),
+    '.sh.js': ('text/javascript; charset=UTF-8', True),
+    '.sh.json': ('application/json; charset=UTF-8', True),
+    '.txt': ('text/plain; charset=UTF-8', False),
+    '.css': ('text/css; charset=UTF-8', False),
+    '.js': ('text/javascript; charset=UTF-8', False),
+    '.svg': ('image/svg+xml; charset=UTF-8', False),
+    '.svgz': ('image/svg+xml; charset=UTF-8', False),
+}
+DEFAULT_FILE_TYPE = ('text/html; charset=UTF-8', False)
 
 # Handler for the root URL
 class url_handler(object):
-    __url__ = '/'
-
     # Handle GET requests
     def GET(self, name=''):
         return self.parse_and_call(web.ctx.query[1:], unquote(name))
@@ -42,7 +81,7 @@ class url_handler(object):
 
     # Parse the query string and call the appropriate method
     def parse_and_call(self, qs, name):
-        if web.ctx.ip != '127.0.0.1':
+        if not is_local_request():
             raise web.Forbidden()
         qs = parse_qs(qs)
         options, content = self._get_set_default_options(name)
@@ -70,164 +109,305 @@ class url_handler(object):
 
 
 # Handler for the favicon.ico URL
+@route('/favicon.ico')
 class favicon_handler(url_handler):
-    __url__ = '/favicon.ico'
-
     # Do nothing for favicon requests
     def called(self, options, content, query):
         return
 
 
 # Handler for the /content URL
+@route('/content', prefix=True)
 class content_handler(url_handler):
-    __url__ = '/content(.*)'
+    include_types = ('html', 'bash', 'php', 'python', 'node')
+    script_types = ('bash', 'php', 'python', 'node')
+    # Directory and environment include blocks run in, read from the
+    # request before blocks are handed to the include pool threads
+    workdir = None
+    environ = None
+
+    def _load_context(self):
+        self.workdir = get_workdir()
+        self.environ = get_environ()
 
     # Process the content file and return the result
     def called(self, options, content, query):
+        self._load_context()
+        content = resolve_path(content)
         try:
-            with open(content) as arq:
-                html_content = arq.read()
-                html_content = self.process_includes(html_content)
-                return html_content
+            if self.is_binary(content):
+                return self.send_file(content)
+            template = templates.load(content)
+            if template.static:
+                return self.send_static(template)
+            return self.render(template.segments)
         except UnicodeDecodeError:
-            with open(content, 'rb') as arq:
-                return arq.read()
-        except FileNotFoundError:
+            return self.send_file(content)
+        except (FileNotFoundError, IsADirectoryError):
             web.ctx.status = '404 Not Found'
             return "File not found"
 
+    # Binary files, and large files other than HTML pages without
+    # include blocks, are streamed from disk instead of being read as
+    # text templates
+    def is_binary(self, path):
+        mimetype = mimetypes.guess_type(path)[0]
+        if mimetype is not None:
+            if not self.is_text_type(mimetype):
+                return True
+        else:
+            # Unknown extension, look for NUL bytes at the start of the file
+            with open(path, 'rb') as arq:
+                if b'\0' in arq.read(1024):
+                    return True
+        return os.stat(path).st_size >= globaldata.STREAM_FILE_BYTES and \
+            not path.endswith(('.htm', '.html')) and not has_includes(path)
+
+    def is_text_type(self, mimetype):
+        return mimetype.startswith('text/') or mimetype in TEXT_TYPES
+
+    # Set the validators of a file version, answering conditional
+    # requests with 304 Not Modified. If-Modified-Since is ignored when
+    # If-None-Match is sent (RFC 9110, 13.1.3), so an ETag that doesn't
+    # match always gets the current version.
+    def check_modified(self, mtime_ns, etag):
+        web.header('Cache-Control', 'no-cache')
+        mtime = datetime.fromtimestamp(mtime_ns // 1000000000, timezone.utc).replace(tzinfo=None)
+        if 'HTTP_IF_NONE_MATCH' in web.ctx.env:
+            web.lastmodified(mtime)
+            web.modified(None, etag)
+        else:
+            web.modified(mtime, etag)
+
+    # Send a file without include blocks from memory
+    def send_static(self, template):
+        self.check_modified(template.mtime_ns, template.etag)
+        web.header('Content-Length', str(len(template.data)))
+        return template.data
+
+    # Stream a file from disk in fixed-size blocks, with Range support
+    def send_file(self, path):
+        arq = open(path, 'rb')
+        try:
+            stat = os.fstat(arq.fileno())
+            etag = '%x-%x' % (stat.st_mtime_ns, stat.st_size)
+            self.check_modified(stat.st_mtime_ns, etag)
+
+            # Text types keep the Content-Type chosen by the route
+            mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            if not self.is_text_type(mimetype):
+                set_header('Content-Type', mimetype)
+            web.header('Accept-Ranges', 'bytes')
+
+            start, end = 0, stat.st_size - 1
+            if_range = web.ctx.env.get('HTTP_IF_RANGE', '').strip('" ')
+            if not if_range or if_range == etag:
+                byte_range = parse_range(web.ctx.env.get('HTTP_RANGE'), stat.st_size)
+                if byte_range is False:
+                    web.ctx.status = '416 Range Not Satisfiable'
+                    web.header('Content-Range', 'bytes */%d' % stat.st_size)
+                    web.header('Content-Length', '0')
+                    arq.close()
+                    return ''
+                if byte_range:
+                    start, end = byte_range
+                    web.ctx.status = '206 Partial Content'
+                    web.header('Content-Range', 'bytes %d-%d/%d' % (start, end, stat.st_size))
+            web.header('Content-Length', str(end - start + 1))
+        except BaseException:
+            arq.close()
+            raise
+        return self._iter_file(arq, start, end + 1)
+
+    # Yield a byte range of a file. A file truncated while it is sent,
+    # like a rotated log, ends the response with an error, so the server
+    # drops the connection instead of leaving the client waiting for the
+    # rest of the Content-Length (a memory map would crash the server).
+    def _iter_file(self, arq, start, stop):
+        with arq:
+            offset = start
+            while offset < stop:
+                chunk = os.pread(arq.fileno(), min(CHUNK_SIZE, stop - offset), offset)
+                if not chunk:
+                    raise EOFError('%s was truncated while it was sent' % arq.name)
+                offset += len(chunk)
+                yield chunk
+
     # Process include statements in the HTML content
     def process_includes(self, html_content):
-        pattern = r'<\?include (\w+)(.*?)\?>'
-        matches = re.finditer(pattern, html_content, re.DOTALL)
-
-        for match in matches:
-            include_type, include_content = match.groups()
-            include_content = include_content.strip()
-
-            if include_type == 'html':
-                html_content = self.include_html(html_content, include_content, match.group(0))
-            elif include_type == 'bash':
-                html_content = self.include_bash(html_content, include_content, match.group(0))
-            elif include_type == 'php':
-                html_content = self.include_php(html_content, include_content, match.group(0))
-            elif include_type == 'python':
-                html_content = self.include_python(html_content, include_content, match.group(0))
-            elif include_type == 'node':
-                html_content = self.include_node(html_content, include_content, match.group(0))
-
-        return html_content
+        self._load_context()
+        return self.render(compile_template(html_content))
+
+    # Assemble a compiled template, running each include block once.
+    # Script blocks run concurrently and their output is spliced back in
+    # document order; a block marked [serial] waits for the blocks before
+    # it and finishes before the blocks after it start.
+    def render(self, segments):
+        parts = list(segments)
+        pending = []
+        for index, segment in enumerate(segments):
+            if not isinstance(segment, Include):
+                continue
+            if segment.type in self.script_types and 'serial' not in segment.options:
+                pending.append((index, get_executor().submit(self.run_include, segment)))
+                continue
+            if 'serial' in segment.options:
+                for pending_index, future in pending:
+                    parts[pending_index] = future.result()
+                pending = []
+            parts[index] = self.run_include(segment)
+        for index, future in pending:
+            parts[index] = future.result()
+        return ''.join(parts)
+
+    # Return the output of an include block
+    def run_include(self, include):
+        if include.type not in self.include_types:
+            # Unknown include types are left untouched
+            return include.source
+        return getattr(self, 'include_%s' % include.type)(include.body, include.options)
 
     # Include an HTML file
-    def include_html(self, html_content, file_path, original_string):
-        full_path = os.path.join(os.getcwd(), file_path)
+    def include_html(self, file_path, options={}):
+        full_path = os.path.join(self.workdir, file_path)
         try:
-            with open(full_path, 'r') as file:
-                included_html = file.read()
-                # Process includes in the included content
-                included_html = self.process_includes(included_html)
-                html_content = html_content.replace(original_string, included_html)
+            # Process includes in the included content
+            return self.render(templates.load(full_path).segments)
         except FileNotFoundError:
-            html_content = html_content.replace(original_string, f"File {full_path} not found")
-        return html_content
-
-    # Include a bash script
-    def include_bash(self, html_content, script, original_string):
+            return f"File {full_path} not found"
+
+    # Run an interpreter and return its output, or an error message
+    def _include_script(self, args, name, options, env=None):
+        policy = cache.get_policy(options)
+        key = ('include', tuple(args), self.workdir)
+        if policy:
+            cached = cache.results.get(key)
+            if cached is not None:
+                return cached
+
+        timeout = parse_duration(options.get('timeout', ''))
         try:
-            result = subprocess.check_output(['bash', '-c', script], stderr=subprocess.STDOUT, env={**os.environ, 'RUST_BACKTRACE': '0'})
-            html_content = html_content.replace(original_string, result.decode())
+            result = subprocess.check_output(
+                args, stderr=subprocess.STDOUT, cwd=self.workdir,
+                env=self.environ if env is None else env, timeout=timeout)
+            result = result.decode()
+            if policy:
+                cache.results.put(key, result, *policy)
+            return result
         except subprocess.CalledProcessError as e:
-            html_content = html_content.replace(original_string, f"Error executing bash script: {e.output.decode()}")
-        return html_content
+            return f"Error executing {name} script: {e.output.decode()}"
+        except subprocess.TimeoutExpired:
+            return f"Error executing {name} script: timed out after {timeout:g} seconds"
+
+    # Include a bash script
+    def include_bash(self, script, options={}):
+        return self._include_script(['bash', '-c', script], 'bash', options, env={**self.environ, 'RUST_BACKTRACE': '0'})
 
     # Include a PHP script
-    def include_php(self, html_content, script, original_string):
-        try:
-            result = subprocess.check_output(['php', '-r', script], stderr=subprocess.STDOUT)
-            html_content = html_content.replace(original_string, result.decode())
-        except subprocess.CalledProcessError as e:
-            html_content = html_content.replace(original_string, f"Error executing PHP script: {e.output.decode()}")
-        return html_content
+    def include_php(self, script, options={}):
+        return self._include_script(['php', '-r', script], 'PHP', options)
 
     # Include a Python script
-    def include_python(self, html_content, script, original_string):
-        try:
-            result = subprocess.check_output(['python', '-c', script], stderr=subprocess.STDOUT)
-            html_content = html_content.replace(original_string, result.decode())
-        except subprocess.CalledProcessError as e:
-            html_content = html_content.replace(original_string, f"Error executing Python script: {e.output.decode()}")
-        return html_content
+    def include_python(self, script, options={}):
+        return self._include_script(['python', '-c', script], 'Python', options)
 
     # Include a Node.js script
-    def include_node(self, html_content, script, original_string):
-        try:
-            result = subprocess.check_output(['node', '-e', script], stderr=subprocess.STDOUT)
-            html_content = html_content.replace(original_string, result.decode())
-        except subprocess.CalledProcessError as e:
-            html_content = html_content.replace(original_string, f"Error executing Node.js script: {e.output.decode()}")
-        return html_content
+    def include_node(self, script, options={}):
+        return self._include_script(['node', '-e', script], 'Node.js', options)
 
 
 # Handler for the /execute URL
+@route('/execute', prefix=True)
 class execute_handler(url_handler):
-    __url__ = '/execute(.*)'
+    # Variables added to the environment of executed commands
+    def _get_variables(self, extra_env={}):
+        variables = get_server_variables()
+        variables.update(extra_env)
+        return variables
 
     # Execute a command and return the output
     def _execute(self, command, root, extra_env={}):
-        env = os.environ.copy()
-        env['bbv_ip'] = str(globaldata.ADDRESS)
-        env['bbv_port'] = str(globaldata.PORT)
-        env.update(extra_env)
-
-        if not root:
-            po = subprocess.Popen(
-                command,
-                stdin=None,
-                stdout=subprocess.PIPE,
-                shell=True,
-                env=env
-            )
-        else:
-            bash_bin = which("bash")
-            bash_bin = bash_bin if bash_bin is not None else "/bin/bash"
-
-            po = subprocess.Popen(
-                f'{bash_bin} {command}',
-                stdin=None,
-                stdout=subprocess.PIPE,
-                shell=True,
-                env=env
-            )
-
-        return po.communicate()
-
-    # Handle the execute request
-    def called(self, options, content, query):
-        root = False
-        if 'close' in options:
-            os.kill(os.getpid(), 15)
-        if os.path.isfile(content) and not os.access(content, os.X_OK):
+        return b''.join(self._stream(command, root, extra_env)), None
+
+    # Return the output of a command, produced while it runs. No
+    # Content-Length is sent, so the server answers with chunked
+    # Transfer-Encoding and the webview can render the first bytes
+    # before the script exits.
+    def _stream(self, command, root, extra_env={}, isolate=False):
+        return CommandStream(command, root, self._get_variables(extra_env), isolate,
+                             cwd=get_workdir(), environ=get_environ())
+
+    # Make a script file executable, returns True when it has to be
+    # run through bash instead
+    def _make_executable(self, content):
+        path = resolve_path(content)
+        if os.path.isfile(path) and not os.access(path, os.X_OK):
             try:
                 from stat import S_IEXEC, S_IXGRP, S_IXOTH
-                permission = os.stat(content).st_mode
+                permission = os.stat(path).st_mode
                 permission = permission | S_IEXEC | S_IXGRP | S_IXOTH
-                os.chmod(content, permission)
+                os.chmod(path, permission)
             except Exception:
-                root = True
-        (stdout, stderr) = self._execute(
-            content, root, extra_env=get_env_for_shell(query))
-        return stdout
+                return True
+        return False
+
+    # Handle the execute request
+    def called(self, options, content, query):
+        if 'close' in options:
+            # Servers of the daemon close only the windows of their app
+            close = web.ctx.get('bbv_close')
+            if close:
+                close()
+            else:
+                os.kill(os.getpid(), 15)
+        root = self._make_executable(content)
+        directives = get_script_directives(content)
+        isolate = 'isolate' in options or 'isolate' in directives
+        extra_env = get_env_for_shell(query)
+
+        # Scripts can opt in to result caching with "# bbv: cache=30s"
+        policy = directives and cache.get_policy(directives, resolve_path(content.split(None, 1)[0]))
+        if policy:
+            key = ('execute', content, tuple(sorted(extra_env.items())), get_workdir())
+            cached = cache.results.get(key)
+            if cached is not None:
+                return cached
+            return self._stream(content, root, extra_env=extra_env, isolate=isolate) \
+                .add_filter(CacheFilter(key, policy))
+
+        return self._stream(
+            content, root, extra_env=extra_env, isolate=isolate)
+
+
+# Handler for the /events$<command> URL, streaming the output of a
+# command as Server-Sent Events (see EventFilter and bbv-events.sh).
+# Only the $ form is taken, the files of an events/ directory are sent
+# as usual.
+@route('/events', prefix=True, separators='$')
+class events_handler(execute_handler):
+    def called(self, options, content, query):
+        root = self._make_executable(content)
+        directives = get_script_directives(content)
+        isolate = 'isolate' in options or 'isolate' in directives
+        extra_env = get_env_for_shell(query)
+        extra_env['bbv_events'] = EVENTS_HELPER
+
+        set_header('Content-Type', 'text/event-stream; charset=UTF-8')
+        web.header('Cache-Control', 'no-cache')
+        return self._stream(content, root, extra_env=extra_env, isolate=isolate) \
+            .add_filter(EventFilter())
 
 
 # Handler for the default URL
+@route('', prefix=True)
 class default_handler(url_handler):
-    __url__ = '(.*)'
-
     # Handle the default request
     def called(self, options, content, query):
         if content not in ("", "/"):
             return self.bbv_compat_mode(options, content, query)
         else:
+            # The welcome page is only loaded when it is shown
+            from .html import HTML
             return HTML
 
     # Parse and call the appropriate method
@@ -237,46 +417,56 @@ class default_handler(url_handler):
 
     # Handle the request in BBV compatibility mode
     def bbv_compat_mode(self, options, content, query):
-        execute_ext = ('.sh', '.sh.html', '.sh.htm', '.sh.php',
-                    '.sh.py', '.sh.lua', '.sh.rb', '.sh.pl',
-                    '.sh.lisp', '.sh.jl', '.run', '.sh.js', '.sh.css')
-        content_ext = ('.htm', '.html')
-        content_plain_ext = ('.txt')
-        content_css_ext = ('.css')
-        content_js_ext = ('.js')
-        content_svg_ext = ('.svg', '.svgz')
-
         relative_content = content[1:]
-        if os.path.isfile(relative_content):
+        if os.path.isfile(resolve_path(relative_content)):
             if content.startswith('.'):
                 content = relative_content
             else:
                 content = './%s' % relative_content
-        if content.endswith('.sh.css'):  # Existing condition for .sh.css
-            web.header('Content-Type', 'text/css; charset=UTF-8')
-            execute_content = " ".join((content, unquote(self.original_qs)))
-            return execute_handler().called(options, execute_content, query)
-        if content.endswith('.sh.js'):  # New condition for .sh.js
-            web.header('Content-Type', 'text/javascript; charset=UTF-8')
+        content_type, execute = get_file_type(content)
+        web.header('Content-Type', content_type)
+        if execute:
             execute_content = " ".join((content, unquote(self.original_qs)))
             return execute_handler().called(options, execute_content, query)
-        if content.endswith(content_plain_ext):
-            web.header('Content-Type', 'text/plain; charset=UTF-8')
-            return content_handler().called(options, content, query)
-        if content.endswith(content_css_ext):
-            web.header('Content-Type', 'text/css; charset=UTF-8')
-            return content_handler().called(options, content, query)
-        if content.endswith(content_js_ext):
-            web.header('Content-Type', 'text/javascript; charset=UTF-8')
-            return content_handler().called(options, content, query)
-        if content.endswith(content_svg_ext):
-            web.header('Content-Type', 'image/svg+xml; charset=UTF-8')
-            return content_handler().called(options, content, query)
-        web.header('Content-Type', 'text/html; charset=UTF-8')
-        if content.endswith(execute_ext):
-            execute_content = " ".join((content, unquote(self.original_qs)))
-            return execute_handler().called(options, execute_content, query)
-        if content.endswith(content_ext):
-            return content_handler().called(options, content, query)
-        # Default option
         return content_handler().called(options, content, query)
+
+
+# Look up the FILE_TYPES entry of a file name
+def get_file_type(content):
+    name = os.path.basename(content)
+    index = name.find('.')
+    while index != -1:
+        file_type = FILE_TYPES.get(name[index:])
+        if file_type is not None:
+            return file_type
+        index = name.find('.', index + 1)
+    return DEFAULT_FILE_TYPE
+
+
+# Find the file default_handler would answer a request for path with
+# as it is on disk: a binary file, or a text file without include
+# blocks, but not a script. Returns its path and content type, or None.
+# The UI uses it to read such files directly, without a round trip
+# through the server.
+def find_static_file(workdir, path):
+    relative_content = path[1:]
+    content_type, execute = get_file_type(path)
+    if not relative_content or execute:
+        return None
+    # Like bbv_compat_mode, absolute paths are tried when there is no
+    # such file in the app directory
+    filename = os.path.join(workdir, relative_content)
+    if not os.path.isfile(filename):
+        filename = path
+    handler = content_handler()
+    try:
+        if not handler.is_binary(filename):
+            if not templates.load(filename).static:
+                return None
+            return filename, content_type
+    except (OSError, UnicodeDecodeError):
+        return None
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if handler.is_text_type(mimetype):
+        return filename, content_type
+    return filename, mimetype
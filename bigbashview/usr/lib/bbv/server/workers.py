@@ -0,0 +1,225 @@
+import itertools
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import tempfile
+import threading
+from shutil import which
+
+# Maximum size of each output chunk read from a worker
+CHUNK_SIZE = 64 * 1024
+# Seconds between liveness checks while waiting for a worker
+POLL_INTERVAL = 1.0
+
+# Names bash accepts for exported variables
+_ENV_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# Pool shared by the request handlers, created by start_pool()
+pool = None
+
+
+class WorkerDied(Exception):
+    pass
+
+
+# A long-lived bash process that runs one command at a time.
+# Each command runs in a subshell, so it is a fork of an already
+# initialized bash instead of a fork+exec of a new one, and nothing
+# it changes (variables, cwd, options) leaks into the next request.
+class BashWorker(object):
+    def __init__(self, bash_bin):
+        self.requests = 0
+        self.proc = subprocess.Popen(
+            [bash_bin, '--noprofile', '--norc', '-s'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=0,
+            start_new_session=True
+        )
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def send(self, script):
+        self.proc.stdin.write(script.encode('utf-8'))
+
+    # Let bash exit on its own once its input is closed
+    def retire(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        self.proc.wait()
+
+    # Kill the worker and everything started by the current command
+    def kill(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+
+
+class WorkerPool(object):
+    def __init__(self, size, max_requests):
+        self.size = size
+        self.max_requests = max_requests
+        self.bash_bin = which('bash') or '/bin/bash'
+        self._idle = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._dir = tempfile.mkdtemp(prefix='bbv-workers-')
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.append(BashWorker(self.bash_bin))
+
+    def stop(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.retire()
+        try:
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+    # Commands that can't be framed safely run on the one-shot path
+    def accepts(self, command, variables):
+        if '\0' in command:
+            return False
+        for name, value in variables.items():
+            if not _ENV_NAME.match(name) or '\0' in value:
+                return False
+        return True
+
+    def _acquire(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                worker.proc.wait()
+                self._replenish_later()
+        return None
+
+    def _release(self, worker):
+        worker.requests += 1
+        if self.max_requests and worker.requests >= self.max_requests:
+            threading.Thread(target=worker.retire, daemon=True).start()
+            self._replenish_later()
+            return
+        with self._lock:
+            self._idle.append(worker)
+
+    # Start a replacement worker off the request path
+    def _replenish_later(self):
+        def replenish():
+            worker = BashWorker(self.bash_bin)
+            with self._lock:
+                self._idle.append(worker)
+        threading.Thread(target=replenish, daemon=True).start()
+
+    def _build_script(self, command, variables, fifo, cwd):
+        lines = ['cd -- %s || exit' % shlex.quote(cwd)]
+        for name, value in variables.items():
+            lines.append('export %s=%s' % (name, shlex.quote(value)))
+        lines.append('eval %s' % shlex.quote(command))
+        # The command output goes to a per-request fifo; the worker's own
+        # stdout only carries the exit status line that ends the request.
+        return '(\n%s\n) >%s </dev/null; printf "%%d\\n" $?\n' % (
+            '\n'.join(lines), shlex.quote(fifo))
+
+    # Run a command on an idle worker and yield its output. When no
+    # worker is available, the output of fallback() is yielded instead.
+    def run(self, command, variables, fallback, cwd=None):
+        worker = None
+        if self.accepts(command, variables):
+            worker = self._acquire()
+        if worker is None:
+            return (yield from fallback())
+
+        fifo = os.path.join(self._dir, '%d.fifo' % next(self._counter))
+        os.mkfifo(fifo, 0o600)
+        finished = False
+        try:
+            status = yield from self._communicate(
+                worker, command, variables, fifo, cwd or os.getcwd())
+            finished = True
+            return status
+        except WorkerDied:
+            return None
+        finally:
+            os.unlink(fifo)
+            if finished:
+                self._release(worker)
+            else:
+                # Client went away or the worker broke mid-request
+                worker.kill()
+                self._replenish_later()
+
+    def _communicate(self, worker, command, variables, fifo, cwd):
+        ctl = worker.proc.stdout.fileno()
+        # Opening the read end without blocking lets the worker open the
+        # write end whenever its subshell starts.
+        fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+        try:
+            try:
+                worker.send(self._build_script(command, variables, fifo, cwd))
+            except OSError:
+                raise WorkerDied()
+
+            status_line = b''
+            status = None
+            eof = False
+            while not (eof and status is not None):
+                rlist = []
+                if not eof:
+                    rlist.append(fd)
+                if status is None:
+                    rlist.append(ctl)
+                ready, _, _ = select.select(rlist, [], [], POLL_INTERVAL)
+
+                if ctl in ready:
+                    data = os.read(ctl, 64)
+                    if not data:
+                        raise WorkerDied()
+                    status_line += data
+                    if b'\n' in status_line:
+                        status = int(status_line.split(b'\n', 1)[0])
+
+                # Once the subshell is done, a read without writers means
+                # EOF; processes it left in background keep the fifo open.
+                if fd in ready or (status is not None and not eof):
+                    try:
+                        chunk = os.read(fd, CHUNK_SIZE)
+                    except BlockingIOError:
+                        chunk = None
+                    if chunk:
+                        yield chunk
+                    elif chunk == b'':
+                        eof = True
+
+                if not ready and not worker.alive():
+                    raise WorkerDied()
+            return status
+        finally:
+            os.close(fd)
+
+
+def start_pool(size, max_requests):
+    global pool
+    if size > 0:
+        pool = WorkerPool(size, max_requests)
+        pool.start()
+    return pool
+
+
+def stop_pool():
+    global pool
+    if pool is not None:
+        pool.stop()
+        pool = None
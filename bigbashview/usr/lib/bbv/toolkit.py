@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#  This file finds the rendering toolkit used with --toolkit auto.
+#
+#  The toolkits are looked up without importing them, and the one that
+#  was imported successfully is remembered in the cache directory, so a
+#  system where PySide6 is installed but QtWebEngine can't be loaded
+#  doesn't try it again on every launch. The cache is keyed on the
+#  Python version and the modification times of the directories the
+#  toolkits are installed into, so installing or removing packages
+#  makes the next launch look again.
+#
+#  Note: This code is licensed under the GNU General Public License version 3 or later.
+#  For more details, see http://www.gnu.org/licenses/
+
+import json
+import os
+import sys
+from importlib.util import find_spec
+from bbv.paths import get_cache_dir
+
+# Directories of the GObject introspection data WebKitGTK is loaded from
+TYPELIB_DIRS = (
+    '/usr/lib/girepository-1.0',
+    '/usr/lib64/girepository-1.0',
+    '/usr/lib/x86_64-linux-gnu/girepository-1.0',
+    '/usr/lib/aarch64-linux-gnu/girepository-1.0',
+)
+
+
+# Find the toolkit to use without importing it: QtWebEngine if PySide6
+# has it, or else WebKitGTK, or None
+def find_toolkit():
+    if find_spec('PySide6') and find_spec('PySide6.QtWebEngineWidgets'):
+        return 'qt'
+    if find_spec('gi'):
+        return 'gtk'
+    return None
+
+
+def get_cache_path():
+    return os.path.join(get_cache_dir(), 'toolkit.json')
+
+
+# State of the installed packages the cached toolkit is valid for
+def get_cache_key():
+    dirs = [path for path in sys.path if path.endswith(('site-packages', 'dist-packages'))]
+    dirs.extend(os.environ.get('GI_TYPELIB_PATH', '').split(os.pathsep))
+    dirs.extend(TYPELIB_DIRS)
+    mtimes = {}
+    for path in dirs:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    return {'python': sys.version, 'executable': sys.executable, 'mtimes': mtimes}
+
+
+# Toolkit imported by the last launch, or None when the packages
+# changed since
+def get_cached():
+    try:
+        with open(get_cache_path()) as cache:
+            data = json.load(cache)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('key') != get_cache_key():
+        return None
+    if data.get('toolkit') not in ('qt', 'gtk'):
+        return None
+    return data['toolkit']
+
+
+# Remember the toolkit that was imported. The cache is only an
+# optimization, failing to write it is not an error.
+def set_cached(toolkit):
+    path = get_cache_path()
+    temp = '%s.%d' % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp, 'w') as cache:
+            json.dump({'key': get_cache_key(), 'toolkit': toolkit}, cache)
+        os.replace(temp, path)
+    except OSError:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+
+
+def clear_cached():
+    try:
+        os.unlink(get_cache_path())
+    except OSError:
+        pass
@@ -1,9 +1,12 @@
 import os
+import threading
 import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("WebKit", "6.0")
-from gi.repository import Gtk, WebKit, Gdk, Gio, GLib
+gi.require_version("Soup", "3.0")
+from gi.repository import Gtk, WebKit, Gdk, Gio, GLib, Soup
 from bbv.globaldata import ICON, TITLE, EXTERNAL_LINK, PROCESS
+from bbv.ui import scheme
 
 
 class Application(Gtk.Application):
@@ -14,10 +17,117 @@ class Application(Gtk.Application):
     def do_activate(self):
         Window(app=self)
 
+class SchemeRequest(object):
+    """Forward a bbv:// request to the unix socket of the server.
+
+    The body of the request is read, and the response read and written
+    to a pipe, on a thread, and WebKit reads the body of the response
+    from the pipe as it arrives. Static files of apps served by this
+    process are looked up on the thread too and read from disk.
+    """
+    registered = False
+
+    def __init__(self, request):
+        self.request = request
+        uri = GLib.Uri.parse(request.get_uri(), GLib.UriFlags.ENCODED)
+        self.host = uri.get_host()
+        self.path = GLib.Uri.unescape_string(uri.get_path())
+        self.target = uri.get_path() or '/'
+        if uri.get_query():
+            self.target += '?' + uri.get_query()
+        self.method = request.get_http_method() or 'GET'
+        self.headers = {}
+        request.get_http_headers().foreach(self.headers.__setitem__)
+        self.stream = request.get_http_body()
+        threading.Thread(target=self.fetch, daemon=True).start()
+
+    @classmethod
+    def register(cls, context):
+        # The web context is shared by all windows
+        if not cls.registered:
+            context.register_uri_scheme(scheme.SCHEME, cls)
+            security = context.get_security_manager()
+            security.register_uri_scheme_as_secure(scheme.SCHEME)
+            security.register_uri_scheme_as_cors_enabled(scheme.SCHEME)
+            cls.registered = True
+
+    def fetch(self):
+        static = scheme.find_static_file(self.host, self.method, self.path, self.headers)
+        if static is not None:
+            GLib.idle_add(self.send_file, *static)
+            return
+        try:
+            body = self.read_body()
+        except GLib.Error as e:
+            GLib.idle_add(self.fail, e.message)
+            return
+        try:
+            connection = scheme.request(self.host, self.method, self.target,
+                                        self.headers, body)
+            response = connection.getresponse()
+        except scheme.ERRORS as e:
+            GLib.idle_add(self.fail, str(e))
+            return
+        read_fd, write_fd = os.pipe()
+        GLib.idle_add(self.respond, response, read_fd)
+        try:
+            with os.fdopen(write_fd, 'wb', buffering=0) as pipe:
+                while True:
+                    chunk = response.read1(scheme.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+        except scheme.ERRORS:
+            # WebKit closed the stream, the page went away
+            pass
+        finally:
+            connection.close()
+
+    def read_body(self):
+        if self.stream is None:
+            return b''
+        chunks = []
+        while True:
+            data = self.stream.read_bytes(scheme.CHUNK_SIZE, None).get_data()
+            if not data:
+                break
+            chunks.append(data)
+        return b''.join(chunks)
+
+    # Answer with a file read by WebKit straight from disk
+    def send_file(self, filename, content_type):
+        try:
+            stream = Gio.File.new_for_path(filename).read(None)
+            size = stream.query_info(Gio.FILE_ATTRIBUTE_STANDARD_SIZE, None).get_size()
+        except GLib.Error as e:
+            return self.fail(e.message)
+        reply = WebKit.URISchemeResponse.new(stream, size)
+        reply.set_content_type(content_type)
+        self.request.finish_with_response(reply)
+        return False
+
+    def respond(self, response, read_fd):
+        stream = Gio.UnixInputStream.new(read_fd, True)
+        length = int(response.getheader('Content-Length') or -1)
+        reply = WebKit.URISchemeResponse.new(stream, length)
+        reply.set_status(response.status, response.reason)
+        reply.set_content_type(response.getheader('Content-Type') or 'application/octet-stream')
+        headers = Soup.MessageHeaders.new(Soup.MessageHeadersType.RESPONSE)
+        for name, value in scheme.response_headers(response, self.host):
+            headers.append(name, value)
+        reply.set_http_headers(headers)
+        self.request.finish_with_response(reply)
+        return False
+
+    def fail(self, message):
+        self.request.finish_error(GLib.Error(message))
+        return False
+
 class Window(Gtk.Window):
     def __init__(self, app):
         super().__init__(application=app)
         self.webview = WebKit.WebView()
+        SchemeRequest.register(self.webview.get_context())
         settings = self.webview.get_settings()
         settings.set_user_agent("BigBashView-Agent") # User-Agent Custom
         settings.set_enable_developer_extras(True) # Enable Web Inspector
@@ -50,7 +160,7 @@ class Window(Gtk.Window):
             navigation_action = decision.get_navigation_action()
             request = navigation_action.get_request()
             uri = request.get_uri()
-            if not uri.startswith("http://127.0.0.1"):
+            if not uri.startswith(("http://127.0.0.1", scheme.SCHEME + "://")):
                 if navigation_action.get_navigation_type() == WebKit.NavigationType.LINK_CLICKED:
                     # Abre links externos no navegador padrão do sistema
                     Gio.app_info_launch_default_for_uri(uri, None)
@@ -34,14 +34,17 @@
 
 import sys
 import os
-from PySide6.QtCore import QUrl, Qt, QObject, Slot, Signal, QEvent
+import threading
+from PySide6.QtCore import QUrl, Qt, QObject, Slot, Signal, QEvent, QIODevice, QFile
 from PySide6.QtWidgets import QWidget, QHBoxLayout, QSplitter, QApplication, QFileDialog
 from PySide6.QtGui import QIcon, QColor, QKeySequence, QShortcut, QDesktopServices
 from PySide6.QtWebEngineWidgets import QWebEngineView
-from PySide6.QtWebEngineCore import QWebEnginePage, QWebEngineDownloadRequest
+from PySide6.QtWebEngineCore import (QWebEnginePage, QWebEngineDownloadRequest,
+    QWebEngineProfile, QWebEngineUrlRequestJob, QWebEngineUrlScheme, QWebEngineUrlSchemeHandler)
 from PySide6.QtWebChannel import QWebChannel
 
-from bbv.globaldata import ICON, TITLE, PROCESS, EXTERNAL_LINK
+from bbv import globaldata
+from bbv.ui import scheme
 
 # Import gettext module for translations
 import gettext
@@ -55,6 +58,186 @@ lang_translations.install()
 # Define _ shortcut for translations
 _ = lang_translations.gettext
 
+# The bbv:// scheme has to be registered before the application is created
+bbv_scheme = QWebEngineUrlScheme(scheme.SCHEME.encode())
+bbv_scheme.setSyntax(QWebEngineUrlScheme.Syntax.Host)
+bbv_scheme.setFlags(QWebEngineUrlScheme.Flag.SecureScheme |
+                    QWebEngineUrlScheme.Flag.LocalAccessAllowed |
+                    QWebEngineUrlScheme.Flag.CorsEnabled |
+                    QWebEngineUrlScheme.Flag.FetchApiAllowed)
+QWebEngineUrlScheme.registerScheme(bbv_scheme)
+
+# ResponseDevice class holding the body of a bbv:// response as it
+# arrives from the server, read by the web engine as it grows
+class ResponseDevice(QIODevice):
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.buffer = bytearray()
+        self.finished = False
+        self.open(QIODevice.ReadOnly)
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        return len(self.buffer) + super().bytesAvailable()
+
+    def atEnd(self):
+        return self.finished and super().atEnd()
+
+    def readData(self, maxlen):
+        data = bytes(self.buffer[:maxlen])
+        del self.buffer[:maxlen]
+        return data
+
+    def writeData(self, data):
+        return -1
+
+    def append(self, data):
+        self.buffer += data
+        self.readyRead.emit()
+
+    def finish(self):
+        self.finished = True
+        self.readyRead.emit()
+        self.readChannelFinished.emit()
+
+# SchemeReply class forwarding a bbv:// request to the unix socket of
+# the server on a thread, and handing the response over to the web
+# engine on the GUI thread as it arrives. Static files are looked up on
+# the thread too, and read by the web engine straight from disk.
+class SchemeReply(QObject):
+    found_file = Signal(str, str)
+    received_head = Signal(int, object)
+    received_data = Signal(object)
+    finished = Signal()
+    failed = Signal()
+
+    def __init__(self, job, handler):
+        super().__init__()
+        self.job = job
+        self.handler = handler
+        self.device = None
+        self.connection = None
+        self.cancelled = False
+        url = job.requestUrl()
+        self.host = url.host()
+        self.method = bytes(job.requestMethod()).decode()
+        self.path = url.path(QUrl.FullyDecoded)
+        self.target = bytes(url.toEncoded(
+            QUrl.RemoveScheme | QUrl.RemoveAuthority | QUrl.RemoveFragment)).decode()
+        self.headers = {bytes(name).decode(): bytes(value).decode()
+                        for name, value in job.requestHeaders().items()}
+        body = job.requestBody()
+        self.body = bytes(body.readAll()) if body is not None else b''
+
+        self.found_file.connect(self.on_file)
+        self.received_head.connect(self.on_head)
+        self.received_data.connect(self.on_data)
+        self.finished.connect(self.on_finished)
+        self.failed.connect(self.on_failed)
+        job.destroyed.connect(self.cancel)
+        threading.Thread(target=self.fetch, daemon=True).start()
+
+    def fetch(self):
+        static = scheme.find_static_file(self.host, self.method, self.path, self.headers)
+        if static is not None:
+            self.found_file.emit(*static)
+            return
+        response = None
+        try:
+            self.connection = scheme.request(self.host, self.method, self.target,
+                                             self.headers, self.body)
+            response = self.connection.getresponse()
+            self.received_head.emit(response.status, response)
+            while not self.cancelled:
+                chunk = response.read1(scheme.CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.received_data.emit(chunk)
+        except scheme.ERRORS as e:
+            if response is None:
+                print(f"Error requesting {self.host}{self.target}: {e}")
+                self.failed.emit()
+                return
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+        self.finished.emit()
+
+    def on_file(self, filename, content_type):
+        if not self.cancelled:
+            device = QFile(filename, self.job)
+            if device.open(QIODevice.ReadOnly):
+                self.job.reply(content_type.encode(), device)
+            else:
+                self.job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+        self.handler.replies.discard(self)
+
+    def on_head(self, status, response):
+        if self.cancelled:
+            return
+        location = response.getheader('Location')
+        if 300 <= status < 400 and location:
+            url = QUrl(self.job.requestUrl()).resolved(QUrl(scheme.rewrite_location(location, self.host)))
+            self.job.redirect(url)
+            self.cancel()
+        elif status == 404:
+            self.job.fail(QWebEngineUrlRequestJob.Error.UrlNotFound)
+            self.cancel()
+        elif status == 403:
+            self.job.fail(QWebEngineUrlRequestJob.Error.RequestDenied)
+            self.cancel()
+        else:
+            # The web engine answers every bbv:// request with a 200
+            # status, the headers of the response are kept
+            self.job.setAdditionalResponseHeaders({
+                name.encode(): value.encode()
+                for name, value in scheme.response_headers(response, self.host)})
+            content_type = response.getheader('Content-Type') or 'application/octet-stream'
+            self.device = ResponseDevice(self.job)
+            self.job.reply(content_type.encode(), self.device)
+
+    def on_data(self, chunk):
+        if self.device is not None and not self.cancelled:
+            self.device.append(chunk)
+
+    def on_finished(self):
+        if self.device is not None and not self.cancelled:
+            self.device.finish()
+        self.handler.replies.discard(self)
+
+    def on_failed(self):
+        if not self.cancelled:
+            self.job.fail(QWebEngineUrlRequestJob.Error.RequestFailed)
+        self.handler.replies.discard(self)
+
+    def cancel(self):
+        # The page went away, or the job was already answered
+        self.cancelled = True
+        self.device = None
+        if self.connection is not None:
+            self.connection.abort()
+
+# SchemeHandler class serving bbv:// URLs from the unix sockets of the
+# servers, or from disk for static files, installed once on the profile
+# shared by all windows
+class SchemeHandler(QWebEngineUrlSchemeHandler):
+    instance = None
+
+    def __init__(self):
+        super().__init__()
+        self.replies = set()
+
+    @classmethod
+    def install(cls, profile):
+        if cls.instance is None:
+            cls.instance = cls()
+            profile.installUrlSchemeHandler(scheme.SCHEME.encode(), cls.instance)
+
+    def requestStarted(self, job):
+        self.replies.add(SchemeReply(job, self))
+
 # WindowControl class for handling window state changes and interactions
 # between the web view and the main window, using signals and slots
 # acessible from JavaScript code in the web page
@@ -113,26 +296,82 @@ class LinkOpener(QWebEnginePage):
             return False  # Impede que o QWebEngineView siga o link
         return True  # Permite outras navegações, como redirecionamentos
 
-class Window(QWidget):
+# Start the application and the web engine before any window is opened,
+# for a daemon started with --prestart. A blank page starts the browser
+# and renderer processes, and is kept to keep them running. The
+# application doesn't quit when the windows opened later are closed.
+def prestart():
+    app = QApplication.instance() or QApplication(sys.argv)
+    app.setQuitOnLastWindowClosed(False)
+    profile = QWebEngineProfile.defaultProfile()
+    profile.setHttpUserAgent("BigBashView-Agent")
+    SchemeHandler.install(profile)
+    app.blank_page = QWebEnginePage(profile, app)
+    app.blank_page.setUrl(QUrl('about:blank'))
+    return app
+
+# Invoker class for running code on the GUI thread from other threads,
+# used by the daemon to open the windows other launches ask for
+class Invoker(QObject):
+    called = Signal(object)
+
     def __init__(self):
-        # Initialize the application and web view
-        self.app = QApplication(sys.argv)
         super().__init__()
+        self.called.connect(self.call, Qt.QueuedConnection)
+
+    @Slot(object)
+    def call(self, job):
+        job()
+
+    def invoke(self, callback, timeout=None):
+        # Run callback on the GUI thread and wait for its result
+        done = threading.Event()
+        result = {}
+
+        def job():
+            try:
+                result['value'] = callback()
+            except Exception as e:
+                result['error'] = e
+            done.set()
+
+        self.called.emit(job)
+        if not done.wait(timeout):
+            raise TimeoutError('the window was not opened in time')
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+class Window(QWidget):
+    def __init__(self, title=None, icon=None, external_link=None):
+        # Initialize the application and web view, the daemon opens
+        # several windows in the same application
+        self.app = QApplication.instance() or QApplication(sys.argv)
+        super().__init__()
+        self.setAttribute(Qt.WA_DeleteOnClose)
         self.web = QWebEngineView()
-        self.web.page().profile().setHttpUserAgent("BigBashView-Agent")
+        profile = self.web.page().profile()
+        profile.setHttpUserAgent("BigBashView-Agent")
+        SchemeHandler.install(profile)
         self.inspector = QWebEngineView()
 
+        # Window options default to the ones given on the command line
+        title = globaldata.TITLE if title is None else title
+        icon = globaldata.ICON if icon is None else icon
+        if external_link is None:
+            external_link = globaldata.EXTERNAL_LINK
+
         # Set window icon and title
-        self.setWindowIcon(QIcon(ICON))
-        self.app.setDesktopFileName(PROCESS)
+        self.setWindowIcon(QIcon(icon))
+        self.app.setDesktopFileName(globaldata.PROCESS)
 
-        if TITLE:
-            self.app.setApplicationName(TITLE)
-            self.setWindowTitle(TITLE)
+        if title:
+            self.app.setApplicationName(title)
+            self.setWindowTitle(title)
         else:
             self.web.titleChanged.connect(self.title_changed)
 
-        if EXTERNAL_LINK:
+        if external_link:
             self.web.setPage(LinkOpener(self))
 
         # Connect various signals to their respective slots
@@ -273,8 +512,8 @@ class Window(QWidget):
         self.app.exec_()
 
     def close_window(self):
-        # Quit the application when the window is closed
-        self.app.quit()
+        # Close the window, the application quits with its last window
+        self.close()
 
     def title_changed(self, title):
         # Set the window title
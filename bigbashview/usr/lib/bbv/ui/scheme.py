@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+#  This file contains the part of the bbv:// URL scheme shared by the Qt
+#  and GTK UIs.
+#
+#  With --transport unix the server listens on a unix socket in the
+#  user's runtime directory instead of a TCP port. Pages are loaded from
+#  bbv://<app>/path, and the scheme handler of the webview forwards each
+#  request to the socket of <app> and hands the response back. Files
+#  of apps served by this process that the server would send unchanged
+#  are read directly instead.
+#
+#  Note: This code is licensed under the GNU General Public License version 3 or later.
+#  For more details, see http://www.gnu.org/licenses/
+
+import http.client
+import os
+import re
+import socket
+from urllib.parse import urlsplit, urlunsplit
+from bbv.paths import get_runtime_dir
+
+SCHEME = 'bbv'
+# Hosts of bbv:// URLs, named after the socket of their server
+HOST_PATTERN = re.compile(r'^app-\d+-\d+$')
+# Size of the chunks read from the server
+CHUNK_SIZE = 64 * 1024
+# Request headers handled by the connection to the server
+SKIP_REQUEST_HEADERS = ('host', 'connection', 'accept-encoding', 'content-length')
+# Response headers handled by the webview
+SKIP_RESPONSE_HEADERS = ('connection', 'transfer-encoding', 'content-length', 'content-type')
+# Errors of a request to the server
+ERRORS = (OSError, http.client.HTTPException)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = self.unix_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+    # Stop a response being read on another thread
+    def abort(self):
+        try:
+            self.unix_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def get_socket_path(host):
+    if not HOST_PATTERN.match(host):
+        raise FileNotFoundError(host)
+    return os.path.join(get_runtime_dir(), host + '.sock')
+
+
+# Send a request to the server of the app and return the connection to
+# get the response from. Responses are never compressed, the webview
+# doesn't decode them for custom schemes.
+def request(host, method, target, headers, body):
+    connection = UnixHTTPConnection(get_socket_path(host))
+    headers = {name: value for name, value in headers.items()
+               if name.lower() not in SKIP_REQUEST_HEADERS}
+    headers['Host'] = host
+    connection.request(method, target or '/', body or None, headers)
+    return connection
+
+
+# Headers of a response to pass on to the webview
+def response_headers(response, host):
+    headers = []
+    for name, value in response.getheaders():
+        if name.lower() == 'location':
+            value = rewrite_location(value, host)
+        if name.lower() not in SKIP_RESPONSE_HEADERS:
+            headers.append((name, value))
+    return headers
+
+
+# Find a file of an app of this process that the webview can read as
+# it is, instead of asking the server. Returns its path and content
+# type, or None. Range requests go to the server, which answers them
+# with the part of the file asked for.
+def find_static_file(host, method, path, headers):
+    if method not in ('GET', 'HEAD') or any(name.lower() == 'range' for name in headers):
+        return None
+    from bbv.server.bbv2server import find_static_file
+    return find_static_file(host, path)
+
+
+# web.py makes redirects absolute with the Host of the request, turn
+# them back into bbv:// URLs of the app
+def rewrite_location(location, host):
+    parts = urlsplit(location)
+    if parts.scheme == 'http' and parts.netloc == host:
+        return urlunsplit((SCHEME,) + tuple(parts[1:]))
+    return location
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The bbv package is installed to /usr/lib, run the tests from the tree
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'bigbashview', 'usr', 'lib'))
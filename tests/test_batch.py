@@ -0,0 +1,81 @@
+import json
+import pytest
+from bbv.server import bbv2server  # noqa: F401, registers the routes of the API
+from bbv.server.routes import Application, table
+
+
+@pytest.fixture
+def batch(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'general.json').write_text('{"language": "en"}')
+    (tmp_path / 'theme.json').write_text('{"colors": {"background": "#222"}}')
+    app = Application(table)
+
+    def request(operations, query=''):
+        response = app.request('/api/batch' + query, method='POST', data=json.dumps(operations),
+                               env={'REMOTE_ADDR': '127.0.0.1'})
+        return response.status, json.loads(response.data)
+    return request
+
+
+def test_operations_run_in_order(batch, tmp_path):
+    status, results = batch([
+        {'filename': 'general.json'},
+        {'filename': 'theme.json', 'pointer': '/colors'},
+        {'method': 'POST', 'filename': 'state.json', 'body': {'opened': True}},
+        {'filename': 'state.json'},
+    ])
+    assert status.startswith('200')
+    assert [result['status'] for result in results] == [200, 200, 200, 200]
+    assert results[0]['body'] == {'language': 'en'}
+    assert results[1]['body'] == {'background': '#222'}
+    assert results[3]['body'] == {'opened': True}
+
+
+# Without a transaction an operation failing doesn't stop the others
+def test_failed_operation(batch, tmp_path):
+    status, results = batch([
+        {'filename': 'missing.json'},
+        {'method': 'POST', 'filename': 'state.json', 'body': {'opened': True}},
+    ])
+    assert [result['status'] for result in results] == [404, 200]
+    assert (tmp_path / 'state.json').exists()
+
+
+@pytest.mark.parametrize('operations, query', [
+    ([{'method': 'POST', 'filename': 'state.json', 'body': {'opened': True}},
+      {'filename': 'missing.json'},
+      {'method': 'DELETE', 'filename': 'general.json'}], '?transaction=1'),
+    ({'transaction': True, 'operations': [
+        {'method': 'POST', 'filename': 'state.json', 'body': {'opened': True}},
+        {'filename': 'missing.json'},
+        {'method': 'DELETE', 'filename': 'general.json'}]}, ''),
+])
+def test_failed_transaction_changes_nothing(batch, tmp_path, operations, query):
+    status, results = batch(operations, query)
+    assert status.startswith('404')
+    assert [result['status'] for result in results] == [200, 404, 424]
+    assert not (tmp_path / 'state.json').exists()
+    assert (tmp_path / 'general.json').exists()
+
+
+def test_transaction_sees_its_changes(batch, tmp_path):
+    status, results = batch([
+        {'method': 'POST', 'filename': 'state.json', 'body': {'opened': True}},
+        {'filename': 'state.json'},
+    ], '?transaction=1')
+    assert status.startswith('200')
+    assert results[1] == {'status': 200, 'body': {'opened': True}}
+    assert json.loads((tmp_path / 'state.json').read_text()) == {'opened': True}
+
+
+@pytest.mark.parametrize('operations', [
+    {'operations': 'general.json'},
+    [{'filename': ''}],
+    [{'filename': 5}],
+    ['general.json'],
+])
+def test_invalid_batch(batch, operations):
+    status, result = batch(operations)
+    assert status.startswith('400')
+    assert 'error' in result
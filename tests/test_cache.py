@@ -0,0 +1,91 @@
+import os
+from bbv import globaldata
+from bbv.server import cache
+from bbv.server.cache import ResultCache, get_policy
+from bbv.server.commands import CacheFilter, CommandStream
+
+
+def test_no_policy():
+    assert get_policy({}) is None
+    assert get_policy({'timeout': '5s'}) is None
+    assert get_policy({'cache': 'soon'}) is None
+
+
+def test_ttl():
+    assert get_policy({'cache': '30s'}) == (30, ())
+    assert get_policy({'cache': '2m'}) == (120, ())
+    assert get_policy({'cache': '1h'}, '/app/script.sh') == (3600, ('/app/script.sh',))
+
+
+def test_watched_files():
+    assert get_policy({'cache': True, 'watch': '/a,/b'}) == (None, ('/a', '/b'))
+    assert get_policy({'watch': '/a'}) == (None, ('/a',))
+    assert get_policy({'cache': 'mtime'}, '/app/script.sh') == (None, ('/app/script.sh',))
+
+
+# Without a time or a watched file the result would never be refreshed
+def test_bare_cache_expires():
+    assert get_policy({'cache': True}) == (globaldata.CACHE_TTL, ())
+    assert get_policy({'cache': 'mtime'}) == (globaldata.CACHE_TTL, ())
+
+
+def test_result_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('bbv.server.cache.time.monotonic', lambda: now[0])
+    results = ResultCache(8, 1024)
+    results.put('key', 'value', 30)
+    assert results.get('key') == 'value'
+    now[0] += 30
+    assert results.get('key') is None
+
+
+def test_result_dropped_when_watched_file_changes(tmp_path):
+    path = tmp_path / 'watched'
+    path.write_text('1')
+    results = ResultCache(8, 1024)
+    results.put('key', 'value', None, (str(path),))
+    assert results.get('key') == 'value'
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert results.get('key') is None
+
+
+def test_least_recently_used_evicted():
+    results = ResultCache(2, 1024)
+    results.put('a', 'x')
+    results.put('b', 'y')
+    results.get('a')
+    results.put('c', 'z')
+    assert results.get('b') is None
+    assert results.get('a') == 'x' and results.get('c') == 'z'
+
+
+def test_size_limit():
+    results = ResultCache(8, 10)
+    results.put('large', 'x' * 11)
+    assert results.get('large') is None
+    results.put('a', 'x' * 6)
+    results.put('b', 'y' * 6)
+    assert results.get('a') is None
+    assert results.get('b') == 'yyyyyy'
+
+
+def test_cache_filter_keeps_output_of_commands_that_succeed(monkeypatch):
+    monkeypatch.setattr(cache, 'results', ResultCache(8, 1024))
+    stream = CommandStream('echo one; echo two', False, {}).add_filter(CacheFilter('ok', (30, ())))
+    assert b''.join(stream) == b'one\ntwo\n'
+    assert cache.results.get('ok') == b'one\ntwo\n'
+
+    stream = CommandStream('echo one; exit 1', False, {}).add_filter(CacheFilter('failed', (30, ())))
+    assert b''.join(stream) == b'one\n'
+    assert cache.results.get('failed') is None
+
+
+def test_cache_filter_drops_large_output(monkeypatch):
+    monkeypatch.setattr(cache, 'results', ResultCache(8, 1024))
+    output_filter = CacheFilter('large', (30, ()))
+    for _ in range(3):
+        assert output_filter.feed(b'x' * 400) == b'x' * 400
+    assert output_filter._chunks == []
+    output_filter.finish(0)
+    assert cache.results.get('large') is None
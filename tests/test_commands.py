@@ -0,0 +1,41 @@
+import asyncio
+import os
+from bbv.server.commands import CommandStream
+
+
+def run(stream):
+    return b''.join(stream)
+
+
+def test_output_and_status():
+    stream = CommandStream('echo one; echo two >&2; echo three; exit 3', False, {})
+    assert run(stream) == b'one\nthree\n'
+    assert stream.status == 3
+
+
+def test_variables_directory_and_environment(tmp_path):
+    stream = CommandStream('echo "$p_name $HOME_TEST"; pwd', False, {'p_name': 'value'},
+                           cwd=str(tmp_path), environ={'HOME_TEST': 'env', 'PATH': os.environ['PATH']})
+    assert run(stream) == b'value env\n%s\n' % str(tmp_path).encode()
+
+
+# Output is handed over as it is produced, not when the command ends
+def test_output_streamed():
+    stream = CommandStream('echo first; sleep 5; echo second', False, {})
+    assert next(stream) == b'first\n'
+    stream.close()
+
+
+def test_script_run_through_bash(tmp_path):
+    script = tmp_path / 'script.sh'
+    script.write_text('echo "from $0"\n')
+    stream = CommandStream(str(script), True, {})
+    assert run(stream) == b'from %s\n' % str(script).encode()
+
+
+def test_asyncio_chunks():
+    async def collect(stream):
+        return b''.join([chunk async for chunk in stream.chunks()])
+    stream = CommandStream('echo one; echo two; exit 1', False, {})
+    assert asyncio.run(collect(stream)) == b'one\ntwo\n'
+    assert stream.status == 1
@@ -0,0 +1,142 @@
+import zlib
+import pytest
+from bbv.server import compress
+from bbv.server.compress import CompressionMiddleware, ResultCache, _decode_etags, _encode_etag, \
+    compressible, encoded_headers, negotiate
+
+TEXT = b'<p>compressible text</p>\n' * 100
+
+
+@pytest.fixture(autouse=True)
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(compress, 'brotli', None)
+    monkeypatch.setattr(compress, 'compressed', ResultCache(8, 1024 * 1024))
+
+
+@pytest.mark.parametrize('header, encoding', [
+    ('', None),
+    ('gzip', 'gzip'),
+    ('deflate, GZIP', 'gzip'),
+    ('gzip;q=0', None),
+    ('gzip; q=0.5', 'gzip'),
+    ('br', None),
+    ('*', 'gzip'),
+    ('*;q=0', None),
+    ('gzip;q=0, *', None),
+    ('gzip;q=bad', None),
+])
+def test_negotiate(header, encoding):
+    assert negotiate(header) == encoding
+
+
+def test_negotiate_prefers_brotli(monkeypatch):
+    monkeypatch.setattr(compress, 'brotli', object())
+    assert negotiate('gzip, br') == 'br'
+    assert negotiate('gzip, br;q=0') == 'gzip'
+
+
+@pytest.mark.parametrize('status, headers, result', [
+    (200, {'content-type': 'text/html'}, True),
+    (200, {'content-type': 'image/svg+xml'}, True),
+    (200, {'content-type': 'image/png'}, False),
+    (200, {'content-type': 'text/event-stream'}, False),
+    (200, {}, False),
+    (200, {'content-type': 'text/html', 'content-encoding': 'gzip'}, False),
+    (200, {'content-type': 'text/html', 'content-range': 'bytes 0-1/2'}, False),
+    (404, {'content-type': 'text/html'}, False),
+])
+def test_compressible(status, headers, result):
+    assert compressible(status, headers) is result
+
+
+def test_encoded_headers():
+    headers = [('Content-Type', 'text/html'), ('Content-Length', '10'), ('ETag', '"abc"')]
+    assert encoded_headers(headers, 'gzip', '"abc"') == [
+        ('Content-Type', 'text/html'), ('Content-Encoding', 'gzip'),
+        ('Vary', 'Accept-Encoding'), ('ETag', '"abc-gzip"')]
+
+
+def test_etags_of_encoded_variants():
+    assert _encode_etag('"abc"', 'gzip') == '"abc-gzip"'
+    assert _decode_etags('"abc-gzip", "def", "ghi-br"', 'gzip') == '"abc", "def", "ghi-br"'
+
+
+def request(app, **environ):
+    environ.setdefault('REQUEST_METHOD', 'GET')
+    environ.setdefault('HTTP_ACCEPT_ENCODING', 'gzip')
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = status
+        response['headers'] = dict(headers)
+
+    chunks = list(CompressionMiddleware(app)(environ, start_response))
+    return response['status'], response['headers'], chunks
+
+
+def static_app(environ, start_response):
+    if environ.get('HTTP_IF_NONE_MATCH') == '"v1"':
+        start_response('304 Not Modified', [('ETag', '"v1"')])
+        return []
+    start_response('200 OK', [('Content-Type', 'text/html'), ('Content-Length', str(len(TEXT))),
+                              ('ETag', '"v1"')])
+    return [TEXT]
+
+
+def test_whole_body():
+    status, headers, chunks = request(static_app)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['ETag'] == '"v1-gzip"'
+    data = b''.join(chunks)
+    assert headers['Content-Length'] == str(len(data))
+    assert zlib.decompress(data, 16 + zlib.MAX_WBITS) == TEXT
+
+
+def test_revalidating_encoded_variant():
+    status, headers, chunks = request(static_app, HTTP_IF_NONE_MATCH='"v1-gzip"')
+    assert status.startswith('304')
+    assert headers['ETag'] == '"v1-gzip"'
+
+
+@pytest.mark.parametrize('environ', [
+    {'HTTP_ACCEPT_ENCODING': ''},
+    {'REQUEST_METHOD': 'HEAD'},
+])
+def test_identity(environ):
+    status, headers, chunks = request(static_app, **environ)
+    assert 'Content-Encoding' not in headers
+    assert b''.join(chunks) == TEXT
+
+
+def test_small_body_not_compressed():
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/html'), ('Content-Length', '2')])
+        return [b'hi']
+    status, headers, chunks = request(app)
+    assert 'Content-Encoding' not in headers
+    assert chunks == [b'hi']
+
+
+# Every chunk of a stream can be decompressed as soon as it arrives
+def test_streamed_body_flushed_after_each_chunk():
+    closed = []
+
+    class Body(object):
+        def __iter__(self):
+            yield b'first\n'
+            yield b'second\n'
+
+        def close(self):
+            closed.append(True)
+
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return Body()
+
+    status, headers, chunks = request(app)
+    assert headers['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in headers
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert [decompressor.decompress(chunk) for chunk in chunks[:2]] == [b'first\n', b'second\n']
+    assert decompressor.decompress(chunks[2]) + decompressor.flush() == b''
+    assert closed == [True]
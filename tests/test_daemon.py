@@ -0,0 +1,24 @@
+from bbv.daemon import get_server_key
+
+ENVIRON = {'HOME': '/home/user', 'PATH': '/usr/bin', 'LANG': 'C.UTF-8'}
+
+
+def test_same_launch_same_key():
+    assert get_server_key('/apps/a', ENVIRON) == get_server_key('/apps/a', dict(ENVIRON))
+
+
+def test_variables_of_the_launch_ignored():
+    launch = dict(ENVIRON, DESKTOP_STARTUP_ID='abc', SHLVL='3', _='/usr/bin/bigbashview',
+                  OLDPWD='/tmp', INVOCATION_ID='1234')
+    assert get_server_key('/apps/a', launch) == get_server_key('/apps/a', ENVIRON)
+
+
+def test_directory_and_environment_make_another_app():
+    key = get_server_key('/apps/a', ENVIRON)
+    assert get_server_key('/apps/b', ENVIRON) != key
+    assert get_server_key('/apps/a', dict(ENVIRON, LANG='pt_BR.UTF-8')) != key
+    assert get_server_key('/apps/a', dict(ENVIRON, APP_MODE='1')) != key
+
+
+def test_key_is_hashable():
+    assert len({get_server_key('/apps/a', ENVIRON), get_server_key('/apps/a', ENVIRON)}) == 1
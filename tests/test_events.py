@@ -0,0 +1,45 @@
+from bbv.server import bbv2server  # noqa: F401, registers the routes of the API
+from bbv.server.commands import CommandStream, EventFilter
+from bbv.server.routes import Application, table
+
+
+def test_lines_become_messages():
+    events = EventFilter()
+    assert events.feed(b'one\ntwo\r\n') == b'data: one\n\ndata: two\n\n'
+    assert events.finish(0) == b'event: bbv-exit\ndata: 0\n\n'
+
+
+def test_lines_split_across_chunks():
+    events = EventFilter()
+    assert events.feed(b'hal') == b''
+    assert events.feed(b'f\nnext') == b'data: half\n\n'
+    assert events.finish(3) == b'data: next\n\nevent: bbv-exit\ndata: 3\n\n'
+
+
+def test_named_events():
+    events = EventFilter()
+    assert events.feed(b'::bbv-event progress 50%\n') == b'event: progress\ndata: 50%\n\n'
+    assert events.feed(b'::bbv-event done\n') == b'event: done\ndata: \n\n'
+    # Without a name the line is a plain message
+    assert events.feed(b'::bbv-event \n') == b'data: ::bbv-event \n\n'
+
+
+def test_unknown_exit_status():
+    assert EventFilter().finish(None) == b'event: bbv-exit\ndata: \n\n'
+
+
+def test_command_events():
+    stream = CommandStream('echo start; echo "::bbv-event step 1"; exit 2', False, {})
+    assert b''.join(stream.add_filter(EventFilter())) == (
+        b'data: start\n\nevent: step\ndata: 1\n\nevent: bbv-exit\ndata: 2\n\n')
+
+
+def test_events_handler(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'install.sh').write_text('#!/bin/bash\necho "$name"\n')
+    response = Application(table).request(
+        '/events$./install.sh?name=app', env={'REMOTE_ADDR': '127.0.0.1'})
+    assert response.status.startswith('200')
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.data == b'data: app\n\nevent: bbv-exit\ndata: 0\n\n'
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import pytest
+from bbv.server.filestore import FileStore
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_write_reaches_the_disk(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    store.write(path, {'a': 1})
+    assert read_json(path) == {'a': 1}
+    assert json.loads(store.read(path)) == {'a': 1}
+    assert json.loads(store.read(path, '/a')) == 1
+
+
+def test_concurrent_updates_are_all_kept(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    store.write(path, {})
+    start = threading.Barrier(20)
+
+    def update(n):
+        start.wait()
+        for i in range(10):
+            store.update(path, {'%d-%d' % (n, i): i})
+
+    threads = [threading.Thread(target=update, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    expected = {'%d-%d' % (n, i): i for n in range(20) for i in range(10)}
+    assert read_json(path) == expected
+    assert json.loads(store.read(path)) == expected
+    # Files are replaced whole, no temporary file is left behind
+    assert os.listdir(tmp_path) == ['data.json']
+
+
+def test_concurrent_writes_leave_a_whole_file(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    values = [{'writer': n, 'items': list(range(1000))} for n in range(8)]
+    threads = [threading.Thread(target=store.write, args=(path, value)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert read_json(path) in values
+    assert read_json(path) == json.loads(store.read(path))
+
+
+def test_update_needs_an_object(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    store.write(path, [1, 2])
+    with pytest.raises(TypeError):
+        store.update(path, {'a': 1})
+    assert read_json(path) == [1, 2]
+
+
+def test_delete(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    store.write(path, {})
+    store.delete(path)
+    assert not os.path.exists(path)
+    with pytest.raises(FileNotFoundError):
+        store.delete(path)
+
+
+def test_transaction_commit(tmp_path):
+    first, second = str(tmp_path / 'first.json'), str(tmp_path / 'second.json')
+    store = FileStore(64)
+    store.write(first, {'count': 1})
+    store.write(second, {'count': 1})
+    with store.transaction([first, second]) as transaction:
+        transaction.modify(first, lambda data: {'count': data['count'] + 1})
+        transaction.delete(second)
+        # Staged changes are seen through the transaction only
+        assert json.loads(transaction.read(first)) == {'count': 2}
+        assert read_json(first) == {'count': 1}
+        transaction.commit()
+    assert read_json(first) == {'count': 2}
+    assert not os.path.exists(second)
+
+
+def test_transaction_rolled_back_on_error(tmp_path):
+    first, second = str(tmp_path / 'first.json'), str(tmp_path / 'second.json')
+    store = FileStore(64)
+    store.write(first, {'count': 1})
+    with pytest.raises(KeyError):
+        with store.transaction([first, second]) as transaction:
+            transaction.write(second, {'count': 1})
+            transaction.update(first, {'count': 2})
+            transaction.modify(first, lambda data: data['missing'])
+            transaction.commit()
+    assert read_json(first) == {'count': 1}
+    assert json.loads(store.read(first)) == {'count': 1}
+    assert not os.path.exists(second)
+
+
+def test_transaction_without_commit_changes_nothing(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    store.write(path, {'a': 1})
+    with store.transaction([path]) as transaction:
+        transaction.write(path, {'a': 2})
+    assert read_json(path) == {'a': 1}
+
+
+def test_transaction_only_changes_its_files(tmp_path):
+    path = str(tmp_path / 'data.json')
+    store = FileStore(64)
+    with store.transaction([path]) as transaction:
+        with pytest.raises(RuntimeError):
+            transaction.write(str(tmp_path / 'other.json'), {})
@@ -0,0 +1,86 @@
+import os
+import pytest
+from bbv.server.includes import INCLUDE_MARKER, SEARCH_CHUNK_SIZE, Include, TemplateCache, \
+    compile_template, has_includes, parse_options
+
+
+def test_parse_options():
+    assert parse_options('serial timeout=5 cache=30s') == \
+        {'serial': True, 'timeout': '5', 'cache': '30s'}
+    assert parse_options('') == {}
+    assert parse_options(None) == {}
+
+
+def test_compile_template():
+    segments = compile_template(
+        'a<?include bash echo 1?>b<?include python[serial timeout=5]\nprint(2)\n?>'
+        '<?include html part.html?>')
+    assert segments == [
+        'a',
+        Include('bash', {}, 'echo 1', '<?include bash echo 1?>'),
+        'b',
+        Include('python', {'serial': True, 'timeout': '5'}, 'print(2)',
+                '<?include python[serial timeout=5]\nprint(2)\n?>'),
+        Include('html', {}, 'part.html', '<?include html part.html?>'),
+    ]
+
+
+@pytest.mark.parametrize('text', [
+    '', 'plain text', '<?include?>', '<?include bash echo unterminated',
+    '<?xml version="1.0"?><a/>', '<?includebash echo?>',
+])
+def test_compile_template_without_includes(text):
+    assert ''.join(compile_template(text)) == text
+    assert all(isinstance(segment, str) for segment in compile_template(text))
+
+
+# Blocks end at the first ?>
+def test_include_body_is_not_greedy():
+    segments = compile_template('<?include bash echo a?> <?include bash echo b?>')
+    assert [segment.body for segment in segments[::2]] == ['echo a', 'echo b']
+
+
+def test_template_cache(tmp_path):
+    path = tmp_path / 'page.html'
+    path.write_text('<p><?include bash date?></p>')
+    templates = TemplateCache(8, 1024)
+    template = templates.load(str(path))
+    assert not template.static
+    assert templates.load(str(path)) is template
+
+    path.write_text('<p>static page</p>')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    template = templates.load(str(path))
+    assert template.static
+    assert template.data == b'<p>static page</p>'
+
+
+def test_template_cache_limits(tmp_path):
+    templates = TemplateCache(2, 1024)
+    paths = []
+    for name in 'abc':
+        path = tmp_path / name
+        path.write_text(name)
+        paths.append(str(path))
+        templates.load(str(path))
+    assert list(templates._entries) == paths[1:]
+
+
+@pytest.mark.parametrize('position', [
+    0, 100, SEARCH_CHUNK_SIZE - len(INCLUDE_MARKER), SEARCH_CHUNK_SIZE - 4,
+    SEARCH_CHUNK_SIZE - 1, SEARCH_CHUNK_SIZE, 3 * SEARCH_CHUNK_SIZE + 5,
+])
+def test_has_includes(tmp_path, position):
+    path = tmp_path / 'large.txt'
+    data = b'x' * position + b'<?include bash echo hi?>' + b'y' * SEARCH_CHUNK_SIZE
+    path.write_bytes(data)
+    assert has_includes(str(path))
+
+
+def test_has_no_includes(tmp_path):
+    path = tmp_path / 'large.txt'
+    path.write_bytes(b'<?include' + b'x' * 3 * SEARCH_CHUNK_SIZE + b'<?includ')
+    assert not has_includes(str(path))
+    path.write_bytes(b'')
+    assert not has_includes(str(path))
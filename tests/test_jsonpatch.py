@@ -0,0 +1,161 @@
+import copy
+import pytest
+from bbv.server.jsonpatch import PatchConflict, PatchError, apply_patch, merge_patch, resolve
+
+# RFC 6901, section 5
+POINTER_DOCUMENT = {
+    "foo": ["bar", "baz"],
+    "": 0,
+    "a/b": 1,
+    "c%d": 2,
+    "e^f": 3,
+    "g|h": 4,
+    "i\\j": 5,
+    "k\"l": 6,
+    " ": 7,
+    "m~n": 8,
+}
+
+
+@pytest.mark.parametrize('pointer, value', [
+    ('', POINTER_DOCUMENT),
+    ('/foo', ["bar", "baz"]),
+    ('/foo/0', "bar"),
+    ('/', 0),
+    ('/a~1b', 1),
+    ('/c%d', 2),
+    ('/e^f', 3),
+    ('/g|h', 4),
+    ('/i\\j', 5),
+    ('/k"l', 6),
+    ('/ ', 7),
+    ('/m~0n', 8),
+])
+def test_pointer_rfc_examples(pointer, value):
+    assert resolve(POINTER_DOCUMENT, pointer) == value
+
+
+@pytest.mark.parametrize('pointer', ['/bar', '/foo/2', '/foo/01', '/foo/-', '/foo/0/x'])
+def test_pointer_missing(pointer):
+    with pytest.raises(PatchConflict):
+        resolve(POINTER_DOCUMENT, pointer)
+
+
+def test_pointer_invalid():
+    with pytest.raises(PatchError):
+        resolve(POINTER_DOCUMENT, 'foo')
+
+
+# RFC 6902, appendix A: document, patch and the result, or None when the
+# patch fails
+PATCH_EXAMPLES = [
+    # A.1 to A.10
+    ({"foo": "bar"}, [{"op": "add", "path": "/baz", "value": "qux"}],
+     {"baz": "qux", "foo": "bar"}),
+    ({"foo": ["bar", "baz"]}, [{"op": "add", "path": "/foo/1", "value": "qux"}],
+     {"foo": ["bar", "qux", "baz"]}),
+    ({"baz": "qux", "foo": "bar"}, [{"op": "remove", "path": "/baz"}],
+     {"foo": "bar"}),
+    ({"foo": ["bar", "qux", "baz"]}, [{"op": "remove", "path": "/foo/1"}],
+     {"foo": ["bar", "baz"]}),
+    ({"baz": "qux", "foo": "bar"}, [{"op": "replace", "path": "/baz", "value": "boo"}],
+     {"baz": "boo", "foo": "bar"}),
+    ({"foo": {"bar": "baz", "waldo": "fred"}, "qux": {"corge": "grault"}},
+     [{"op": "move", "from": "/foo/waldo", "path": "/qux/thud"}],
+     {"foo": {"bar": "baz"}, "qux": {"corge": "grault", "thud": "fred"}}),
+    ({"foo": ["all", "grass", "cows", "eat"]},
+     [{"op": "move", "from": "/foo/1", "path": "/foo/3"}],
+     {"foo": ["all", "cows", "eat", "grass"]}),
+    ({"baz": "qux", "foo": ["a", 2, "c"]},
+     [{"op": "test", "path": "/baz", "value": "qux"},
+      {"op": "test", "path": "/foo/1", "value": 2}],
+     {"baz": "qux", "foo": ["a", 2, "c"]}),
+    ({"baz": "qux"}, [{"op": "test", "path": "/baz", "value": "bar"}], None),
+    ({"foo": "bar"}, [{"op": "add", "path": "/child", "value": {"grandchild": {}}}],
+     {"foo": "bar", "child": {"grandchild": {}}}),
+    # A.11, members other than those of the operation are ignored
+    ({"foo": "bar"}, [{"op": "add", "path": "/baz", "value": "qux", "xyz": 123}],
+     {"foo": "bar", "baz": "qux"}),
+    # A.12
+    ({"foo": "bar"}, [{"op": "add", "path": "/baz/bat", "value": "qux"}], None),
+    # A.14
+    ({"/": 9, "~1": 10}, [{"op": "test", "path": "/~01", "value": 10}],
+     {"/": 9, "~1": 10}),
+    # A.15
+    ({"/": 9, "~1": 10}, [{"op": "test", "path": "/~01", "value": "10"}], None),
+    # A.16
+    ({"foo": ["bar"]}, [{"op": "add", "path": "/foo/-", "value": ["abc", "def"]}],
+     {"foo": ["bar", ["abc", "def"]]}),
+]
+
+
+@pytest.mark.parametrize('document, patch, result', PATCH_EXAMPLES)
+def test_patch_rfc_examples(document, patch, result):
+    original = copy.deepcopy(document)
+    if result is None:
+        with pytest.raises(PatchConflict):
+            apply_patch(document, patch)
+    else:
+        assert apply_patch(document, patch) == result
+    # Documents are never changed in place
+    assert document == original
+
+
+def test_patch_is_applied_as_a_whole():
+    document = {"a": 1}
+    patch = [{"op": "replace", "path": "/a", "value": 2},
+             {"op": "remove", "path": "/missing"}]
+    with pytest.raises(PatchConflict):
+        apply_patch(document, patch)
+    assert document == {"a": 1}
+
+
+@pytest.mark.parametrize('patch', [
+    {"op": "add", "path": "/a", "value": 1},
+    [{"op": "frobnicate", "path": "/a"}],
+    [{"op": "add", "path": "/a"}],
+    [{"op": "move", "from": "/a", "path": "/a/b"}],
+    [{"op": "move", "from": "/a", "path": 1}],
+    [{"op": "move", "from": "/a", "path": None}],
+    [{"op": "copy", "from": "/a", "path": ["a"]}],
+    [{"op": "remove", "path": 1}],
+])
+def test_patch_invalid(patch):
+    with pytest.raises(PatchError) as error:
+        apply_patch({"a": {}}, patch)
+    assert not isinstance(error.value, PatchConflict)
+
+
+def test_patch_move_to_itself_or_sibling():
+    assert apply_patch({"a": 1}, [{"op": "move", "from": "/a", "path": "/a"}]) == {"a": 1}
+    assert apply_patch({"a": 1}, [{"op": "move", "from": "/a", "path": "/ab"}]) == {"ab": 1}
+
+
+def test_patch_test_compares_numbers_by_value():
+    assert apply_patch({"a": 1}, [{"op": "test", "path": "/a", "value": 1.0}]) == {"a": 1}
+    with pytest.raises(PatchConflict):
+        apply_patch({"a": 1}, [{"op": "test", "path": "/a", "value": True}])
+
+
+# RFC 7396, appendix A
+@pytest.mark.parametrize('document, patch, result', [
+    ({"a": "b"}, {"a": "c"}, {"a": "c"}),
+    ({"a": "b"}, {"b": "c"}, {"a": "b", "b": "c"}),
+    ({"a": "b"}, {"a": None}, {}),
+    ({"a": "b", "b": "c"}, {"a": None}, {"b": "c"}),
+    ({"a": ["b"]}, {"a": "c"}, {"a": "c"}),
+    ({"a": "c"}, {"a": ["b"]}, {"a": ["b"]}),
+    ({"a": {"b": "c"}}, {"a": {"b": "d", "c": None}}, {"a": {"b": "d"}}),
+    ({"a": [{"b": "c"}]}, {"a": [1]}, {"a": [1]}),
+    (["a", "b"], ["c", "d"], ["c", "d"]),
+    ({"a": "b"}, ["c"], ["c"]),
+    ({"a": "foo"}, None, None),
+    ({"a": "foo"}, "bar", "bar"),
+    ({"e": None}, {"a": 1}, {"e": None, "a": 1}),
+    ([1, 2], {"a": "b", "c": None}, {"a": "b"}),
+    ({}, {"a": {"bb": {"ccc": None}}}, {"a": {"bb": {}}}),
+])
+def test_merge_patch_rfc_examples(document, patch, result):
+    original = copy.deepcopy(document)
+    assert merge_patch(document, patch) == result
+    assert document == original
@@ -0,0 +1,103 @@
+import json
+import pytest
+from array import array
+from bbv.server.jsonstream import CHUNK_SIZE, InvalidJSON, Scanner, read_lines, stream_file
+
+VALID = [
+    b'0', b'-1.5e+10', b'"text"', b'true', b'null', b'[]', b'{}', b'  [ ]  ',
+    b'[1, 2.5, -3e2, "a", true, false, null]',
+    b'{"a": [1, {"b": null}], "c": "d\\"e", "f": {}}',
+    b'[[[[]]], {"a": [{}]}]',
+    '["é€\U0001f600", {"ü": 1}]'.encode('utf-8'),
+    b'["\\u00e9\\ud83d\\ude00"]',
+    b'12345678901234567890',
+    b'[123456789, 0.000001, 1E5]',
+]
+
+INVALID = [
+    b'', b'   ', b'[', b'{', b']', b'[1,]', b'[1 2]', b'{"a" 1}', b'{"a": 1,}',
+    b'{1: 2}', b'"unterminated', b'[01]', b'[1.]', b'[-]', b'tru', b'nul',
+    b'[1] [2]', b'{} x', b'["\x01"]', b'["a\\x"]', b'[1,,2]', b'[,1]',
+    b'["\xff"]', b'["\xc3"]', '["é"]'.encode('utf-8')[:-3] + b'"]',
+]
+
+
+def scan(data, size, items=None):
+    scanner = Scanner(items)
+    for i in range(0, len(data), size):
+        scanner.feed(data[i:i + size])
+    scanner.close()
+    return scanner
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+@pytest.mark.parametrize('data', VALID)
+def test_scanner_valid(data, size):
+    json.loads(data)
+    scan(data, size)
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 64])
+@pytest.mark.parametrize('data', INVALID)
+def test_scanner_invalid(data, size):
+    with pytest.raises(ValueError):
+        json.loads(data.decode('utf-8'))
+    with pytest.raises(InvalidJSON):
+        scan(data, size)
+
+
+# Numbers are only complete once what follows them is known
+@pytest.mark.parametrize('size', [1, 2, 3, 4, 5])
+def test_scanner_numbers_cut_at_chunk_ends(size):
+    assert scan(b'[12345, 6789]', size).is_array
+    scan(b'12345', size)
+    with pytest.raises(InvalidJSON):
+        scan(b'[12345 6789]', size)
+
+
+@pytest.mark.parametrize('size', [1, 3, 64])
+def test_scanner_item_offsets(size):
+    data = '[1, "é", {"a": [2]} , []]'.encode('utf-8')
+    items = array('q')
+    scanner = scan(data, size, items)
+    assert scanner.is_array
+    ranges = list(zip(items[::2], items[1::2]))
+    assert [data[start:end] for start, end in ranges] == \
+        [b'1', '"é"'.encode('utf-8'), b'{"a": [2]}', b'[]']
+
+
+def test_scanner_object_is_not_array():
+    assert not scan(b'{"a": 1}', 64).is_array
+
+
+def test_scanner_error_offset():
+    with pytest.raises(InvalidJSON, match='byte 9'):
+        scan(b'[1, 2, 3 4]', 3)
+
+
+def test_stream_file_validates_across_chunks(tmp_path):
+    path = tmp_path / 'data.json'
+    data = json.dumps([{'n': n, 'text': 'x' * 50} for n in range(5000)]).encode()
+    assert len(data) > 2 * CHUNK_SIZE
+    path.write_bytes(data)
+    assert b''.join(stream_file(str(path))) == data
+
+    path.write_bytes(data[:-1])
+    with pytest.raises(InvalidJSON):
+        b''.join(stream_file(str(path)))
+    assert b''.join(stream_file(str(path), validate=False)) == data[:-1]
+
+
+def test_stream_file_checks_first_chunk(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_bytes(b'not json')
+    with pytest.raises(InvalidJSON):
+        stream_file(str(path))
+
+
+def test_read_lines(tmp_path):
+    path = tmp_path / 'log.jsonl'
+    path.write_bytes(b'{"n": 0}\n\n{"n": 1}\n{"n": 2}\n{"n": ')
+    records, count = read_lines(str(path), 1, 5)
+    assert json.loads(records) == [{'n': 1}, {'n': 2}]
+    assert count == 3
@@ -0,0 +1,45 @@
+import os
+import socket
+import stat
+import pytest
+from bbv import paths
+
+
+@pytest.fixture
+def runtime(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.setattr(paths, '_runtime_dir', None)
+    return tmp_path / 'bigbashview'
+
+
+def test_runtime_dir_created_private(runtime):
+    assert paths.get_runtime_dir() == str(runtime)
+    assert stat.S_IMODE(os.lstat(runtime).st_mode) == 0o700
+    # Picked once per process
+    assert paths.get_runtime_dir() == str(runtime)
+
+
+def test_runtime_dir_open_to_others_not_used(runtime):
+    runtime.mkdir(0o755)
+    os.chmod(runtime, 0o755)
+    path = paths.get_runtime_dir()
+    assert path != str(runtime)
+    assert stat.S_IMODE(os.lstat(path).st_mode) == 0o700
+    os.rmdir(path)
+
+
+def test_runtime_dir_symlink_not_used(runtime, tmp_path):
+    target = tmp_path / 'elsewhere'
+    target.mkdir(0o700)
+    runtime.symlink_to(target)
+    path = paths.get_runtime_dir()
+    assert path not in (str(runtime), str(target))
+    os.rmdir(path)
+
+
+def test_private_socket(tmp_path):
+    path = str(tmp_path / 'test.sock')
+    soc = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with soc:
+        paths.bind_private_socket(soc, path)
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
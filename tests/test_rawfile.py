@@ -0,0 +1,105 @@
+import io
+import os
+import pytest
+from bbv.server.rawfile import CHUNK_SIZE, align_text, decode_text, read_range
+
+TEXT = 'aéb€c\U0001f600d'.encode('utf-8')
+
+
+class ClosingBytesIO(io.BytesIO):
+    name = 'test.bin'
+    closed_by_reader = False
+
+    def close(self):
+        self.closed_by_reader = True
+        super().close()
+
+
+@pytest.mark.parametrize('start, stop', [
+    (0, len(TEXT)), (0, 0), (3, 9), (0, CHUNK_SIZE * 3), (CHUNK_SIZE - 1, CHUNK_SIZE + 2),
+])
+def test_read_range(start, stop):
+    data = bytes(range(256)) * (CHUNK_SIZE * 3 // 256)
+    f = ClosingBytesIO(data)
+    assert b''.join(read_range(f, start, stop)) == data[start:stop]
+    assert f.closed_by_reader
+
+
+# A file shorter than the range was truncated, the response can't be
+# completed
+def test_read_range_truncated():
+    f = ClosingBytesIO(b'0123456789')
+    with pytest.raises(EOFError):
+        b''.join(read_range(f, 4, 100))
+    assert f.closed_by_reader
+
+
+def test_read_range_truncated_while_read(tmp_path):
+    path = tmp_path / 'big.log'
+    path.write_bytes(b'x' * CHUNK_SIZE * 4)
+    chunks = read_range(open(path, 'rb'), 0, CHUNK_SIZE * 4)
+    assert next(chunks) == b'x' * CHUNK_SIZE
+    os.truncate(path, 10)
+    with pytest.raises(EOFError):
+        next(chunks)
+
+
+def test_read_range_closed_when_abandoned():
+    f = ClosingBytesIO(b'x' * CHUNK_SIZE * 2)
+    chunks = read_range(f, 0, CHUNK_SIZE * 2)
+    next(chunks)
+    chunks.close()
+    assert f.closed_by_reader
+
+
+def is_text(data):
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def test_align_text_every_range():
+    f = io.BytesIO(TEXT)
+    for start in range(len(TEXT) + 1):
+        for stop in range(start, len(TEXT) + 1):
+            aligned = align_text(f, start, stop)
+            first, last = aligned
+            assert start <= first <= last <= stop
+            assert is_text(TEXT[first:last]), (start, stop, aligned)
+            # Only the bytes of cut characters are left out
+            assert first - start < 4 and stop - last < 4
+
+
+def test_align_text_whole_characters_kept():
+    f = io.BytesIO(TEXT)
+    assert align_text(f, 0, len(TEXT)) == (0, len(TEXT))
+    # 'a' and the two bytes of e acute
+    assert align_text(f, 0, 3) == (0, 3)
+    # Starting in the middle of e acute, ending in the middle of the euro sign
+    assert align_text(f, 2, 5) == (3, 4)
+    # The four byte emoji cut after its second byte
+    assert align_text(f, 7, 10) == (7, 8)
+    assert align_text(f, 7, 12) == (7, 12)
+
+
+# Consecutive aligned ranges read every character exactly once
+def test_align_text_consecutive_ranges():
+    f = io.BytesIO(TEXT)
+    for size in range(1, 6):
+        start, parts = 0, []
+        while start < len(TEXT):
+            first, last = align_text(f, start, min(start + size + 3, len(TEXT)))
+            assert first == start
+            parts.append(TEXT[first:last])
+            start = last
+        assert b''.join(parts) == TEXT
+
+
+# Characters split across chunks are decoded whole
+def test_decode_text_replaces_invalid_sequences():
+    chunks = [TEXT[:2], TEXT[2:5], b'\xff', TEXT[5:7], TEXT[7:9], TEXT[9:], b'\xe2\x82']
+    assert b''.join(decode_text(chunks)).decode('utf-8') == \
+        b''.join(chunks).decode('utf-8', 'replace')
+    assert b''.join(decode_text([TEXT[:9], TEXT[9:]])) == TEXT
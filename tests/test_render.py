@@ -0,0 +1,54 @@
+import os
+import time
+import pytest
+from bbv.server.includes import compile_template
+from bbv.server.views import content_handler
+
+
+@pytest.fixture
+def handler(tmp_path):
+    handler = content_handler()
+    handler.workdir = str(tmp_path)
+    handler.environ = dict(os.environ)
+    return handler
+
+
+def render(handler, text):
+    return handler.render(compile_template(text))
+
+
+def test_blocks_in_document_order(handler):
+    assert render(handler, '<?include bash sleep 0.2; echo -n a?>-<?include bash echo -n b?>') == 'a-b'
+
+
+def test_blocks_run_concurrently(handler):
+    started = time.monotonic()
+    assert render(handler, '<?include bash sleep 0.5?>' * 4) == ''
+    assert time.monotonic() - started < 1.5
+
+
+# A serial block starts once the blocks before it are done, and the
+# blocks after it start once it is done
+def test_serial_blocks(handler):
+    text = ('<?include bash sleep 0.3; echo -n 1 > step?>'
+            '<?include bash[serial] cat step; echo -n 2 > step?>'
+            '<?include bash cat step?>')
+    assert render(handler, text) == '12'
+
+
+def test_blocks_run_in_the_workdir(handler, tmp_path):
+    assert render(handler, '<?include bash pwd?>') == '%s\n' % tmp_path
+
+
+def test_html_blocks(handler, tmp_path):
+    (tmp_path / 'part.html').write_text('<b><?include bash echo -n inner?></b>')
+    assert render(handler, '<?include html part.html?>') == '<b>inner</b>'
+
+
+def test_unknown_blocks_left_untouched(handler):
+    text = '<?include ruby puts 1?>'
+    assert render(handler, text) == text
+
+
+def test_block_timeout(handler):
+    assert 'timed out' in render(handler, '<?include bash[timeout=0.2] sleep 5?>')
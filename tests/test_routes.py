@@ -0,0 +1,57 @@
+from bbv.server import bbv2server, jobs, views
+from bbv.server.routes import RouteTable, table
+
+
+class Handler(object):
+    pass
+
+
+class Prefix(object):
+    pass
+
+
+class Longer(object):
+    pass
+
+
+class Fallback(object):
+    pass
+
+
+def test_route_table():
+    routes = RouteTable()
+    routes.route('/api/file')(Handler)
+    routes.route('/api', prefix=True, separators='/')(Prefix)
+    routes.route('/api/long', prefix=True)(Longer)
+    assert routes.match('/api/file') == (Handler, [])
+    assert routes.match('/api/file/more') == (Prefix, ['/file/more'])
+    assert routes.match('/api') == (Prefix, [''])
+    assert routes.match('/api/longer') == (Longer, ['er'])
+    assert routes.match('/apis') == (None, None)
+    assert routes.match('/other') == (None, None)
+
+    routes.route('', prefix=True)(Fallback)
+    assert routes.match('/apis') == (Fallback, ['/apis'])
+    assert routes.match('/api/x') == (Prefix, ['/x'])
+
+
+# Paths served by the server itself, and paths of app files that look
+# like them
+def test_jobs_routes():
+    assert table.match('/api/jobs') == (jobs.jobs_handler, [''])
+    assert table.match('/api/jobs/3f2a9c1b') == (jobs.jobs_handler, ['/3f2a9c1b'])
+    assert table.match('/api/jobs.html')[0] is views.default_handler
+    assert table.match('/jobs/index.html')[0] is views.default_handler
+    assert table.match('/jobs')[0] is views.default_handler
+
+
+def test_api_routes():
+    assert table.match('/api/file') == (bbv2server.FileHandler, [])
+    assert table.match('/api/batch')[0] is bbv2server.BatchHandler
+
+
+def test_events_routes():
+    assert table.match('/events$./install.sh') == (views.events_handler, ['$./install.sh'])
+    assert table.match('/events$') == (views.events_handler, ['$'])
+    assert table.match('/events/index.html')[0] is views.default_handler
+    assert table.match('/events.html')[0] is views.default_handler
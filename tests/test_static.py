@@ -0,0 +1,95 @@
+import os
+import pytest
+from bbv.server import bbv2server  # noqa: F401, registers the routes of the API
+from bbv.server.routes import Application, table
+from bbv.server.utils import parse_range
+
+DATA = bytes(range(256)) * 10
+
+
+@pytest.mark.parametrize('header, result', [
+    (None, None),
+    ('', None),
+    ('bytes=0-3', (0, 3)),
+    ('bytes=10-', (10, 2559)),
+    ('bytes=-5', (2555, 2559)),
+    ('bytes=-5000', (0, 2559)),
+    ('bytes=100-99999', (100, 2559)),
+    ('bytes = 1 - 2', (1, 2)),
+    ('bytes=2560-', False),
+    ('bytes=5-4', False),
+    ('bytes=-0', False),
+    ('bytes=-', None),
+    ('bytes=0-1,5-6', None),
+    ('items=0-1', None),
+])
+def test_parse_range(header, result):
+    assert parse_range(header, len(DATA)) == result
+
+
+def test_parse_range_empty_file():
+    assert parse_range('bytes=0-', 0) is False
+
+
+@pytest.fixture
+def request_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'blob.bin').write_bytes(DATA)
+    (tmp_path / 'page.html').write_text('<p>static page</p>')
+    app = Application(table)
+
+    def request(path, **headers):
+        return app.request(path, headers=headers, env={'REMOTE_ADDR': '127.0.0.1'})
+    return request
+
+
+def test_whole_file(request_file):
+    response = request_file('/blob.bin')
+    assert response.status.startswith('200')
+    assert response.data == DATA
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_range(request_file):
+    response = request_file('/blob.bin', Range='bytes=10-19')
+    assert response.status.startswith('206')
+    assert response.data == DATA[10:20]
+    assert response.headers['Content-Range'] == 'bytes 10-19/2560'
+
+
+def test_range_not_satisfiable(request_file):
+    response = request_file('/blob.bin', Range='bytes=5000-')
+    assert response.status.startswith('416')
+    assert response.headers['Content-Range'] == 'bytes */2560'
+
+
+# A range of another version of the file gets the whole current file
+def test_if_range(request_file):
+    etag = request_file('/blob.bin').headers['ETag']
+    response = request_file('/blob.bin', Range='bytes=0-3', If_Range=etag)
+    assert response.status.startswith('206')
+    response = request_file('/blob.bin', Range='bytes=0-3', If_Range='"old"')
+    assert response.status.startswith('200')
+    assert response.data == DATA
+
+
+@pytest.mark.parametrize('path', ['/blob.bin', '/page.html'])
+def test_not_modified(request_file, tmp_path, path):
+    etag = request_file(path).headers['ETag']
+    response = request_file(path, If_None_Match=etag)
+    assert response.status.startswith('304')
+    assert response.data == b''
+
+    stat = os.stat(tmp_path / path[1:])
+    os.utime(tmp_path / path[1:], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    response = request_file(path, If_None_Match=etag)
+    assert response.status.startswith('200')
+    assert response.headers['ETag'] != etag
+
+
+def test_pages_with_includes_have_no_validator(request_file, tmp_path):
+    (tmp_path / 'dynamic.html').write_text('<?include bash echo -n hi?>')
+    response = request_file('/dynamic.html')
+    assert response.data == b'hi'
+    assert 'ETag' not in response.headers
@@ -0,0 +1,51 @@
+import json
+import pytest
+from bbv import toolkit
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    return tmp_path / 'bigbashview' / 'toolkit.json'
+
+
+def test_cached_toolkit(cache):
+    assert toolkit.get_cached() is None
+    toolkit.set_cached('gtk')
+    assert json.loads(cache.read_text())['toolkit'] == 'gtk'
+    assert toolkit.get_cached() == 'gtk'
+    toolkit.clear_cached()
+    assert not cache.exists()
+    assert toolkit.get_cached() is None
+
+
+# Installing or removing packages makes the next launch look again
+def test_cache_invalidated_by_packages(cache, tmp_path, monkeypatch):
+    packages = tmp_path / 'site-packages'
+    packages.mkdir()
+    monkeypatch.setattr('sys.path', [str(packages)])
+    toolkit.set_cached('qt')
+    assert toolkit.get_cached() == 'qt'
+    (packages / 'PySide6').mkdir()
+    assert toolkit.get_cached() is None
+
+
+@pytest.mark.parametrize('data', ['', 'not json', '[]', '{"key": null}'])
+def test_invalid_cache(cache, data):
+    cache.parent.mkdir()
+    cache.write_text(data)
+    assert toolkit.get_cached() is None
+
+
+def test_unknown_toolkit_ignored(cache):
+    cache.parent.mkdir()
+    cache.write_text(json.dumps({'key': toolkit.get_cache_key(), 'toolkit': 'tk'}))
+    assert toolkit.get_cached() is None
+
+
+# Failing to write the cache is not an error
+def test_cache_not_writable(tmp_path, monkeypatch):
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'file'))
+    toolkit.set_cached('qt')
+    assert toolkit.get_cached() is None
@@ -0,0 +1,72 @@
+import time
+import pytest
+from bbv.server.workers import WorkerPool
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(1, 3)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def run(pool, command, variables={}, cwd=None):
+    def fallback():
+        yield b'fallback\n'
+        return -1
+
+    chunks = []
+    source = pool.run(command, variables, fallback, cwd)
+    while True:
+        try:
+            chunks.append(next(source))
+        except StopIteration as stop:
+            return b''.join(chunks), stop.value
+
+
+def test_output_and_status(pool, tmp_path):
+    assert run(pool, 'echo "$p_name"; pwd; exit 4', {'p_name': 'a b'}, str(tmp_path)) == \
+        (b'a b\n%s\n' % str(tmp_path).encode(), 4)
+
+
+# Each command runs in a subshell of the worker
+def test_nothing_leaks_into_the_next_command(pool, tmp_path):
+    run(pool, 'export LEAK=1; cd /; set -e', {'p_name': 'x'}, str(tmp_path))
+    assert run(pool, 'echo "${LEAK:-none} ${p_name:-none}"; pwd', {}, str(tmp_path)) == \
+        (b'none none\n%s\n' % str(tmp_path).encode(), 0)
+
+
+def test_same_worker_reused(pool):
+    first = run(pool, 'echo $$')[0]
+    assert run(pool, 'echo $$')[0] == first
+
+
+def test_worker_recycled(pool):
+    pids = {run(pool, 'echo $$')[0] for _ in range(3)}
+    assert len(pids) == 1
+    # The replacement is started on a thread
+    for _ in range(100):
+        if pool._idle:
+            break
+        time.sleep(0.05)
+    pids.add(run(pool, 'echo $$')[0])
+    assert len(pids) == 2
+
+
+@pytest.mark.parametrize('command, variables', [
+    ('echo \0', {}),
+    ('echo', {'bad-name': 'x'}),
+    ('echo', {'name': '\0'}),
+])
+def test_unsafe_commands_fall_back(pool, command, variables):
+    assert run(pool, command, variables) == (b'fallback\n', -1)
+
+
+def test_busy_pool_falls_back(pool):
+    source = pool.run('echo busy; sleep 5', {}, None, None)
+    assert next(source) == b'busy\n'
+    try:
+        assert run(pool, 'echo hi') == (b'fallback\n', -1)
+    finally:
+        source.close()